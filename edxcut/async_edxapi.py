@@ -0,0 +1,142 @@
+'''
+Concurrent interface to edx platform site, for fanning out many Studio and LMS calls
+from one process, using a single login and a single pool of HTTP connections.
+'''
+
+import threading
+
+from multiprocessing.pool import ThreadPool
+from edxapi import edXapi
+
+#-----------------------------------------------------------------------------
+
+class AsyncEdXapi(object):
+    '''
+    Asynchronous counterpart to edXapi.
+
+    Each of the ASYNC_METHODS (e.g. get_xblock, update_xblock, do_xblock_check_problem,
+    list_static_assets) takes the same arguments as the edXapi method of the same name, but
+    returns immediately, with an AsyncResult; call .get() on that to wait for the result
+    (exceptions raised by the call are re-raised by .get()).
+
+    Calls run on a bounded pool of worker threads.  Each worker uses its own clone of one
+    logged-in edXapi instance, so all workers share the session cookies, CSRF token, and
+    HTTP connection pool, but not the per-request headers.
+    '''
+    ASYNC_METHODS = [
+        # xblocks
+        'get_xblock', 'create_xblock', 'update_xblock', 'delete_xblock', 'list_xblocks',
+        'get_xblock_metadata', 'set_xblock_metadata', 'get_due_date', 'set_due_date',
+        'do_xblock_check_problem', 'do_xblock_get_problem', 'do_xblock_show_answer',
+        # outline
+        'get_outline', 'list_chapters', 'list_sequentials', 'list_verticals',
+        'get_chapter_by_name', 'get_sequential_by_name', 'get_vertical_by_name',
+        # static assets
+        'list_static_assets', 'get_static_asset_info', 'get_static_asset',
+        'upload_static_asset', 'delete_static_asset',
+        # instructor dashboard
+        'do_instructor_dashboard_action', 'get_basic_course_info', 'list_reports_for_download',
+        'list_instructor_tasks', 'enqueue_request_for_problem_responses', 'do_reset_student_attempts',
+    ]
+
+    def __init__(self, ea=None, max_concurrency=8, **kwargs):
+        '''
+        ea = (edXapi) existing, logged in, edXapi (or ccXapi) instance to use; if not provided,
+             then a new edXapi instance is created (and logged in), using kwargs, which take
+             the same names as the edXapi constructor arguments (base, username, password, ...)
+        max_concurrency = (int) maximum number of calls in flight at once
+        '''
+        self.ea = ea or edXapi(**kwargs)
+        self.max_concurrency = max_concurrency
+        self.ea.set_connection_pool_size(max_concurrency)
+        self.local = threading.local()
+        self.pool = ThreadPool(max_concurrency)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        '''
+        Wait for all pending calls to complete, and shut down the worker threads.
+        '''
+        self.pool.close()
+        self.pool.join()
+
+    def worker_ea(self):
+        '''
+        Return the edXapi clone for the current worker thread
+        '''
+        if not hasattr(self.local, 'ea'):
+            self.local.ea = self.ea.clone()
+        return self.local.ea
+
+    def submit(self, method, *args, **kwargs):
+        '''
+        Queue call of the named edXapi method, with the given args; return AsyncResult.
+        '''
+        def call():
+            return getattr(self.worker_ea(), method)(*args, **kwargs)
+        return self.pool.apply_async(call)
+
+    def map(self, method, arglist):
+        '''
+        Queue calls of the named edXapi method, one per entry of arglist.  Each entry may
+        be a dict (of keyword args), a tuple (of positional args), or a single positional arg.
+
+        Return list of AsyncResults, in the same order as arglist.
+        '''
+        results = []
+        for args in arglist:
+            if isinstance(args, dict):
+                results.append(self.submit(method, **args))
+            elif isinstance(args, tuple):
+                results.append(self.submit(method, *args))
+            else:
+                results.append(self.submit(method, args))
+        return results
+
+    @staticmethod
+    def gather(results, timeout=None):
+        '''
+        Wait for all of the given AsyncResults; return list of their values.
+        '''
+        return [x.get(timeout) for x in results]
+
+
+def _make_async_method(name):
+    def method(self, *args, **kwargs):
+        return self.submit(name, *args, **kwargs)
+    method.__name__ = name
+    method.__doc__ = "Asynchronous edXapi.%s: same arguments; returns AsyncResult" % name
+    return method
+
+for _name in AsyncEdXapi.ASYNC_METHODS:
+    setattr(AsyncEdXapi, _name, _make_async_method(_name))
+
+#-----------------------------------------------------------------------------
+# unit tests
+
+def test_async_xblocks():
+    cid = "course-v1:edX+DemoX+Demo_Course"
+    with AsyncEdXapi(base="http://192.168.33.10:18010", username="staff@example.com", password="edx",
+                     studio=True, course_id=cid, max_concurrency=4) as aea:
+        chapters = aea.list_chapters().get()
+        rets = aea.map('get_xblock', [{'usage_key': x['id']} for x in chapters['blocks']])
+        blocks = aea.gather(rets)
+        assert [x['id'] for x in blocks]==[x['id'] for x in chapters['blocks']]
+        assets = aea.list_static_assets().get()
+        assert len(assets) > 10
+
+def test_async_check_problem():
+    cid = "course-v1:edX+DemoX+Demo_Course"
+    aea = AsyncEdXapi(base="http://192.168.33.10", username="staff@example.com", password="edx",
+                      course_id=cid)
+    url_name = "75f9562c77bc4858b61f907bb810d974"
+    ret1 = aea.do_xblock_check_problem(url_name, ['3.141', "4500", "5"])
+    ret2 = aea.do_xblock_get_problem(url_name)
+    assert ret1.get()['success']=="correct"
+    assert len(ret2.get()['html'])
+    aea.close()
@@ -0,0 +1,372 @@
+'''
+Benchmarks for edxcut client hot paths: command line startup, outline lookup, correctness
+extraction, SRT generation, YAML test set loading, and end-to-end run_all_tests, all without network
+access (using the local fake edX site in fake_edx.py).
+
+Run with "edxcut benchmark"; results can be saved as JSON, and are compared with a baseline,
+by default the one committed as benchmarks_baseline.json (next to this file).
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+
+from StringIO import StringIO
+from contextlib import contextmanager
+
+import fake_edx
+
+from file_utils import atomic_write
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks_baseline.json")
+
+#-----------------------------------------------------------------------------
+
+@contextmanager
+def quiet():
+    '''
+    Discard output to stdout (e.g. test progress lines) within the body
+    '''
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        yield
+    finally:
+        sys.stdout = stdout
+
+class BenchmarkSuite(object):
+    '''
+    Set of benchmarks, each timed over repeat runs.  Sizes of the synthetic inputs are
+    multiplied by scale (e.g. use a small scale for a quick check that the suite works).
+
+    Each benchmark is a method bench_<name>, which does any setup, and returns (func, n),
+    where func is the function to time, and n the number of operations it does per run.
+    '''
+    BENCHMARKS = ['cli_startup', 'outline_lookup', 'outline_lookup_cached', 'correctness_extraction',
+                  'correctness_extraction_offset1', 'srt_generation',
+                  'yaml_loading', 'run_all_tests', 'run_all_tests_offset1', 'run_all_tests_incremental']
+
+    def __init__(self, scale=1.0, repeat=3, verbose=False):
+        self.scale = scale
+        self.repeat = repeat
+        self.verbose = verbose
+        self.servers = []
+        self.tmpdir = tempfile.mkdtemp(prefix="edxcut_bench_")
+
+    def size(self, n):
+        return max(1, int(n * self.scale))
+
+    def start_server(self, course, **kwargs):
+        srv = fake_edx.FakeEdxServer([course], **kwargs).start()
+        self.servers.append(srv)
+        return srv
+
+    def api(self, srv, studio=True, **kwargs):
+        from edxapi import edXapi
+        with quiet():
+            return edXapi(srv.base_url, "staff@example.com", "edx", srv.courses.keys()[0], studio=studio, **kwargs)
+
+    def close(self):
+        for srv in self.servers:
+            srv.stop()
+        self.servers = []
+        shutil.rmtree(self.tmpdir, True)
+
+    #-----------------------------------------------------------------------------
+    # benchmarks
+
+    def bench_cli_startup(self):
+        import subprocess
+        cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py"), "edxapi", "-h"]
+        nruns = 5
+
+        def run():
+            with open(os.devnull, 'w') as devnull:
+                for k in range(nruns):
+                    subprocess.check_call(cmd, stdout=devnull)
+        return run, nruns
+
+    def outline_paths(self, outline, nmax):
+        '''
+        Return up to nmax [chapter, sequential, vertical] display name paths, the last vertical of
+        each sequential first (these take the longest to find by name)
+        '''
+        paths = []
+        for chapter in outline['child_info']['children']:
+            for seq in chapter['child_info']['children']:
+                vert = seq['child_info']['children'][-1]
+                paths.append([chapter['display_name'], seq['display_name'], vert['display_name']])
+        return paths[:nmax]
+
+    def bench_outline_lookup(self):
+        size = self.size(10)
+        course = fake_edx.FakeCourse(chapters=size, sequentials=size, verticals=size, problems=size, assets=0)
+        ea = self.api(self.start_server(course))
+        outline = ea.get_outline()
+        paths = self.outline_paths(outline, 200)
+
+        def run():
+            for path in paths:
+                block = outline
+                for name, category in zip(path, ea.content_stages):
+                    block = ea._get_block_by_name_from_outline(block, name, category)
+        return run, len(paths)
+
+    def bench_outline_lookup_cached(self):
+        size = self.size(10)
+        course = fake_edx.FakeCourse(chapters=size, sequentials=size, verticals=size, problems=size, assets=0)
+        ea = self.api(self.start_server(course), outline_cache=True)
+        paths = self.outline_paths(ea.get_outline(), 200)
+
+        def run():
+            for path in paths:
+                ea._get_block_by_name_from_outline(path=path)
+        return run, len(paths)
+
+    def make_correctness_extraction(self, status_index_offset):
+        from lxml import etree
+        from course_unit_tester import CourseUnitTester
+        course = fake_edx.FakeCourse(chapters=1, sequentials=1, verticals=1, problems=1, boxes=self.size(40), assets=0,
+                                     status_index_offset=status_index_offset)
+        srv = self.start_server(course)
+        ea = self.api(srv, studio=False)
+        with quiet():
+            cut = CourseUnitTester(srv.base_url, "staff@example.com", "edx", course.course_id)
+        answers = course.answers("problem_1")
+        html = course.check_problem("problem_1", ea.make_response_dict("problem_1", answers).items())['contents']
+        nproblems = 20
+
+        def run():
+            for k in range(nproblems):
+                xml = etree.parse(StringIO(html), etree.HTMLParser())
+                correctness_list = cut.make_correctness_list_for_responses(ea, xml, "problem_1", answers)
+                assert correctness_list==["correct"] * len(answers)
+        return run, nproblems
+
+    def bench_correctness_extraction(self):
+        return self.make_correctness_extraction(2)
+
+    def bench_correctness_extraction_offset1(self):
+        return self.make_correctness_extraction(1)
+
+    def bench_srt_generation(self):
+        from edxapi import edXapi
+        n = self.size(5000)
+        sjson = {'start': [k * 2000 for k in range(n)],
+                 'end': [k * 2000 + 1900 for k in range(n)],
+                 'text': [u"Transcript line %d, with some words to show" % k for k in range(n)],
+                 }
+
+        def run():
+            edXapi.generate_srt_from_sjson(sjson)
+        return run, n
+
+    def bench_yaml_loading(self):
+        from course_tests import CourseUnitTestSet
+        ntests = self.size(5000)
+        size = self.size(10)
+        course = fake_edx.FakeCourse(chapters=size, sequentials=size, verticals=size, problems=size, assets=0)
+        fn = os.path.join(self.tmpdir, "yaml_loading.yaml")
+        fake_edx.make_test_file(course, fn, "http://localhost", "staff@example.com", "edx", max_problems=ntests / 2)
+
+        def run():
+            CourseUnitTestSet(fn, verbose=False)
+        return run, ntests
+
+    def make_run_all_tests(self, status_index_offset):
+        from course_unit_tester import CourseUnitTester
+        course = fake_edx.FakeCourse(chapters=2, sequentials=2, verticals=5, problems=self.size(5), assets=0,
+                                     status_index_offset=status_index_offset)
+        srv = self.start_server(course, latency=0.002)
+        fn = os.path.join(self.tmpdir, "run_all_tests_%d.yaml" % status_index_offset)
+        ntests = fake_edx.make_test_file(course, fn, srv.base_url, "staff@example.com", "edx")
+        with quiet():
+            cut = CourseUnitTester(cutfn=fn, jobs=8)
+
+        def run():
+            with quiet():
+                cut.run_all_tests()
+            assert cut.test_results['n_passed']==ntests
+        return run, ntests
+
+    def bench_run_all_tests(self):
+        return self.make_run_all_tests(2)
+
+    def bench_run_all_tests_offset1(self):
+        return self.make_run_all_tests(1)
+
+    def bench_run_all_tests_incremental(self):
+        from course_unit_tester import CourseUnitTester
+        course = fake_edx.FakeCourse(chapters=2, sequentials=2, verticals=5, problems=self.size(5), assets=0)
+        srv = self.start_server(course, latency=0.002)
+        fn = os.path.join(self.tmpdir, "run_all_tests_incremental.yaml")
+        ntests = fake_edx.make_test_file(course, fn, srv.base_url, "staff@example.com", "edx")
+        with quiet():
+            cut = CourseUnitTester(cutfn=fn, jobs=8, results_db=True, studio_base_url=srv.base_url)
+            cut.run_all_tests()					# stores the results, which later runs reuse
+
+        def run():
+            with quiet():
+                cut.run_all_tests()
+            assert cut.test_results['n_passed']==ntests and cut.test_results['n_cached']==ntests
+        return run, ntests
+
+    #-----------------------------------------------------------------------------
+
+    def time_benchmark(self, name):
+        func, n = getattr(self, "bench_%s" % name)()
+        times = []
+        for k in range(self.repeat):
+            t0 = time.time()
+            func()
+            times.append(time.time() - t0)
+        times.sort()
+        return {'n': n,
+                'repeat': self.repeat,
+                'min_sec': times[0],
+                'median_sec': times[len(times) / 2],
+                'mean_sec': sum(times) / len(times),
+                'usec_per_op': times[0] / n * 1e6,
+                }
+
+    def run(self, names=None):
+        '''
+        Run the named benchmarks (default all); returns results dict, with 'benchmarks'
+        giving the timings for each (by name)
+        '''
+        results = {'created': time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                   'python': platform.python_version(),
+                   'platform': platform.platform(),
+                   'scale': self.scale,
+                   'benchmarks': {},
+                   }
+        try:
+            for name in (names or self.BENCHMARKS):
+                if name not in self.BENCHMARKS:
+                    raise Exception("[benchmarks] unknown benchmark %s; known: %s" % (name, ", ".join(self.BENCHMARKS)))
+                result = self.time_benchmark(name)
+                results['benchmarks'][name] = result
+                if self.verbose:
+                    print "%-26s n=%-6d min=%8.4fs median=%8.4fs (%.1f usec/op)" % (name, result['n'], result['min_sec'],
+                                                                                   result['median_sec'], result['usec_per_op'])
+                    sys.stdout.flush()
+        finally:
+            self.close()
+        return results
+
+#-----------------------------------------------------------------------------
+
+def compare(results, baseline, tolerance=0.25):
+    '''
+    Compare benchmark results with baseline results (by minimum time).  A benchmark has
+    regressed if it is slower by more than the fraction tolerance, and improved if it is
+    faster by more than that.
+
+    Returns list of dicts (name, baseline_sec, sec, ratio, verdict), in benchmark order.
+    '''
+    rows = []
+    for name in BenchmarkSuite.BENCHMARKS:
+        if name not in results['benchmarks'] or name not in baseline.get('benchmarks', {}):
+            continue
+        now = results['benchmarks'][name]['min_sec']
+        base = baseline['benchmarks'][name]['min_sec']
+        ratio = now / base if base else None
+        if ratio is None:
+            verdict = "n/a"
+        elif ratio > 1 + tolerance:
+            verdict = "REGRESSION"
+        elif ratio < 1 / (1 + tolerance):
+            verdict = "improved"
+        else:
+            verdict = "ok"
+        rows.append({'name': name, 'baseline_sec': base, 'sec': now, 'ratio': ratio, 'verdict': verdict})
+    return rows
+
+def print_comparison(rows, baseline_fn):
+    print "Comparison with baseline %s:" % baseline_fn
+    for row in rows:
+        ratio = "%6.2fx" % row['ratio'] if row['ratio'] is not None else "   n/a"
+        print "    %-26s baseline=%8.4fs now=%8.4fs %s %s" % (row['name'], row['baseline_sec'], row['sec'], ratio, row['verdict'])
+
+def write_json(data, fn):
+    with atomic_write(fn) as fp:
+        fp.write(json.dumps(data, indent=4, sort_keys=True))
+
+#-----------------------------------------------------------------------------
+
+def CommandLine(args=None, arglist=None):
+    '''
+    Benchmark command line.  Exits with status 1 if any benchmark regressed, compared with the baseline.
+    '''
+    help_text = """usage: edxcut benchmark [benchmark names...] [options]
+
+Benchmarks: %s
+
+Results are compared with %s, unless another
+baseline is given.  Its timings were taken on one machine: on another, save a baseline first.
+
+Examples:
+
+edxcut benchmark
+edxcut benchmark --save-baseline bench_baseline.json
+edxcut benchmark --baseline bench_baseline.json -o bench_results.json
+""" % (", ".join(BenchmarkSuite.BENCHMARKS), DEFAULT_BASELINE)
+    parser = argparse.ArgumentParser(description=help_text, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("names", nargs='*', help="benchmarks to run (default all)")
+    parser.add_argument("-o", "--output-file", type=str, help="write results (JSON) to this file", default=None)
+    parser.add_argument("--baseline", type=str, help="compare results with this baseline results file (default %s)" % DEFAULT_BASELINE,
+                        default=DEFAULT_BASELINE)
+    parser.add_argument("--no-baseline", help="do not compare results with a baseline", action="store_true")
+    parser.add_argument("--save-baseline", type=str, help="write results to this file, as a new baseline", default=None)
+    parser.add_argument("--tolerance", type=float, help="fraction slower than baseline deemed a regression (default 0.25)", default=0.25)
+    parser.add_argument("--scale", type=float, help="multiply sizes of benchmark inputs by this (default 1)", default=1.0)
+    parser.add_argument("--repeat", type=int, help="number of timed runs of each benchmark (default 3)", default=3)
+
+    if not args:
+        args = parser.parse_args(arglist)
+
+    suite = BenchmarkSuite(scale=args.scale, repeat=args.repeat, verbose=True)
+    results = suite.run(args.names)
+    for fn in [args.output_file, args.save_baseline]:
+        if fn:
+            write_json(results, fn)
+            print "Wrote results to %s" % fn
+    if args.baseline and not args.no_baseline:
+        baseline = json.loads(open(args.baseline).read())
+        if not baseline.get('scale')==args.scale:
+            print "Not comparing with baseline %s, which was run with --scale %s" % (args.baseline, baseline.get('scale'))
+            return results
+        rows = compare(results, baseline, tolerance=args.tolerance)
+        results['comparison'] = rows
+        print_comparison(rows, args.baseline)
+        if args.output_file:
+            write_json(results, args.output_file)
+        if any([x['verdict']=="REGRESSION" for x in rows]):
+            sys.exit(1)
+    return results
+
+#-----------------------------------------------------------------------------
+# unit tests
+
+def test_default_baseline():
+    baseline = json.loads(open(DEFAULT_BASELINE).read())
+    assert sorted(baseline['benchmarks'].keys())==sorted(BenchmarkSuite.BENCHMARKS) and baseline['scale']==1.0
+    assert [x['verdict'] for x in compare(baseline, baseline)]==["ok"] * len(BenchmarkSuite.BENCHMARKS)
+
+def test_benchmarks_quick():
+    results = BenchmarkSuite(scale=0.3, repeat=1).run()
+    assert sorted(results['benchmarks'].keys())==sorted(BenchmarkSuite.BENCHMARKS)
+    assert all([x['min_sec'] > 0 for x in results['benchmarks'].values()])
+    rows = compare(results, results)
+    assert [x['verdict'] for x in rows]==["ok"] * len(BenchmarkSuite.BENCHMARKS)
+    slower = json.loads(json.dumps(results))
+    slower['benchmarks']['srt_generation']['min_sec'] *= 0.5
+    assert [x['verdict'] for x in compare(results, slower) if x['name']=='srt_generation']==["REGRESSION"]
+
+if __name__=="__main__":
+    CommandLine()
@@ -0,0 +1,277 @@
+'''
+Record and replay of the HTTP traffic of edXapi, so that runs can be repeated
+offline (e.g. for regression tests and benchmarks), without an edX server.
+'''
+
+import os
+import re
+import json
+import gzip
+import time
+import atexit
+import base64
+import hashlib
+import httplib
+import threading
+import requests
+
+from StringIO import StringIO
+from collections import defaultdict
+from requests.adapters import BaseAdapter, HTTPAdapter
+from urllib3.response import HTTPResponse
+from file_utils import atomic_write
+
+#-----------------------------------------------------------------------------
+
+class CassetteMiss(requests.exceptions.RequestException):
+    '''
+    Raised on replay, for a request which was not recorded
+    '''
+    pass
+
+SECRET_FIELDS = [re.compile(r'((?:^|&)[^=&]*password[^=&]*=)[^&]*', re.I),		# form encoded
+                 re.compile(r'("[^"]*password[^"]*"\s*:\s*)"(?:[^"\\]|\\.)*"', re.I)]	# JSON
+
+def body_digest(body):
+    '''
+    Digest of a request body, used to match requests on replay.  Only digests are kept in cassettes,
+    and the values of password fields (e.g. in the login POST) are left out of them, since a digest of
+    a weak password could be reversed by trying candidates.
+    '''
+    if body is None:
+        return None
+    if hasattr(body, 'read'):
+        return "stream"
+    if isinstance(body, unicode):
+        body = body.encode('utf8')
+    for pattern in SECRET_FIELDS:
+        body = pattern.sub(r'\1""', body)
+    return hashlib.sha1(body).hexdigest()
+
+#-----------------------------------------------------------------------------
+
+class RecordingAdapter(HTTPAdapter):
+    '''
+    requests transport adapter which makes real HTTP requests, and records each request and
+    response (status, headers, body, and time taken), to a cassette file (gzipped JSON lines).
+
+    The cassette is written by save(), which is also called at exit.  Response bodies are read
+    in full, to record them, so streamed downloads are buffered in memory while recording.
+    Cassettes contain session cookies (in Set-Cookie headers), so treat them as credentials.
+    '''
+    def __init__(self, fn, **kwargs):
+        super(RecordingAdapter, self).__init__(**kwargs)
+        self.fn = fn
+        self.records = []
+        self.lock = threading.Lock()
+        atexit.register(self.save)
+
+    def set_pool_size(self, size):
+        self._pool_maxsize = size
+        self.init_poolmanager(self._pool_connections, size, block=self._pool_block)
+
+    def send(self, request, **kwargs):
+        t0 = time.time()
+        ret = super(RecordingAdapter, self).send(request, **kwargs)
+        content = ret.content			# read whole body (it remains available to the caller)
+        elapsed = time.time() - t0
+        headers = ret.raw.headers
+        items = headers.iteritems() if hasattr(headers, 'iteritems') else headers.items()
+        record = {'method': request.method,
+                  'url': request.url,
+                  'body_digest': body_digest(request.body),
+                  'status': ret.status_code,
+                  'reason': ret.reason,
+                  'headers': [[k, v] for (k, v) in items if not k.lower() in ['content-encoding', 'transfer-encoding']],
+                  'elapsed': elapsed,
+                  }
+        try:
+            record['body'] = (content or '').decode('utf8')
+        except UnicodeDecodeError:
+            record['body_b64'] = base64.b64encode(content)
+        with self.lock:
+            self.records.append(record)
+        return ret
+
+    def save(self):
+        with self.lock:
+            if not self.records:
+                return
+            with atomic_write(self.fn) as rawfp:
+                fp = gzip.GzipFile(fileobj=rawfp, mode='wb')
+                for record in self.records:
+                    fp.write(json.dumps(record, separators=(',', ':')) + '\n')
+                fp.close()
+
+    def close(self):
+        self.save()
+        super(RecordingAdapter, self).close()
+
+#-----------------------------------------------------------------------------
+
+class RecordedMessage(object):
+    '''
+    Stand-in for the httplib response underlying a replayed response; requests reads
+    Set-Cookie headers from its msg.
+    '''
+    def __init__(self, msg):
+        self.msg = msg
+
+    def isclosed(self):
+        return True
+
+    def close(self):
+        pass
+
+class ReplayAdapter(BaseAdapter):
+    '''
+    requests transport adapter which answers requests from a recorded cassette, without any
+    network access.
+
+    Requests are matched by method, URL, and request body digest, falling back to method and
+    URL alone (e.g. for multipart uploads, whose boundaries differ each time).  Repeated
+    identical requests (e.g. status polls) get the recorded responses in order; once those
+    run out, the last one is repeated.  Unmatched requests raise CassetteMiss.
+
+    latency = None (no delay), "recorded" (sleep for the recorded time of each request,
+              times latency_scale), a number (fixed seconds per request), or a function
+              of (method, url) returning seconds
+    max_concurrency = (int) if given, model a server which handles at most this many
+                      requests at once (further requests queue for a free slot)
+    '''
+    def __init__(self, fn, latency=None, latency_scale=1.0, max_concurrency=None):
+        super(ReplayAdapter, self).__init__()
+        self.fn = fn
+        self.latency = latency
+        self.latency_scale = latency_scale
+        self.slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self.lock = threading.Lock()
+        self.by_body = defaultdict(list)
+        self.by_url = defaultdict(list)
+        self.used = defaultdict(int)
+        self.nreplayed = 0
+        fp = gzip.open(fn, 'rb')
+        for line in fp:
+            record = json.loads(line)
+            self.by_body[(record['method'], record['url'], record['body_digest'])].append(record)
+            self.by_url[(record['method'], record['url'])].append(record)
+        fp.close()
+
+    def set_pool_size(self, size):
+        pass
+
+    def find(self, request):
+        keys = [('body', (request.method, request.url, body_digest(request.body))),
+                ('url', (request.method, request.url))]
+        with self.lock:
+            for kind, key in keys:
+                records = (self.by_body if kind=='body' else self.by_url).get(key)
+                if records:
+                    k = self.used[(kind, key)]
+                    self.used[(kind, key)] = k + 1
+                    self.nreplayed += 1
+                    return records[min(k, len(records) - 1)]
+        raise CassetteMiss("[ReplayAdapter] no recorded response for %s %s in %s" % (request.method, request.url, self.fn))
+
+    def delay(self, request, record):
+        if self.latency is None:
+            return 0
+        if self.latency=="recorded":
+            return record.get('elapsed', 0) * self.latency_scale
+        if callable(self.latency):
+            return self.latency(request.method, request.url)
+        return float(self.latency)
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        record = self.find(request)
+        delay = self.delay(request, record)
+        if delay:
+            if self.slots:
+                with self.slots:
+                    time.sleep(delay)
+            else:
+                time.sleep(delay)
+        if 'body_b64' in record:
+            body = base64.b64decode(record['body_b64'])
+        else:
+            body = record['body'].encode('utf8')
+        hlines = ''.join(["%s: %s\r\n" % (k, v) for (k, v) in record['headers']])
+        original = RecordedMessage(httplib.HTTPMessage(StringIO(hlines + "\r\n")))	# for cookie extraction
+        raw = HTTPResponse(body=StringIO(body), headers=record['headers'], status=record['status'],
+                           reason=record.get('reason'), preload_content=False, decode_content=False,
+                           original_response=original)
+        return HTTPAdapter().build_response(request, raw)
+
+    def close(self):
+        pass
+
+#-----------------------------------------------------------------------------
+
+def make_transport(record=None, replay=None, latency=None, latency_scale=1.0, max_concurrency=None):
+    '''
+    Return a RecordingAdapter (if record is a cassette filename), or a ReplayAdapter (if
+    replay is a cassette filename), or None.  latency may be given as a string from the
+    command line, e.g. "recorded" or "0.05".
+    '''
+    if record and replay:
+        raise Exception("[cassette] cannot both record and replay")
+    if record:
+        return RecordingAdapter(record)
+    if replay:
+        if latency not in [None, "recorded"] and not callable(latency):
+            latency = float(latency)
+        return ReplayAdapter(replay, latency=latency, latency_scale=latency_scale, max_concurrency=max_concurrency)
+    return None
+
+#-----------------------------------------------------------------------------
+# unit tests
+
+def test_body_digest():
+    assert body_digest("email=a%40b.org&password=edx")==body_digest("email=a%40b.org&password=secret")
+    assert not body_digest("email=a%40b.org&password=edx")==body_digest("email=c%40b.org&password=edx")
+    assert body_digest("email=a&password=edx")==hashlib.sha1('email=a&password=""').hexdigest()
+    assert body_digest('{"new_password": "x\\"y", "n": 1}')==body_digest('{"new_password": "z", "n": 1}')
+    assert not body_digest("data=1")==body_digest("data=2")
+
+def test_record_replay():
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    counter = {'n': 0}
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+        def do_GET(self):
+            counter['n'] += 1
+            self.send_response(200)
+            self.send_header('Set-Cookie', 'csrftoken=tok%d; Path=/' % counter['n'])
+            self.send_header('Set-Cookie', 'other=x; Path=/')
+            body = "\x89PNG\xff" if self.path=='/bin' else "poll %d" % counter['n']
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+    srv = HTTPServer(('127.0.0.1', 0), Handler)
+    base = "http://127.0.0.1:%d" % srv.server_address[1]
+    fn = "/tmp/edxcut_tmp_cassette.jsonl.gz"
+
+    ses = requests.Session()
+    ses.mount('http://', RecordingAdapter(fn))
+    for path in ['/poll', '/poll', '/bin']:
+        thr = threading.Thread(target=srv.handle_request)
+        thr.start()
+        ses.get(base + path)
+        thr.join()
+    ses.close()
+    srv.server_close()
+
+    ses = requests.Session()
+    ses.mount('http://', ReplayAdapter(fn, latency=0.01))
+    ret = ses.get(base + '/poll')
+    assert ret.text=="poll 1"
+    assert ses.cookies['csrftoken']=="tok1" and ses.cookies['other']=="x"
+    assert ses.get(base + '/poll').text=="poll 2"
+    assert ses.get(base + '/poll').text=="poll 2"		# last response repeats
+    assert ses.get(base + '/bin', stream=True).raw.read()=="\x89PNG\xff"
+    try:
+        ses.get(base + '/missing')
+        assert False
+    except CassetteMiss:
+        pass
@@ -1,5 +1,4 @@
 from edxapi import edXapi
-from lxml import etree
 
 class ccXapi(edXapi):
     '''
@@ -23,7 +22,7 @@ class ccXapi(edXapi):
 
     def get_ccx_dashboard_csrf(self):
         url = self.ccx_dashboard_url
-        ret = self.ses.get(url)
+        ret = self.request('GET', url)
         domain = self.BASE.rsplit("//", 1)[-1]
         csrf = self.ses.cookies.get('csrftoken', domain=domain)
         return csrf
@@ -38,9 +37,9 @@ class ccXapi(edXapi):
                    'Referer': self.ccx_dashboard_url}
         data = data or {}
         self.headers['Referer'] = url
-        ret = self.ses.post(url, data=data, headers=self.headers)
-        if not ret.status_code==200:
-            ret = self.ses.get(url, params=data, headers=self.headers)
+        ret = self.request('POST', url, data=data, headers=self.headers)
+        if not (ret.status_code==200 or ret.status_code in self.dispatcher.retry_statuses):
+            ret = self.request('GET', url, params=data, headers=self.headers)
         if self.verbose:
             print "[edxapi] do_ccx_dashboard_action url=%s, return=%s" % (url, ret)
         return ret
@@ -77,11 +76,13 @@ class ccXapi(edXapi):
         List students enrolled in CCX (provided by HTML in CCX coach dashboard - not a nice api)
         '''
         url = self.ccx_dashboard_url
-        ret = self.ses.get(url, headers=self.headers)
+        ret = self.request('GET', url, headers=self.headers)
         open("data.html", 'w').write(ret.content)
 
-        parser = etree.HTMLParser()
-        xml = etree.fromstring(ret.content, parser=parser)
+        from lxml import etree
+        with self.metrics.phase('parse:ccx_list_students'):
+            parser = etree.HTMLParser()
+            xml = etree.fromstring(ret.content, parser=parser)
         # <div class="member-list-widget">
         mlist = xml.find('.//div[@class="member-list-widget"]')
         data = []
@@ -0,0 +1,27 @@
+'''
+pytest fixtures for the edxcut unit tests (kept here, so that the edxcut modules do not
+need pytest, which is slow to import, except when running tests).
+'''
+
+import pytest
+
+@pytest.fixture(scope="module")
+def eapi():
+    from edxapi import edXapi
+    course_id = "course-v1:edX+DemoX+Demo_Course"
+    ea = edXapi("http://192.168.33.10:18000", "staff@example.com", "edx", course_id=course_id)
+    return ea
+
+@pytest.fixture(scope="module")
+def eapi_studio():
+    from edxapi import edXapi
+    cid = "course-v1:edX+DemoX+Demo_Course"
+    ea = edXapi("http://192.168.33.10:18010", "staff@example.com", "edx", studio=True, course_id=cid)
+    return ea
+
+@pytest.fixture(scope="module")
+def cut_test_fixture():
+    from course_unit_tester import CourseUnitTester
+    course_id = "course-v1:edX+DemoX+Demo_Course"
+    cut = CourseUnitTester("http://192.168.33.10", "staff@example.com", "edx", course_id)
+    return cut
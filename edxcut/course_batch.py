@@ -0,0 +1,181 @@
+'''
+Export (download) and import (upload) of many courses at once, via edX Studio,
+using a single login, with a manifest recording the outcome for each course.
+'''
+
+import os
+import re
+import sys
+import json
+import time
+import threading
+import traceback
+
+from file_utils import atomic_write
+
+#-----------------------------------------------------------------------------
+
+class CourseBatch(object):
+    '''
+    Run course tarball downloads or uploads for many courses concurrently.
+
+    All workers share one logged-in (Studio) edXapi session.  The number of Studio export
+    jobs in flight at once is capped separately from the number of workers, since exports
+    load the Studio server far more than downloads of finished tarballs.
+
+    A manifest (JSON) with the status and timing of each course is written after each
+    course finishes, so that failed courses can be retried on their own.
+    '''
+    def __init__(self, ea, jobs=4, max_exports=2, manifest_fn=None, deadline=600, verbose=False):
+        '''
+        ea = logged in edXapi instance for the Studio site
+        jobs = (int) number of courses to process concurrently
+        max_exports = (int) maximum number of Studio course exports in progress at once
+        manifest_fn = (string) filename for the manifest (defaults to batch_manifest.json in ea.data_dir)
+        deadline = (float) seconds to wait for each course export or import to finish
+        '''
+        self.ea = ea
+        self.jobs = jobs
+        self.max_exports = max_exports
+        self.manifest_fn = manifest_fn or os.path.join(ea.data_dir, "batch_manifest.json")
+        self.deadline = deadline
+        self.verbose = verbose
+        self.export_slots = threading.BoundedSemaphore(max_exports)
+        self.lock = threading.Lock()
+        self.manifest = None
+
+    @staticmethod
+    def course_id_from_tarball_name(tfn):
+        '''
+        Return course_id for a tarball named as by edXapi.download_course_tarball, e.g.
+        COURSE-course-v1:edX+DemoX+Demo_Course___Fri_Jun_23_101522_2017.tar.gz
+        '''
+        m = re.match('COURSE-(.*?)(___.*)?\.tar\.gz$', os.path.basename(tfn))
+        if not m:
+            raise Exception("[CourseBatch] cannot determine course_id from tarball filename %s" % tfn)
+        return m.group(1).replace('__', '/')
+
+    @staticmethod
+    def failed_course_ids(manifest_fn):
+        '''
+        Return list of course_ids which did not succeed, according to the given manifest file.
+        '''
+        manifest = json.loads(open(manifest_fn).read())
+        return [cid for cid, info in manifest['courses'].items() if not info['status']=="ok"]
+
+    def new_manifest(self, action, course_ids):
+        self.manifest = {'action': action,
+                         'site': self.ea.BASE,
+                         'started': time.strftime("%Y-%m-%dT%H:%M:%S"),
+                         'courses': {cid: {'status': 'pending'} for cid in course_ids},
+                         'n_ok': 0,
+                         'n_failed': 0,
+                         }
+        self.ea.ensure_data_dir_exists()
+        self.save_manifest()
+
+    def save_manifest(self):
+        with atomic_write(self.manifest_fn) as fp:
+            fp.write(json.dumps(self.manifest, indent=4, sort_keys=True))
+
+    def record(self, course_id, **info):
+        with self.lock:
+            self.manifest['courses'][course_id] = info
+            self.manifest['n_ok'] = len([x for x in self.manifest['courses'].values() if x['status']=="ok"])
+            self.manifest['n_failed'] = len([x for x in self.manifest['courses'].values() if x['status']=="failed"])
+            self.save_manifest()
+        if info['status']=="ok":
+            print "[CourseBatch] %s: done in %.1f sec" % (course_id, info['elapsed'])
+        else:
+            print "[CourseBatch] %s: FAILED after %.1f sec, err=%s" % (course_id, info['elapsed'], info['error'])
+        sys.stdout.flush()
+
+    def run(self, action, items):
+        '''
+        Run action(ea, item) -> (course_id, info dict) for each item, concurrently; return manifest
+        '''
+        def run_one(ea, item):
+            t0 = time.time()
+            course_id = item[0]
+            ea.set_course_id(course_id)
+            try:
+                info = action(ea, *item)
+                info['status'] = "ok"
+            except Exception as err:
+                if self.verbose:
+                    traceback.print_exc()
+                info = {'status': "failed", 'error': str(err)}
+            info['elapsed'] = time.time() - t0
+            self.record(course_id, **info)
+            return info
+        list(self.ea.imap_concurrent(run_one, items, max_workers=self.jobs))
+        self.manifest['finished'] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        self.save_manifest()
+        print "[CourseBatch] %s of %d courses succeeded, %s failed; manifest in %s" % (self.manifest['n_ok'],
+                                                                                       len(items),
+                                                                                       self.manifest['n_failed'],
+                                                                                       self.manifest_fn)
+        return self.manifest
+
+    def download_courses(self, course_ids=None):
+        '''
+        Download tarballs of the specified courses (defaults to all courses listed in Studio),
+        into ea.data_dir.  Returns manifest.
+        '''
+        if course_ids is None:
+            course_ids = self.ea.list_courses()['course_ids']
+        self.new_manifest('download', course_ids)
+
+        def download(ea, course_id):
+            t0 = time.time()
+            with self.export_slots:
+                status = ea.start_course_export()
+                eo = ea.wait_for_course_export(status, deadline=self.deadline)
+            t1 = time.time()
+            ofn = ea.download_course_export(eo)
+            if not ofn:
+                raise Exception("download of course export from %s failed" % eo)
+            return {'file': ofn,
+                    'size': os.path.getsize(ofn),
+                    'export_time': t1 - t0,
+                    'download_time': time.time() - t1,
+                    }
+        return self.run(download, [(cid,) for cid in course_ids])
+
+    def upload_courses(self, tarballs):
+        '''
+        Upload course tarballs, each to the course given by its filename (as produced by
+        download_courses), or specified explicitly, if tarballs is a dict of course_id: filename.
+        Returns manifest.
+        '''
+        if not isinstance(tarballs, dict):
+            tarballs = {self.course_id_from_tarball_name(tfn): tfn for tfn in tarballs}
+        self.new_manifest('upload', tarballs.keys())
+
+        def upload(ea, course_id, tfn):
+            ret = ea.import_course_tarball(tfn, deadline=self.deadline)
+            if not ret['ok']:
+                raise Exception("import of %s did not complete, stages=%s" % (tfn, [x['stage'] for x in ret['stages']]))
+            return {'file': tfn,
+                    'size': os.path.getsize(tfn),
+                    'stages': ret['stages'],
+                    }
+        return self.run(upload, tarballs.items())
+
+#-----------------------------------------------------------------------------
+# unit tests
+
+def test_course_id_from_tarball_name():
+    tfn = "DATA/COURSE-course-v1:edX+DemoX+Demo_Course___Fri_Jun_23_101522_2017.tar.gz"
+    assert CourseBatch.course_id_from_tarball_name(tfn)=="course-v1:edX+DemoX+Demo_Course"
+    tfn = "COURSE-MITx__8.01x__2013_SOND___Fri_Jun_23_101522_2017.tar.gz"
+    assert CourseBatch.course_id_from_tarball_name(tfn)=="MITx/8.01x/2013_SOND"
+    assert CourseBatch.course_id_from_tarball_name("COURSE-course-v1:a+b+c.tar.gz")=="course-v1:a+b+c"
+
+def test_download_courses():
+    from edxapi import edXapi
+    ea = edXapi("http://192.168.33.10:18010", "staff@example.com", "edx", studio=True, data_dir="/tmp/edxcut_batch")
+    cb = CourseBatch(ea, jobs=2, max_exports=1)
+    manifest = cb.download_courses(["course-v1:edX+DemoX+Demo_Course"])
+    assert manifest['n_ok']==1
+    assert CourseBatch.failed_course_ids(cb.manifest_fn)==[]
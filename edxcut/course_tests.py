@@ -5,6 +5,7 @@ representation of a full set of such tests for a course.
 
 import yaml
 import os
+import hashlib
 
 class AnswerBoxUnitTest(object):
     '''
@@ -33,6 +34,7 @@ class AnswerBoxUnitTest(object):
         self.responses = []
         self.expected = []
         self.name = test_name
+        self.index = None			# position in the test file, if loaded from one
         self.box_indexes = []
         if test_spec:
             for field in self.SPEC_FIELDS:
@@ -86,6 +88,39 @@ class AnswerBoxUnitTest(object):
                                       box_indexes=both_indexes,
                                       name=both_name))
 
+    @property
+    def answer_boxes(self):
+        '''
+        Return set of the <x> indexes of the answer boxes this test submits responses to
+        '''
+        return set([x for (x, y) in self.box_indexes])
+
+    def can_combine(self, other):
+        '''
+        Return True if this test and other can be submitted together, in one problem check, and their
+        results told apart: they must be for the same problem, submit to disjoint sets of answer boxes,
+        and expect a list of per-box correctness values (not an overall outcome, nor an error, both of
+        which depend on the whole submission).
+        '''
+        for test in [self, other]:
+            if not isinstance(test.expected, list) or "error" in test.expected:
+                return False
+        return self.url_name==other.url_name and not (self.answer_boxes & other.answer_boxes)
+
+    def combine(self, other):
+        '''
+        Return test which submits the responses of this test and other together, each to its own answer
+        boxes.  Unlike __add__, the box indexes of other are kept as they are, not shifted: those of tests
+        in a test file are already the actual boxes they submit to.  See can_combine.
+        '''
+        if not self.can_combine(other):
+            raise Exception("[AnswerBoxUnitTest] cannot combine %s with %s" % (self, other))
+        return AnswerBoxUnitTest(dict(url_name=self.url_name,
+                                      responses=self.responses + other.responses,
+                                      expected=self.expected + other.expected,
+                                      box_indexes=self.box_indexes + other.box_indexes,
+                                      name="combination of %s and %s" % (str(self.name), str(other.name))))
+
     def as_dict(self):
         '''
         Return dict representation of this AnswerBoxUnitTest object
@@ -107,6 +142,8 @@ class CourseUnitTestSet(object):
         '''
         self.config = {}
         self.tests = []
+        self.ntests = 0
+        self.shard_spec = None
         self.verbose = verbose
         if fn or yaml_string:
             self.load_tests_from_file(fn=fn, yaml_string=yaml_string)
@@ -125,6 +162,53 @@ class CourseUnitTestSet(object):
         if not isinstance(test, AnswerBoxUnitTest):
             raise Exception("[CourseUnitTestSet] add_test: test must be an instance of AnswerBoxUnitTest")
         self.tests.append(test)
+        self.ntests = len(self.tests)
+
+    @staticmethod
+    def shard_of(url_name, nshards):
+        '''
+        Return the shard number (1 to nshards) for tests of the problem url_name.  All the tests of
+        a problem are in the same shard, since they share student state (and attempt resets).
+        '''
+        return int(hashlib.md5(url_name).hexdigest()[:8], 16) % nshards + 1
+
+    def shard(self, ishard, nshards):
+        '''
+        Return a new CourseUnitTestSet, with the same config, and the tests (in file order) which are
+        in shard number ishard (1 to nshards) of nshards, as determined by a hash of their url_name.
+        '''
+        if not 1 <= ishard <= nshards:
+            raise Exception("[CourseUnitTestSet] illegal shard %s/%s -- must be i/N with 1 <= i <= N" % (ishard, nshards))
+        cutset = CourseUnitTestSet(verbose=self.verbose)
+        cutset.config = self.config
+        cutset.shard_spec = (ishard, nshards)
+        cutset.add_tests([x for x in self.tests if self.shard_of(x.url_name, nshards)==ishard])
+        if self.verbose:
+            print "[CourseUnitTestSet] Shard %d/%d has %d of %d tests" % (ishard, nshards, cutset.ntests, self.ntests)
+        return cutset
+
+    @staticmethod
+    def combine_tests(tests):
+        '''
+        Combine tests (list of AnswerBoxUnitTest) which can be submitted together (see AnswerBoxUnitTest.can_combine),
+        each test being combined with the earliest combination for its problem that it can join.
+
+        Returns list of (test, members) pairs, where test is the combined test, and members the list of
+        indexes (in tests) of the tests combined into it, in order of their first member.
+        '''
+        combinations = []
+        by_url_name = {}
+        for idx, test in enumerate(tests):
+            for combination in by_url_name.get(test.url_name, []):
+                if combination[0].can_combine(test):
+                    combination[0] = combination[0].combine(test)
+                    combination[1].append(idx)
+                    break
+            else:
+                combination = [test, [idx]]
+                combinations.append(combination)
+                by_url_name.setdefault(test.url_name, []).append(combination)
+        return [tuple(x) for x in combinations]
 
     def output_to_file(self, ofn):
         '''
@@ -149,6 +233,7 @@ class CourseUnitTestSet(object):
         for test in cut_specs.get('tests', []):
             cnt += 1
             abutest = AnswerBoxUnitTest(test, cnt)
+            abutest.index = cnt - 1
             self.tests.append(abutest)
         self.ntests = len(self.tests)
         if self.verbose:
@@ -165,6 +250,22 @@ def test_abut1():
     assert abut3.expected==["correct", "incorrect"]
     assert abut3.responses==["1", "2"]
 
+def test_combine_tests():
+    tests = [AnswerBoxUnitTest(dict(responses=["1"], expected=["correct"], url_name="x")),
+             AnswerBoxUnitTest(dict(responses=["2"], expected=["incorrect"], url_name="x")),
+             AnswerBoxUnitTest(dict(responses=["3"], expected=["correct"], url_name="x", box_indexes=[[1, 0]])),
+             AnswerBoxUnitTest(dict(responses=["4", "5"], expected=["correct", "correct"], url_name="x",
+                                    box_indexes=[(2, 0), (2, 1)])),
+             AnswerBoxUnitTest(dict(responses=["6"], expected="correct", url_name="x", box_indexes=[(3, 0)])),
+             AnswerBoxUnitTest(dict(responses=["7"], expected=["correct"], url_name="y", box_indexes=[(1, 0)])),
+             AnswerBoxUnitTest(dict(responses=["8"], expected=["incorrect"], url_name="x", box_indexes=[(1, 0)])),
+             ]
+    combined = CourseUnitTestSet.combine_tests(tests)
+    assert [x[1] for x in combined]==[[0, 2, 3], [1, 6], [4], [5]]
+    assert combined[0][0].box_indexes==[(0, 0), [1, 0], (2, 0), (2, 1)]
+    assert combined[0][0].responses==["1", "3", "4", "5"]
+    assert combined[1][0].expected==["incorrect", "incorrect"]
+
 def test_cutset1():
     yaml = """config: {a: 2}
 tests:
@@ -204,4 +305,16 @@ tests:
     assert cutset2.tests[0].responses==['red']
     assert cutset2.tests[0].url_name=="a_problem"
 
+def test_cutset_shards():
+    cutset = CourseUnitTestSet(verbose=False)
+    for k in range(60):
+        test = AnswerBoxUnitTest(dict(responses=[str(k)], expected="correct", url_name="p%d" % (k / 3)))
+        test.index = k
+        cutset.add_test(test)
+    shards = [cutset.shard(i, 4) for i in range(1, 5)]
+    assert sorted([x.index for s in shards for x in s.tests])==range(60)
+    for s in shards:
+        assert [x.index for x in s.tests]==sorted([x.index for x in s.tests])	# file order
+        assert not set([x.url_name for x in s.tests]) & set([x.url_name for t in shards if not t is s for x in t.tests])
+
     
@@ -5,47 +5,165 @@ Checks to ensure responses to problems are graded with expected correctness.
 
 import os
 import sys
-import pytest
+import json
+import hashlib
+import threading
 
 from lxml import etree
 from StringIO import StringIO
+from collections import OrderedDict
 
 import course_tests
-reload(course_tests)
 
 AnswerBoxUnitTest = course_tests.AnswerBoxUnitTest
 CourseUnitTestSet = course_tests.CourseUnitTestSet
 
 import edxapi
-reload(edxapi)
+
+from site_profile import SiteProfile
+from results_db import ResultsDB, fingerprint
 
 edXapi = edxapi.edXapi
 
+class StatusNotFound(Exception):
+    pass
+
+class StatusIndex(object):
+    '''
+    Index of the elements of a problem's content XML (as returned by the grader) which may give
+    the status (correctness) of answer boxes: div, span, and label elements by id, and label
+    elements by their for attribute.  Built in one pass over the tree, so that the status of
+    each answer box is then found without further scans.
+    '''
+    def __init__(self, xml):
+        self.xml = xml
+        self.by_id = {}
+        self.label_by_for = {}
+        for elem in xml.iter('div', 'span', 'label'):
+            eid = elem.get('id')
+            if eid:
+                self.by_id.setdefault((elem.tag, eid), elem)		# first in document order, as for find()
+            if elem.tag=='label' and elem.get('for'):
+                self.label_by_for.setdefault(elem.get('for'), elem)
+
+    def find_status(self, status_name, response):
+        '''
+        Return (element, name) for the status of the answer box with status_name (status_<url_name>_<x>_<y>),
+        given the response submitted to it; element is None if not found.
+        '''
+        sx = self.by_id.get(('div', status_name))			# text line input problems
+        if sx is None:
+            sx = self.by_id.get(('span', status_name))		# multiple choice problems, unanswered
+        if sx is not None:
+            return sx, status_name
+        # <label for="input_a0effb954cca4759994f1ac9e9434bf4_3_1_choice_2" class="choicegroup_correct">
+        name = "input_%s_%s" % (status_name[7:], response)
+        sx = self.label_by_for.get(name)				# multiple choice problems
+        if sx is not None:
+            return sx, name
+        # <label id="URL_NAME_2_1-choice_5-label" class="response-label field-label label-inline choicegroup_correct">
+        name = "%s-%s-label" % (status_name[7:], response)
+        return self.by_id.get(('label', name)), name		# multiple choice problems
+
 class CourseUnitTester(object):
     '''
     Unit tester for edX courses.
     Checks to ensure responses to problems are graded with expected correctness.
     '''
-    def __init__(self, site_base_url=None, username=None, password=None, course_id=None, verbose=False, cutfn=None):
+    STATUS_INDEX_OFFSETS = [(2, 1), (1, 1)]	# (x, y) offsets for status element ids, tried in this order
+
+    def __init__(self, site_base_url=None, username=None, password=None, course_id=None, verbose=False, cutfn=None,
+                 jobs=None, session_cache=None, metrics=None, transport=None, site_profile=None, results_db=None,
+                 studio_base_url=None, shard=None, combine_tests=None):
         '''
         course_id should be a fully-formed course-v1 or slash separated course id, as appropriate.
 
         cutfn = course unit test file (yaml format); specifies unit tests to perform; may include site_base_url,
-                username, password, course_id.
+                username, password, course_id, jobs.
+        jobs = (int) number of tests to run concurrently (default 1)
+        session_cache = (string or True) reuse stored login session (see edXapi)
+        metrics = (Metrics) collector for request and parse timings (see edXapi)
+        transport = (requests adapter) for recording or replaying HTTP traffic (see edXapi)
+        site_profile = (string or True) if provided, keep the status index offsets learned for the site in a
+                       site profile, in this directory (or in ~/.edxcut/sites, if True), for later runs (see SiteProfile)
+        results_db = (string or True) if provided, run tests incrementally: keep test results in this file (or, if True,
+                     in <cutfn base>.results.json), and only re-run tests whose problem content (from Studio), grader
+                     library (the grader_library static asset, default python_lib.zip), or definition have changed
+                     since they were last run (see ResultsDB)
+        studio_base_url = (string) base url for the course's Studio site, e.g. http://192.168.33.10:18010; needed for
+                          incremental runs; may also be given in the cut file config
+        shard = (tuple of ints) (i, N), to run only the tests in shard i (1 to N) of N, chosen by a hash of their
+                url_name (so all the tests of a problem are in the same shard).  If the cut file config has
+                shard_accounts (a list of dicts with username and password), and no username is given, shard i
+                is run with account i (cycling through the list), e.g. to spread shards over several staff accounts.
+        combine_tests = (bool) if True, tests of the same problem which submit to different answer boxes, and expect
+                        per-box correctness lists, are submitted together, in one problem check, whose correctness
+                        list is then split into the results of each test (see CourseUnitTestSet.combine_tests);
+                        may also be given in the cut file config
+
+        The (x, y) index offsets of the status element ids in problem content (which differ between edX platform
+        versions) are learned from the first problem whose correctness is extracted, and used first for the rest.
+        They may also be given in the cut file config, as status_index_offsets: [x, y], and, for problems which
+        differ from the rest, as problem_index_offsets: {url_name: [x, y]}.
         '''
         self.verbose = verbose
         self.cut_specs = None
+        self.jobs = 1
+        self.status_index_offsets = None
+        self.problem_index_offsets = {}
+        self.offsets_lock = threading.Lock()
+        self.studio_base_url = None
+        self.grader_library = "python_lib.zip"
+        self.shard_accounts = None
+        self.combine_tests = False
+        self.cutfn = cutfn
+        self.test_records = []
         if cutfn:
             self.load_cut_file(cutfn)
+        if shard:
+            self.cutset = self.cutset.shard(*shard)
+            if self.shard_accounts and not username:
+                account = self.shard_accounts[(shard[0] - 1) % len(self.shard_accounts)]
+                self.username = account['username']
+                self.password = account['password']
         if site_base_url:
             self.site_base_url = site_base_url
+        if jobs:
+            self.jobs = jobs
+        if combine_tests is not None:
+            self.combine_tests = combine_tests
         if username:
             self.username = username
         if not password:
             password = self.password
+        self.password = password
         if course_id:
             self.course_id = course_id
-        self.ea = edXapi(self.site_base_url, self.username, password, self.course_id, verbose=self.verbose)
+        if studio_base_url:
+            self.studio_base_url = studio_base_url
+        self.site_profile = None
+        if site_profile:
+            self.site_profile = SiteProfile(self.site_base_url, None if site_profile is True else site_profile,
+                                            verbose=self.verbose)
+            self.status_index_offsets = self.status_index_offsets or self.site_profile.get('status_index_offsets')
+            self.problem_index_offsets = dict(self.site_profile.get(self.problem_offsets_profile_key, {}),
+                                              **self.problem_index_offsets)
+        if self.status_index_offsets:
+            self.status_index_offsets = tuple(self.status_index_offsets)
+        self.problem_index_offsets = dict([(k, tuple(v)) for (k, v) in self.problem_index_offsets.items()])
+        self.results_db = None
+        if results_db:
+            if results_db is True:
+                if not cutfn:
+                    raise Exception("[CourseUnitTester] results_db file must be specified when there is no cut file")
+                shard_str = ".shard%dof%d" % shard if shard else ""
+                results_db = "%s%s.results.json" % (os.path.splitext(cutfn)[0], shard_str)
+            if not self.studio_base_url:
+                raise Exception("[CourseUnitTester] incremental runs need studio_base_url, to fingerprint problem content")
+            self.results_db = ResultsDB(results_db, test_set=os.path.abspath(cutfn) if cutfn else None, verbose=self.verbose)
+        self.api_kwargs = dict(verbose=self.verbose, session_cache=session_cache, metrics=metrics, transport=transport)
+        self.studio_ea = None
+        self.ea = edXapi(self.site_base_url, self.username, password, self.course_id, **self.api_kwargs)
 
     def load_cut_file(self, fn):
         '''
@@ -54,56 +172,300 @@ class CourseUnitTester(object):
         self.cutset = CourseUnitTestSet(fn)
         self.__dict__.update(self.cutset.config)
 
-    def run_all_tests(self):
+    def run_all_tests(self, jobs=None):
         '''
         Run tests loaded from cut file.
+
+        jobs = (int) number of tests to run concurrently (defaults to self.jobs).  Tests on the same
+               problem (url_name) share student state, so they are always run serially, in file order.
+               Results are reported in file order, regardless of jobs.
+
+        If a results database is used, tests whose fingerprints match those of their stored results are
+        not run, and their stored results are reported instead.
         '''
+        jobs = jobs or self.jobs
         cnt = 0
         nok = 0
         nbad = 0
+        ncached = 0
         all_url_names = []
+        tests = self.cutset.tests
+        fingerprints = [None] * len(tests)
+        cached = [None] * len(tests)
         print "="*60 + " Running %s tests" % self.cutset.ntests
+        if self.cutset.shard_spec:
+            print "Tests in shard %d/%d of %s" % (self.cutset.shard_spec + (self.cutfn,))
         print "Tests using site %s and course %s" % (self.site_base_url, self.course_id)
+        if jobs > 1:
+            print "Running up to %d tests concurrently" % jobs
+        if self.results_db:
+            fingerprints = self.test_fingerprints(tests, jobs)
+            cached = [self.cached_result(test, self.results_db.lookup(test, fp)) for (test, fp) in zip(tests, fingerprints)]
+            print "Incremental run: %d of %d tests unchanged since last run" % (len([x for x in cached if x]), len(tests))
         print "-" * 60
-        for test in self.cutset.tests:
+        to_run = [test for (test, ret) in zip(tests, cached) if ret is None]
+        results = self.run_tests(to_run, jobs)
+        all_rets = []
+        self.test_records = []
+        for test, ret in zip(tests, self.merge_results(cached, results)):
             cnt += 1
+            all_rets.append(ret)
+            self.test_records.append(self.make_test_record(test, ret, cnt - 1))
             if test.url_name not in all_url_names:
                 all_url_names.append(test.url_name)
-            ret = self.test_problem(abutest=test)
+            if ret.get('cached'):
+                ncached += 1
             if ret['ok']:
                 name = "[%s]" % test.name if test.name else ""
-                print "Test %d: OK %s" % (cnt, name)
+                print "Test %d: OK %s%s" % (cnt, name, " (unchanged)" if ret.get('cached') else "")
                 nok += 1
             else:
                 print "Test %s: Failure! url_name=%s, responses=%s, expected=%s" % (test.name,
                                                                                     test.url_name,
                                                                                     test.responses,
                                                                                     test.expected)
-                print "   --> got correctness_list=%s" % ret['correctness_list']
+                print "   --> got correctness_list=%s%s" % (ret['correctness_list'], " (unchanged)" if ret.get('cached') else "")
                 nbad += 1
             sys.stdout.flush()
         nprobs = len(all_url_names)
         print "="*40 + " Tests done"
         print "%s total tests, on %s unique problems; %s passed, %s failed" % (cnt, nprobs, nok, nbad)
+        if self.results_db:
+            print "%s tests were unchanged since last run, and not re-run" % ncached
+            self.results_db.save(tests, fingerprints, all_rets)
         self.test_results = {'n_tests_ran': cnt,
                              'n_passed': nok,
                              'n_failed': nbad,
                              'n_problems': nprobs,
+                             'n_cached': ncached,
                              }
+        self.save_index_offsets()
+
+    @staticmethod
+    def make_test_record(test, ret, position):
+        '''
+        Return JSON-serializable record of the result of test (with test_problem return dict ret), which was
+        at position in the test set run
+        '''
+        return OrderedDict([('index', test.index if test.index is not None else position),
+                            ('name', test.name),
+                            ('url_name', test.url_name),
+                            ('responses', test.responses),
+                            ('expected', test.expected),
+                            ('ok', ret['ok']),
+                            ('correctness_list', ret['correctness_list']),
+                            ('cached', bool(ret.get('cached'))),
+                            ])
+
+    def results_as_dict(self):
+        '''
+        Return JSON-serializable dict of the results of the last run_all_tests, for write_results
+        '''
+        return OrderedDict([('test_file', self.cutfn),
+                            ('site_base_url', self.site_base_url),
+                            ('course_id', self.course_id),
+                            ('username', self.username),
+                            ('shard', list(self.cutset.shard_spec) if self.cutset.shard_spec else None),
+                            ('test_results', self.test_results),
+                            ('tests', self.test_records),
+                            ])
+
+    @staticmethod
+    def write_results(runs, ofn):
+        '''
+        Write results of runs (list of results_as_dict dicts, e.g. one per test file) to JSON file ofn
+        '''
+        with open(ofn, 'w') as fp:
+            fp.write(json.dumps({'runs': runs}, indent=2))
+
+    @staticmethod
+    def merge_results(cached, results):
+        '''
+        Generate results for all tests, in order, from cached (list of stored results, or None for tests
+        which are run) and results (of the tests which are run, in order).
+        '''
+        results = iter(results)
+        for ret in cached:
+            yield ret if ret is not None else next(results)
+
+    @staticmethod
+    def cached_result(test, result):
+        '''
+        Return test_problem style dict for a stored result from the results database (or None)
+        '''
+        if result is None:
+            return None
+        return {'ok': result['ok'],
+                'data': None,
+                'xml': None,
+                'correctness_list': result['correctness_list'],
+                'responses': test.responses,
+                'expected': test.expected,
+                'cached': True,
+                }
+
+    def get_studio_api(self):
+        '''
+        Return edXapi instance for the course's Studio site (logged in on first use)
+        '''
+        if not self.studio_ea:
+            self.studio_ea = edXapi(self.studio_base_url, self.username, self.password, self.course_id, studio=True,
+                                    **self.api_kwargs)
+        return self.studio_ea
+
+    def test_fingerprints(self, tests, jobs=None):
+        '''
+        Return list of fingerprints for tests, each of the content of the test's problem (its Studio data
+        and metadata, and when it was published), the grader library static asset, and the test definition.
+        The fingerprint is None (so the test is always run) for tests whose problem content could not be
+        retrieved, or has unpublished changes: the LMS grades the published version, which Studio does
+        not return.
+        '''
+        studio = self.get_studio_api()
+        url_names = list(OrderedDict([(test.url_name, 1) for test in tests]))
+
+        def problem_fingerprint(ea, url_name):
+            try:
+                block = ea.get_xblock(usage_key=ea.create_block_key('problem', url_name))
+            except Exception as err:
+                print "[CourseUnitTester] failed to get content of problem %s, err=%s" % (url_name, err)
+                return None
+            if block.get('has_changes') or block.get('published') is False:
+                return None
+            return fingerprint(block.get('data'), block.get('metadata'), block.get('published_on'))
+
+        with studio.metrics.phase('incremental:fingerprints'):
+            library = studio.get_static_asset(self.grader_library, nofail=True)
+            library = hashlib.sha1(library).hexdigest() if library is not None else None
+            problems = dict(zip(url_names, studio.imap_concurrent(problem_fingerprint, url_names,
+                                                                  max_workers=jobs or self.jobs)))
+        return [fingerprint(problems[test.url_name], library, ResultsDB.test_key(test)) if problems[test.url_name] else None
+                for test in tests]
+
+    def run_tests(self, tests, jobs):
+        '''
+        Run tests (list of AnswerBoxUnitTest objects), jobs at a time (see run_tests_concurrently), combining
+        them into fewer problem checks, if combine_tests is set.
+
+        Generates the test_problem return dicts, in the same order as tests.
+        '''
+        if not self.combine_tests:
+            if jobs > 1:
+                results = self.run_tests_concurrently(tests, jobs)
+            else:
+                results = (self.test_problem(abutest=test) for test in tests)
+            for ret in results:
+                yield ret
+            return
+
+        combinations = CourseUnitTestSet.combine_tests(tests)
+        submissions = [test for (test, members) in combinations]
+        if len(submissions) < len(tests):
+            print "Combined %d tests into %d problem checks" % (len(tests), len(submissions))
+        members_of = dict((id(test), [tests[k] for k in members]) for (test, members) in combinations)
+
+        def run_combination(ea, test):
+            return self.test_combination(test, members_of[id(test)], ea=ea)
+
+        if jobs > 1:
+            results = self.run_tests_concurrently(submissions, jobs, run_test=run_combination)
+        else:
+            results = (run_combination(self.ea, test) for test in submissions)
+        rets = {}
+        next_idx = 0
+        for (test, members), mrets in zip(combinations, results):
+            rets.update(zip(members, mrets))
+            while next_idx in rets:
+                yield rets.pop(next_idx)
+                next_idx += 1
+
+    def test_combination(self, combined, tests, ea=None):
+        '''
+        Run the test combined from tests (list of AnswerBoxUnitTest objects), and return the list of
+        test_problem return dicts for tests.
+
+        If the combined problem check gives no correctness list (e.g. a bad box index in one of
+        the tests), or an overall error, then which test caused it is unknown, so the tests are
+        re-run separately, instead of all being failed.
+        '''
+        if len(tests)==1:
+            return [self.test_problem(abutest=tests[0], ea=ea)]
+        ret = self.test_problem(abutest=combined, ea=ea)
+        if not ret['correctness_list'] or 'Error' in (ret['overall_correctnes'] or ""):
+            print "Combined check of %d tests of %s failed, running them separately" % (len(tests), combined.url_name)
+            return [self.test_problem(abutest=test, ea=ea) for test in tests]
+        return self.split_result(ret, tests)
+
+    def split_result(self, ret, tests):
+        '''
+        Return list of test_problem return dicts for tests, from ret, the return dict of the test which
+        combined them (with their responses, in order).
+        '''
+        rets = []
+        start = 0
+        for test in tests:
+            correctness_list = ret['correctness_list']
+            if correctness_list is not None:
+                correctness_list = correctness_list[start:start + len(test.responses)]
+            start += len(test.responses)
+            isok = correctness_list is not None and self.is_expected_outcome(test.expected, correctness_list,
+                                                                             ret['overall_correctnes'])
+            rets.append(dict(ret, ok=isok, correctness_list=correctness_list, responses=test.responses,
+                             expected=test.expected, ncombined=len(tests)))
+        return rets
+
+    @staticmethod
+    def is_expected_outcome(expected, correctness_list, success):
+        '''
+        Return True if a problem check, with overall outcome success, and correctness_list for the answer boxes,
+        is as expected (a list of correctness values, or an overall outcome)
+        '''
+        if 'Error' in success:
+            return expected=="error"
+        if isinstance(expected, list):
+            return len(expected)==len(correctness_list) and all([ex==c for (ex, c) in zip(expected, correctness_list)])
+        return expected==success
+
+    def run_tests_concurrently(self, tests, jobs, run_test=None):
+        '''
+        Run tests (list of AnswerBoxUnitTest objects) using a pool of jobs worker threads, each with
+        its own clone of the edXapi instance.  Tests are grouped by url_name, and the tests within
+        each group are run serially, in order.
+
+        run_test = function (ea, test) running one test (default test_problem)
+
+        Generates the run_test return values, in the same order as tests.
+        '''
+        if run_test is None:
+            run_test = lambda ea, test: self.test_problem(abutest=test, ea=ea)
+        groups = OrderedDict()
+        for idx, test in enumerate(tests):
+            groups.setdefault(test.url_name, []).append(idx)
+
+        def run_group(ea, indexes):
+            return [(idx, run_test(ea, tests[idx])) for idx in indexes]
+
+        results = {}
+        next_idx = 0
+        for group_results in self.ea.imap_concurrent(run_group, groups.values(), max_workers=jobs):
+            results.update(group_results)
+            while next_idx in results:
+                yield results.pop(next_idx)
+                next_idx += 1
 
     def make_correctness_list_from_xml(self, xml, status_names):
         '''
         Extract whether a given response was correct or incorrect, from the content XML 
         returned for a problem, from the grader.
 
+        xml may be the parsed content, or a StatusIndex of it (so that it is only indexed once,
+        when trying several sets of status names).
+
         Return cottectness list (a list of strings).
         '''
-        status_divs = []
+        index = xml if isinstance(xml, StatusIndex) else StatusIndex(xml)
         correctness_list = []
         for sn, response in status_names.items():
-            correctness = None
-            label_type = None
-            sn_orig = sn
             #
             # This is the diciest part of the edxcut process, because the edX xblock API
             # and the edX CAPA responsetypes interface is not well defined here.
@@ -115,47 +477,115 @@ class CourseUnitTester(object):
             # accessibility constraints.  Beyond this, even the format of the html element
             # ID's has changed, eg from input_.... to status_... to ...-label.
             #
-            sx = xml.find('.//div[@id="%s"]' % sn)		# text line input problems
-            if sx is None:
-                sx = xml.find('.//span[@id="%s"]' % sn)	# multiple choice problems, unanswered
-            if sx is None:
-                sn = "input_%s_%s" % (sn_orig[7:], response)	# <label for="input_a0effb954cca4759994f1ac9e9434bf4_3_1_choice_2" class="choicegroup_correct">
-                sx = xml.find('.//label[@for="%s"]' % sn)	# multiple choice problems
-                label_type = "choice input"
+            sx, sn = index.find_status(sn, response)
             if sx is None:
-                # <label id="URL_NAME_2_1-choice_5-label" class="response-label field-label label-inline choicegroup_correct">
-                sn = "%s-%s-label" % (sn_orig[7:], response)
-                sx = xml.find('.//label[@id="%s"]' % sn)	# multiple choice problems
-            if sx is None:
-                contents = etree.tostring(xml)
-                raise Exception("[CourseUnitTester] failed to find status in content for %s,"
-                                "contents=%s" % (sn, contents))
-            if correctness is None:
-                try:
-                    correctness = sx.get('class').strip()
-                except Exception as err:
-                    contents = etree.tostring(xml)
-                    raise Exception("[CourseUnitTester] failed to construct correctness, err=%s, "
-                                    "with status_name=%s, contents=%s" % (err, sn, contents))
-                if ' ' in correctness:
-                    for cstr in correctness.split(' '):
-                        if 'correct' in cstr:
-                            correctness = cstr
-                correctness = correctness.replace('choicegroup_', '')
-                correctness = correctness.replace('status', '')
-                correctness = correctness.replace('inline', '')
-                correctness = correctness.strip()
+                raise StatusNotFound("[CourseUnitTester] failed to find status in content for %s%s" % (sn, self.contents_for_error(index)))
+            try:
+                correctness = sx.get('class').strip()
+            except Exception as err:
+                raise Exception("[CourseUnitTester] failed to construct correctness, err=%s, "
+                                "with status_name=%s%s" % (err, sn, self.contents_for_error(index)))
+            if ' ' in correctness:
+                for cstr in correctness.split(' '):
+                    if 'correct' in cstr:
+                        correctness = cstr
+            correctness = correctness.replace('choicegroup_', '')
+            correctness = correctness.replace('status', '')
+            correctness = correctness.replace('inline', '')
+            correctness = correctness.strip()
             correctness_list.append(correctness)
-            status_divs.append(sx)
         return correctness_list
 
-    def test_problem(self, url_name=None, responses=None, expected=None, box_indexes=None, abutest=None):
+    def contents_for_error(self, index):
+        '''
+        Problem content, for error messages, when verbose (serializing the whole page is slow)
+        '''
+        if not self.verbose:
+            return ""
+        return ", contents=%s" % etree.tostring(index.xml)
+
+    def index_offsets_to_try(self, url_name):
+        '''
+        Return list of (x, y) status index offsets to try for problem url_name: those learned for the
+        problem, or for the site, first.
+        '''
+        offsets = []
+        for xy in [self.problem_index_offsets.get(url_name), self.status_index_offsets] + self.STATUS_INDEX_OFFSETS:
+            if xy and xy not in offsets:
+                offsets.append(xy)
+        return offsets
+
+    def learn_index_offsets(self, url_name, xy):
+        '''
+        Record that the (x, y) status index offsets xy worked for problem url_name.  The first offsets to work
+        are taken for the site; problems for which others work are remembered individually.
+        '''
+        with self.offsets_lock:
+            if self.status_index_offsets is None:
+                self.status_index_offsets = xy
+                if self.verbose:
+                    print "[CourseUnitTester] using status index offsets %s for %s" % (list(xy), self.site_base_url)
+            if xy==self.status_index_offsets:
+                self.problem_index_offsets.pop(url_name, None)
+            else:
+                self.problem_index_offsets[url_name] = xy
+
+    @property
+    def problem_offsets_profile_key(self):
+        '''
+        Site profile key for the offsets of individual problems, which are kept per course, since url_names
+        (e.g. q1) are only unique within a course
+        '''
+        return "problem_index_offsets %s" % self.course_id
+
+    def save_index_offsets(self):
+        '''
+        Store the status index offsets learned, in the site profile (if one is used)
+        '''
+        if not self.site_profile:
+            return
+        with self.offsets_lock:
+            if self.status_index_offsets:
+                self.site_profile.set('status_index_offsets', list(self.status_index_offsets))
+            self.site_profile.set(self.problem_offsets_profile_key,
+                                  dict([(k, list(v)) for (k, v) in self.problem_index_offsets.items()]))
+        self.site_profile.save()
+
+    def make_correctness_list_for_responses(self, ea, xml, url_name, responses, box_indexes=None):
+        '''
+        Return correctness list for responses to problem url_name, from the content XML returned
+        by the grader.  The status elements are looked up with each of the (x, y) index offsets for
+        their ids given by index_offsets_to_try, until all are found (some versions of edx platform
+        index x from 3, some from 2, for multiple choice problems), using one index of the content.
+        The offsets which work are remembered, to be tried first for later problems.
+
+        Raises StatusNotFound if the status elements are not found with any of the offsets.
+        '''
+        index = StatusIndex(xml)
+        for (x_offset, y_offset) in self.index_offsets_to_try(url_name):
+            status_names = ea.make_response_dict(url_name, responses, prefix="status", box_indexes=box_indexes,
+                                                 x_index_offset=x_offset, y_index_offset=y_offset)
+            if self.verbose > 3:
+                print "    stats_names=%s" % status_names
+            try:
+                correctness_list = self.make_correctness_list_from_xml(index, status_names)
+            except StatusNotFound as err:
+                error = StatusNotFound("%s, with status_names=%s" % (err, status_names))
+                if self.verbose:
+                    print "[CourseUnitTester] test_problem: warning, %s; retrying with other index offsets" % error
+                continue
+            self.learn_index_offsets(url_name, (x_offset, y_offset))
+            return correctness_list
+        raise error
+
+    def test_problem(self, url_name=None, responses=None, expected=None, box_indexes=None, abutest=None, ea=None):
         '''
         Test that the problem specified by url_name, when fed responses, returns expected.
 
         responses = ordered list of input strings, or dict with key:string
         expected = either list or single string instance of "correct" or "incorrect" or "error"
         box_indexes = list of (x,y) indexes for input box locations
+        ea = edXapi instance to use (defaults to self.ea); used by concurrent worker threads
 
         if url_name, responses, and expected are not supplied, then abutest (an AnswerBoxUnitTest objet)
         must be provided.
@@ -171,16 +601,17 @@ class CourseUnitTester(object):
             responses = abutest.responses
             expected = abutest.expected
             box_indexes = abutest.box_indexes
+        ea = ea or self.ea
         got_eval = False
 
         ntries = 0
         while not got_eval:
             ntries += 1
             try:
-                data = self.ea.do_xblock_check_problem(url_name, responses, box_indexes)
+                data = ea.do_xblock_check_problem(url_name, responses, box_indexes)
             except Exception as err:
                 print "[CourseUnitTester] Failed testing %s (at %s), err=%s" % (url_name,
-                                                                                self.ea.problem_url(url_name),
+                                                                                ea.problem_url(url_name),
                                                                                 err)
                 print "--> Skipping problem!"
                 return {'ok': False,
@@ -193,7 +624,7 @@ class CourseUnitTester(object):
                 }
                 sys.stdout.flush()
             if 'success' in data and "Please refresh your page" in data['success']:
-                ret = self.ea.do_reset_student_attempts(url_name)
+                ret = ea.do_reset_student_attempts(url_name)
                 if not (isinstance(ret, dict) and 'student' in ret):
                     raise Exception("[CourseUnitTester] Failed to reset attempts!  return=%s" % ret)
             else:
@@ -203,54 +634,31 @@ class CourseUnitTester(object):
 
         parser = etree.HTMLParser()
         if 'contents' in data:
-            xml = etree.parse(StringIO(data['contents']), parser)
+            with ea.metrics.phase('parse:problem_check'):
+                xml = etree.parse(StringIO(data['contents']), parser)
             # <div class="correct " id="status_75f9562c77bc4858b61f907bb810d974_4_1">
-            status_names = self.ea.make_response_dict(url_name, responses, prefix="status", box_indexes=box_indexes)
-            if self.verbose > 3:
-                print "    stats_names=%s" % status_names
             try:
-                correctness_list = self.make_correctness_list_from_xml(xml, status_names)
-            except Exception as err:
-                if "failed to find status in content" in str(err):
-                    # try reducing x index offset from 2 to 1 (some versions of edx platform index from 3, some from 2)
-                    # for multiple choice problems.
-                    if self.verbose:
-                        print ("[CourseUnitTester] test_problem: warning, %s, with status_names=%s; "
-                               "retrying with x index offset = 1" % (str(err), status_names))
-                    status_names = self.ea.make_response_dict(url_name, responses, prefix="status",
-                                                              box_indexes=box_indexes,
-                                                              x_index_offset=1)
-                    try:
-                        correctness_list = self.make_correctness_list_from_xml(xml, status_names)
-                    except Exception as err:
-                        print "[CourseUnitTester] test_problem, error with status_names=%s, err=%s" % (status_names, err)
-                        print "--> Skipping problem!"
-                        return {'ok': False,
-                                'data': None,
-                                'xml': None,
-                                'correctness_list': None,
-                                'overall_correctnes': None,
-                                'responses': responses,
-                                'expected': expected,
-                        }
-                    sys.stdout.flush()
-                else:
-                    raise
-                        
+                with ea.metrics.phase('extract:correctness_list'):
+                    correctness_list = self.make_correctness_list_for_responses(ea, xml, url_name, responses, box_indexes)
+            except StatusNotFound as err:
+                print "[CourseUnitTester] test_problem, error: %s" % err
+                print "--> Skipping problem!"
+                sys.stdout.flush()
+                return {'ok': False,
+                        'data': None,
+                        'xml': None,
+                        'correctness_list': None,
+                        'overall_correctnes': None,
+                        'responses': responses,
+                        'expected': expected,
+                }
+
         else:
             correctness_list = []
-            print "  --> oops, empty correctness_list; url=%s, ret=%s" % (self.ea.jump_to_url(url_name), data)
+            print "  --> oops, empty correctness_list; url=%s, ret=%s" % (ea.jump_to_url(url_name), data)
             xml = None
 
-        if 'Error' in data['success']:
-            isok = (expected=="error")
-        elif isinstance(expected, list):
-            if not len(expected)==len(correctness_list):
-                isok = False
-            else:
-                isok = all([ex==c for (ex, c) in zip(expected, correctness_list)])
-        else:
-            isok = expected==data['success']
+        isok = self.is_expected_outcome(expected, correctness_list, data['success'])
         if self.verbose:
             print "[CourseUnitTester] problem %s responses %s gives correctness %s (%s)" % (url_name, responses, correctness_list, "OK" if isok else "ERROR")
         status = {'ok': isok,
@@ -265,11 +673,70 @@ class CourseUnitTester(object):
 
 #-----------------------------------------------------------------------------
 
-@pytest.fixture(scope="module")
-def cut_test_fixture():
-    course_id = "course-v1:edX+DemoX+Demo_Course"
-    cut = CourseUnitTester("http://192.168.33.10", "staff@example.com", "edx", course_id)
-    return cut
+def summarize_test_records(records):
+    '''
+    Return test_results summary dict (as run_all_tests makes) for test records
+    '''
+    return {'n_tests_ran': len(records),
+            'n_passed': len([x for x in records if x['ok']]),
+            'n_failed': len([x for x in records if not x['ok']]),
+            'n_problems': len(set([x['url_name'] for x in records])),
+            'n_cached': len([x for x in records if x.get('cached')]),
+            }
+
+def merge_shard_results(fns, ofn=None):
+    '''
+    Merge results of shard runs (JSON files written by CourseUnitTester.write_results, e.g. from runs with
+    --shard on several hosts) into one run per test file, with the tests in test file order, and print
+    a report.  Write the merged results to ofn, if given.  Returns list of merged runs.
+    '''
+    merged = OrderedDict()
+    for fn in fns:
+        for run in json.loads(open(fn).read())['runs']:
+            key = os.path.basename(run['test_file'] or "")
+            mrun = merged.setdefault(key, OrderedDict([('test_file', run['test_file']),
+                                                       ('site_base_url', run['site_base_url']),
+                                                       ('course_id', run['course_id']),
+                                                       ('shards', []),
+                                                       ('usernames', []),
+                                                       ('tests', {}),
+                                                       ]))
+            if run['shard'] in mrun['shards']:
+                print "Warning: shard %s of %s appears more than once (in %s); using the last" % (run['shard'], key, fn)
+            else:
+                mrun['shards'].append(run['shard'])
+            if run['username'] not in mrun['usernames']:
+                mrun['usernames'].append(run['username'])
+            for record in run['tests']:
+                mrun['tests'][record['index']] = record
+    runs = []
+    for key, mrun in merged.items():
+        mrun['tests'] = [mrun['tests'][k] for k in sorted(mrun['tests'])]
+        mrun['test_results'] = summarize_test_records(mrun['tests'])
+        print "="*70
+        print "==>  Results from %s, %d shards (run as %s)" % (key, len(mrun['shards']), ', '.join(map(str, mrun['usernames'])))
+        nshards = set([x[1] for x in mrun['shards'] if x])
+        if len(nshards)==1 and None not in mrun['shards']:
+            nshards = nshards.pop()
+            missing = sorted(set(range(1, nshards + 1)) - set([x[0] for x in mrun['shards']]))
+            if missing:
+                print "Warning: missing shards %s of %d" % (missing, nshards)
+        elif len(mrun['shards']) > 1:
+            print "Warning: results are from runs with different shard counts %s" % mrun['shards']
+        for record in mrun['tests']:
+            if not record['ok']:
+                print "Test %s: Failure! url_name=%s, responses=%s, expected=%s" % (record['name'], record['url_name'],
+                                                                                    record['responses'], record['expected'])
+                print "   --> got correctness_list=%s" % record['correctness_list']
+        tr = mrun['test_results']
+        print "%s total tests, on %s unique problems; %s passed, %s failed" % (tr['n_tests_ran'], tr['n_problems'],
+                                                                               tr['n_passed'], tr['n_failed'])
+        runs.append(mrun)
+    if ofn:
+        CourseUnitTester.write_results(runs, ofn)
+    return runs
+
+#-----------------------------------------------------------------------------
 
 def test_cut1(cut_test_fixture):
     cut = cut_test_fixture
@@ -349,6 +816,171 @@ def test_cut_from_file1():
     assert(cut.test_results['n_passed']==3)
     assert(cut.test_results['n_failed']==0)
 
+def test_cut_from_file_concurrent():
+    cfn = "../test_data/test_demo_course.yaml"
+    cut = CourseUnitTester(cutfn=cfn, jobs=3)
+    cut.run_all_tests()
+    assert(cut.test_results['n_tests_ran']==6)
+    assert(cut.test_results['n_passed']==6)
+    assert(cut.test_results['n_failed']==0)
+    assert(cut.test_results['n_problems']==3)
+
+def test_correctness_from_status_index():
+    from fake_edx import FakeCourse, FakeEdxServer
+    for offset in [2, 1]:
+        course = FakeCourse(problems=3, boxes=3, status_index_offset=offset)
+        srv = FakeEdxServer([course]).start()
+        try:
+            cut = CourseUnitTester(srv.base_url, "staff@example.com", "edx", course.course_id)
+        finally:
+            srv.stop()
+        ea = cut.ea
+        for url_name in ["problem_1", "problem_3"]:			# numerical and choice problems
+            answers = course.answers(url_name)
+            wrong = [x for x in course.CHOICES if not x==answers[-1]][0] if course.is_choice_problem(url_name) else "-1"
+            responses = answers[:-1] + [wrong]
+            html = course.check_problem(url_name, ea.make_response_dict(url_name, responses).items())['contents']
+            xml = etree.parse(StringIO(html), etree.HTMLParser())
+            cl = cut.make_correctness_list_for_responses(ea, xml, url_name, responses)
+            assert cl==["correct"] * (len(answers) - 1) + ["incorrect"]
+    try:
+        cut.make_correctness_list_for_responses(ea, xml, "problem_2", responses)
+        assert False
+    except StatusNotFound as err:
+        assert "failed to find status" in str(err) and not "contents=" in str(err)
+
+def test_index_offsets_learned():
+    import shutil
+    from fake_edx import FakeCourse, FakeEdxServer, make_test_file
+    pdir = "/tmp/edxcut_tmp_sites"
+    shutil.rmtree(pdir, True)
+    course = FakeCourse(chapters=1, sequentials=1, verticals=2, problems=3, status_index_offset=1)
+    srv = FakeEdxServer([course]).start()
+    try:
+        fn = "/tmp/edxcut_tmp_offsets.yaml"
+        ntests = make_test_file(course, fn, srv.base_url, "staff@example.com", "edx")
+        cut = CourseUnitTester(cutfn=fn, site_profile=pdir)
+        assert cut.index_offsets_to_try("problem_1")==[(2, 1), (1, 1)]
+        cut.run_all_tests()
+        assert cut.test_results['n_passed']==ntests
+        assert cut.status_index_offsets==(1, 1) and cut.problem_index_offsets=={}
+        cut2 = CourseUnitTester(cutfn=fn, site_profile=pdir)		# learned by an earlier run
+        assert cut2.index_offsets_to_try("problem_1")==[(1, 1), (2, 1)]
+        cut2.learn_index_offsets("problem_2", (2, 1))
+        assert cut2.index_offsets_to_try("problem_2")==[(2, 1), (1, 1)]
+        cut2.save_index_offsets()
+        assert CourseUnitTester(cutfn=fn, site_profile=pdir).problem_index_offsets=={'problem_2': (2, 1)}
+        other = CourseUnitTester(cutfn=fn, site_profile=pdir, course_id="course-v1:edX+Other+2026")
+        assert other.problem_index_offsets=={} and other.index_offsets_to_try("problem_2")==[(1, 1), (2, 1)]
+    finally:
+        srv.stop()
+
+def test_incremental_run():
+    from fake_edx import FakeCourse, FakeEdxServer, fake_api, make_test_file
+    course = FakeCourse(chapters=1, sequentials=1, verticals=2, problems=3)
+    srv = FakeEdxServer([course]).start()
+    try:
+        fn = "/tmp/edxcut_tmp_incremental.yaml"
+        rfn = "/tmp/edxcut_tmp_incremental.results.json"
+        if os.path.exists(rfn):
+            os.unlink(rfn)
+        ntests = make_test_file(course, fn, srv.base_url, "staff@example.com", "edx")
+
+        def run():
+            cut = CourseUnitTester(cutfn=fn, results_db=True, studio_base_url=srv.base_url, jobs=2)
+            cut.run_all_tests()
+            assert cut.test_results['n_passed']==ntests
+            return cut.test_results['n_cached']
+
+        assert run()==0 and run()==ntests
+        ea = fake_api(srv)
+        key = ea.create_block_key('problem', "problem_1")
+        block = ea.get_xblock(usage_key=key)
+        ea.update_xblock(usage_key=key, data=block['data'] + " ")
+        assert run()==ntests - 2				# two tests of the changed problem re-run
+        assert run()==ntests - 2				# and again, until the change is published
+        ea.update_xblock(usage_key=key, post_data={'publish': "make_public"})
+        assert run()==ntests - 2
+        assert run()==ntests
+        open("/tmp/python_lib.zip", 'w').write("grader")
+        ea.upload_static_asset("/tmp/python_lib.zip")
+        assert run()==0
+    finally:
+        srv.stop()
+
+def test_shards_merge():
+    import yaml
+    from fake_edx import FakeCourse, FakeEdxServer, make_test_file
+    course = FakeCourse(chapters=1, sequentials=2, verticals=2, problems=3)
+    srv = FakeEdxServer([course], users={'staff@example.com': "edx", 'staff2@example.com': "edx2"}).start()
+    try:
+        fn = "/tmp/edxcut_tmp_shards.yaml"
+        ntests = make_test_file(course, fn, srv.base_url, "staff@example.com", "edx")
+        spec = yaml.safe_load(open(fn))
+        spec['config']['shard_accounts'] = [{'username': "staff@example.com", 'password': "edx"},
+                                            {'username': "staff2@example.com", 'password': "edx2"}]
+        spec['tests'][1]['expected'] = "incorrect" if spec['tests'][1]['expected']=="correct" else "correct"
+        open(fn, 'w').write(yaml.safe_dump(spec))
+        cut = CourseUnitTester(cutfn=fn)
+        cut.run_all_tests()
+        rfns = []
+        for i in range(1, 4):
+            scut = CourseUnitTester(cutfn=fn, shard=(i, 3))
+            assert scut.username==["staff@example.com", "staff2@example.com"][(i - 1) % 2]
+            scut.run_all_tests()
+            rfns.append("/tmp/edxcut_tmp_shard%d.json" % i)
+            CourseUnitTester.write_results([scut.results_as_dict()], rfns[-1])
+        runs = merge_shard_results(rfns, "/tmp/edxcut_tmp_merged.json")
+        assert len(runs)==1 and runs[0]['tests']==cut.test_records
+        assert runs[0]['test_results']==cut.test_results=={'n_tests_ran': ntests, 'n_passed': ntests - 1, 'n_failed': 1,
+                                                          'n_problems': ntests / 2, 'n_cached': 0}
+    finally:
+        srv.stop()
+
+def test_combined_tests():
+    from fake_edx import FakeCourse, FakeEdxServer
+    course = FakeCourse(chapters=1, sequentials=1, verticals=1, problems=2, boxes=3)
+    srv = FakeEdxServer([course]).start()
+    try:
+        cutset = CourseUnitTestSet(verbose=False)
+        for url_name in ["problem_1", "problem_2"]:
+            for k, answer in enumerate(course.answers(url_name)):
+                for response, expected in [(answer, "correct"), ("-1", "incorrect")]:
+                    cutset.add_test(AnswerBoxUnitTest(dict(url_name=url_name, responses=[response], expected=[expected],
+                                                           box_indexes=[(k, 0)])))
+        cutset.tests[3].expected = ["correct"]			# fails, whether or not combined
+        checks = []
+        for combine in [False, True]:
+            cut = CourseUnitTester(srv.base_url, "staff@example.com", "edx", course.course_id, combine_tests=combine, jobs=2)
+            cut.cutset = cutset
+            cut.run_all_tests()
+            checks.append(sum([x['count'] for x in srv.metrics.summary()['requests'] if "problem_check" in x['endpoint']]))
+            assert cut.test_results['n_passed']==11 and cut.test_results['n_failed']==1
+            assert [x['ok'] for x in cut.test_records]==[k!=3 for k in range(12)]
+        assert checks[1] - checks[0]==4				# 2 per problem, instead of 6
+    finally:
+        srv.stop()
+
+def test_combined_tests_bad_box_index():
+    from fake_edx import FakeCourse, FakeEdxServer
+    course = FakeCourse(chapters=1, sequentials=1, verticals=1, problems=1, boxes=3)
+    srv = FakeEdxServer([course]).start()
+    try:
+        cutset = CourseUnitTestSet(verbose=False)
+        for k, answer in enumerate(course.answers("problem_1")):
+            cutset.add_test(AnswerBoxUnitTest(dict(url_name="problem_1", responses=[answer], expected=["correct"],
+                                                   box_indexes=[(k, 0)])))
+        cutset.add_test(AnswerBoxUnitTest(dict(url_name="problem_1", responses=["1"], expected=["correct"],
+                                               box_indexes=[(9, 0)])))		# no such answer box
+        assert len(cutset.combine_tests(cutset.tests))==1
+        cut = CourseUnitTester(srv.base_url, "staff@example.com", "edx", course.course_id, combine_tests=True)
+        cut.cutset = cutset
+        cut.run_all_tests()
+        assert [x['ok'] for x in cut.test_records]==[True, True, True, False]
+        assert cut.test_results['n_passed']==3 and cut.test_results['n_failed']==1
+    finally:
+        srv.stop()
+
 #-----------------------------------------------------------------------------
             
 if __name__=="__main__":
@@ -0,0 +1,226 @@
+'''
+HTTP request dispatch for edXapi: retries with backoff, Retry-After handling,
+per-host client-side rate limiting, and default timeouts, in one place.
+'''
+
+import sys
+import time
+import random
+import urlparse
+import requests
+import threading
+
+from email.utils import parsedate_tz, mktime_tz
+
+#-----------------------------------------------------------------------------
+
+class TokenBucket(object):
+    '''
+    Token bucket rate limiter: allows bursts of up to burst requests, and on average
+    rate requests per second.  Thread safe.
+    '''
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1, rate))
+        self.tokens = self.burst
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        '''
+        Take one token, waiting until one is available.  Returns number of seconds waited.
+        '''
+        waited = 0
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+#-----------------------------------------------------------------------------
+
+class RequestDispatcher(object):
+    '''
+    Issue HTTP requests on a requests session, retrying transient failures.
+
+    Idempotent requests (GET, HEAD, OPTIONS, PUT, DELETE) are retried on connection errors,
+    timeouts, and responses with a status in retry_statuses (by default 429, 502, 503, 504).
+    Other requests (i.e. POST) are only retried when the server cannot have acted on them:
+    on 429 (Too Many Requests), and on failure to connect.  Waits between attempts grow
+    exponentially (with full jitter), unless the server gives a Retry-After.
+
+    If rate is given, requests to each host are limited to that many per second (with
+    bursts of up to burst), across all threads sharing this dispatcher.
+    '''
+    IDEMPOTENT_METHODS = ['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE']
+
+    def __init__(self, retries=3, backoff=0.5, max_backoff=30.0, rate=None, burst=None, timeout=None,
+                 retry_statuses=(429, 502, 503, 504), metrics=None, verbose=False):
+        '''
+        retries = (int) maximum number of retries per request
+        backoff = (float) base wait, in seconds, before the first retry (doubled for each later one)
+        max_backoff = (float) maximum wait between attempts, including waits requested by Retry-After
+        rate = (float) maximum average requests per second, per host (no limit if None)
+        burst = (int) maximum burst of requests per host (defaults to rate)
+        timeout = (float) default timeout, in seconds, for each request (none if None)
+        metrics = (Metrics) if provided, record the method, URL, status, response size, and time of each attempt
+        '''
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.rate = rate
+        self.burst = burst
+        self.timeout = timeout
+        self.retry_statuses = retry_statuses
+        self.metrics = metrics
+        self.verbose = verbose
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, url):
+        host = urlparse.urlsplit(url).netloc
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate, self.burst)
+            return self.buckets[host]
+
+    @staticmethod
+    def retry_after(ret):
+        '''
+        Return number of seconds the server asks the client to wait (Retry-After header), or None
+        '''
+        val = ret.headers.get('Retry-After')
+        if not val:
+            return None
+        val = val.strip()
+        if val.isdigit():
+            return float(val)
+        date = parsedate_tz(val)
+        if date is None:
+            return None
+        return max(0, mktime_tz(date) - time.time())
+
+    def wait_time(self, attempt, ret=None):
+        delay = self.retry_after(ret) if ret is not None else None
+        if delay is None:
+            delay = random.uniform(0, self.backoff * (2 ** attempt))
+        return min(delay, self.max_backoff)
+
+    @staticmethod
+    def rewind_files(kwargs):
+        '''
+        Seek file objects being uploaded back to their start, before re-sending a request
+        '''
+        for val in (kwargs.get('files') or {}).values():
+            fobj = val[1] if isinstance(val, tuple) else val
+            if hasattr(fobj, 'seek'):
+                fobj.seek(0)
+
+    def request(self, ses, method, url, retries=None, **kwargs):
+        '''
+        Make request using session ses; returns the requests Response.  Takes the same
+        keyword arguments as requests (data, json, files, headers, params, timeout, stream,
+        allow_redirects, ...), and optionally retries, to override the number of retries.
+        Raises the last exception if all attempts fail with connection errors or timeouts.
+        '''
+        method = method.upper()
+        retries = self.retries if retries is None else retries
+        idempotent = method in self.IDEMPOTENT_METHODS
+        if self.timeout is not None:
+            kwargs.setdefault('timeout', self.timeout)
+        attempt = 0
+        while True:
+            if self.rate:
+                self.bucket(url).acquire()
+            t0 = time.time()
+            try:
+                ret = ses.request(method, url, **kwargs)
+            except Exception as err:
+                if self.metrics is not None:
+                    self.metrics.record_request(method, url, type(err).__name__, 0, time.time() - t0)
+                if not isinstance(err, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+                    raise
+                connect_failed = isinstance(err, requests.exceptions.ConnectTimeout) or (
+                    isinstance(err, requests.exceptions.ConnectionError) and 'refused' in str(err).lower())
+                if attempt >= retries or not (idempotent or connect_failed):
+                    raise
+                delay = self.wait_time(attempt)
+                if self.verbose:
+                    print "[dispatch] %s %s failed (%s); retrying in %.1f sec" % (method, url, err, delay)
+                    sys.stdout.flush()
+            else:
+                if self.metrics is not None:
+                    if kwargs.get('stream'):
+                        nbytes = int(ret.headers.get('Content-Length') or 0)
+                    else:
+                        nbytes = len(ret.content or '')
+                    self.metrics.record_request(method, url, ret.status_code, nbytes, time.time() - t0)
+                retryable = ret.status_code in self.retry_statuses and (idempotent or ret.status_code==429)
+                if attempt >= retries or not retryable:
+                    return ret
+                delay = self.wait_time(attempt, ret)
+                ret.close()
+                if self.verbose:
+                    print "[dispatch] %s %s returned %s; retrying in %.1f sec" % (method, url, ret.status_code, delay)
+                    sys.stdout.flush()
+            time.sleep(delay)
+            self.rewind_files(kwargs)
+            attempt += 1
+
+#-----------------------------------------------------------------------------
+# unit tests
+
+class FakeResponse(object):
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def close(self):
+        pass
+
+class FakeSession(object):
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        ret = self.responses.pop(0)
+        if isinstance(ret, Exception):
+            raise ret
+        return ret
+
+def test_dispatch_retries():
+    rd = RequestDispatcher(retries=3, backoff=0.001, timeout=7)
+    ses = FakeSession([FakeResponse(502), requests.exceptions.ReadTimeout("slow"), FakeResponse(200)])
+    assert rd.request(ses, 'get', "http://localhost/x").status_code==200
+    assert len(ses.calls)==3
+    assert ses.calls[0][2]['timeout']==7
+    ses = FakeSession([FakeResponse(502), FakeResponse(200)])
+    assert rd.request(ses, 'post', "http://localhost/x").status_code==502		# POST not retried on 502
+    ses = FakeSession([FakeResponse(429, {'Retry-After': '0'}), FakeResponse(200)])
+    assert rd.request(ses, 'post', "http://localhost/x", timeout=1).status_code==200	# but is on 429
+    assert ses.calls[1][2]['timeout']==1
+    ses = FakeSession([FakeResponse(503)] * 5)
+    assert rd.request(ses, 'get', "http://localhost/x", retries=1).status_code==503
+    assert len(ses.calls)==2
+
+def test_dispatch_retry_after():
+    assert RequestDispatcher.retry_after(FakeResponse(429, {'Retry-After': '12'}))==12
+    date = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(time.time() + 60))
+    assert 50 < RequestDispatcher.retry_after(FakeResponse(503, {'Retry-After': date})) <= 60
+    rd = RequestDispatcher(max_backoff=5)
+    assert rd.wait_time(0, FakeResponse(429, {'Retry-After': '120'}))==5
+
+def test_token_bucket():
+    tb = TokenBucket(rate=50, burst=2)
+    t0 = time.time()
+    waits = [tb.acquire() for k in range(6)]
+    assert waits[:2]==[0, 0]
+    assert 0.06 < time.time() - t0 < 0.5
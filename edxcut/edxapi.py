@@ -5,16 +5,83 @@ Handles logins, and performs queries.
 
 import os, sys
 import re
+import copy
 import time
 import requests
-import pytest
 import json
+import base64
+import hashlib
+import threading
 import traceback
 
 from collections import OrderedDict, defaultdict
 from StringIO import StringIO
-from lxml import etree
-from pysrt import SubRipTime, SubRipItem, SubRipFile
+from file_utils import atomic_write
+from outline_cache import OutlineCache
+from response_cache import ResponseCache
+from session_store import SessionStore
+from dispatch import RequestDispatcher
+from metrics import Metrics
+
+#-----------------------------------------------------------------------------
+# polling
+
+def backoff_intervals(initial=1.0, factor=1.5, max_interval=30.0, deadline=None):
+    '''
+    Generate intervals (in seconds) to sleep between successive polls of a long-running
+    server task, growing exponentially from initial, up to max_interval.
+
+    deadline = (float) if given, stop once this many seconds have passed since the first
+               interval was generated (the last interval is shortened to end at the deadline)
+    '''
+    start = time.time()
+    interval = initial
+    while True:
+        if deadline is None:
+            yield interval
+        else:
+            remaining = deadline - (time.time() - start)
+            if remaining <= 0:
+                return
+            yield min(interval, remaining)
+        interval = min(interval * factor, max_interval)
+
+#-----------------------------------------------------------------------------
+# lazily retrieved xblock
+
+class LazyXBlock(dict):
+    '''
+    Placeholder for an xblock, holding only its id (and, possibly, a few other fields,
+    such as category and display_name), which retrieves the full xblock (via Studio) the
+    first time any other field is accessed.
+    '''
+    def __init__(self, ea, usage_key, **fields):
+        '''
+        ea = edXapi instance to use for retrieving the xblock
+        usage_key = (string) block key for the xblock
+        '''
+        dict.__init__(self, id=usage_key, **fields)
+        self.ea = ea
+        self.loaded = False
+
+    def load(self):
+        '''
+        Retrieve the full xblock, if not already done
+        '''
+        if not self.loaded:
+            self.update(self.ea.get_xblock(usage_key=self['id']))
+            self.loaded = True
+        return self
+
+    def __missing__(self, key):
+        if self.loaded:
+            raise KeyError(key)
+        return self.load()[key]
+
+    def get(self, key, default=None):
+        if not key in self:
+            self.load()
+        return dict.get(self, key, default)
 
 #-----------------------------------------------------------------------------
 # edX platform site API
@@ -26,7 +93,10 @@ class edXapi(object):
     '''
     def __init__(self, base=None, username='', password='',
                  course_id=None, data_dir="DATA", verbose=False, studio=False,
-                 auth=None, timeout=None):
+                 auth=None, timeout=None, outline_cache=False, outline_cache_file=None,
+                 outline_cache_ttl=None, max_workers=8, lazy_children=False, session_cache=None,
+                 retries=3, rate_limit=None, metrics=None, transport=None, response_cache=None,
+                 response_cache_ttl=60):
         '''
         Initialize API interface to edx platform site (either LMS or CMS Studio).
 
@@ -39,13 +109,42 @@ class edXapi(object):
         verbose = (bool) output verbosity level
         studio = (bool) True if edX CMS studio site is being accessed (False for edX LMS site)
         auth = (tuple of strings) if provided, added to the requests session for HTTP basic auth
-        timeout = (int) number of seconds to wait for potentially long request timeouts - default None
+        timeout = (int) number of seconds to wait for each request to respond - default None (wait forever)
+        outline_cache = (bool) True if the course outline should be cached (and indexed), instead of
+                        being re-fetched for every name or path lookup.  The cache is kept up to date
+                        with blocks created, deleted, or renamed via this instance.
+        outline_cache_file = (string) if provided, cache the outline, and keep a snapshot of it in
+                             this file, for use by later instances (implies outline_cache=True)
+        outline_cache_ttl = (float) seconds for which a cached outline remains valid (default forever)
+        max_workers = (int) maximum number of concurrent requests, e.g. when retrieving the xblocks in a vertical
+        lazy_children = (bool) True if xblocks in a vertical should only be retrieved when their content is
+                        accessed (see LazyXBlock); their id, category, and display_name are always available
+        session_cache = (string or True) if provided, reuse the login session stored (by an earlier instance) in this
+                        directory (or in ~/.edxcut/sessions, if True), when it is still valid (see SessionStore)
+        retries = (int) number of times to retry requests which fail transiently, e.g. with 429, 502, 503, or 504
+                  (POST requests are only retried when the server cannot have acted on them; see RequestDispatcher)
+        rate_limit = (float) maximum number of requests per second to the edX site (no limit if None)
+        metrics = (Metrics) collector for request and parse timings, e.g. to share one among several
+                  instances; a new one is made if not provided.  Available as self.metrics.
+        transport = (requests adapter) if provided, used for all HTTP(S) requests, e.g. a RecordingAdapter
+                    or ReplayAdapter (see cassette.make_transport), to record or replay a session
+        response_cache = (bool, string, or ResponseCache) if provided, cache the responses of read-only
+                         requests (outline, xblocks, asset list, course metadata, transcripts, course list),
+                         revalidating them with conditional requests; in memory if True, and also in this
+                         directory, if a string (see ResponseCache).  Entries are dropped when changed via
+                         this instance.
+        response_cache_ttl = (float) seconds for which cached responses without ETag or Last-Modified are
+                             used without revalidation
 
         '''
         self.ses = requests.Session()
         self.ses.verify = False
         if auth:
             self.ses.auth = auth
+        self.transport = transport
+        if transport:
+            self.ses.mount('http://', transport)
+            self.ses.mount('https://', transport)
         self.is_studio = studio
         self.login_ok = False
         self.BASE = base or ("https://studio.edx.org" if studio else "https://courses.edx.org")
@@ -55,14 +154,33 @@ class edXapi(object):
         self.username = username
         self.data_dir = data_dir
         self.timeout = timeout
+        self.metrics = metrics or Metrics()
+        self.dispatcher = RequestDispatcher(retries=retries, rate=rate_limit, timeout=timeout, metrics=self.metrics,
+                                            verbose=verbose)
         self.xblock_csrf = None
         self.debug = False
-        self.login(username, password)
+        self.max_workers = max_workers
+        self.lazy_children = lazy_children
+        self.outline_cache = None
+        if outline_cache or outline_cache_file:
+            self.outline_cache = OutlineCache(fn=outline_cache_file, ttl=outline_cache_ttl, verbose=verbose)
+        self.response_cache = None
+        if isinstance(response_cache, ResponseCache):
+            self.response_cache = response_cache
+        elif response_cache:
+            self.response_cache = ResponseCache(cache_dir=None if response_cache is True else response_cache,
+                                                ttl=response_cache_ttl, verbose=verbose)
+        self.session_store = None
+        if session_cache:
+            self.session_store = SessionStore(None if session_cache is True else session_cache, verbose=verbose)
+            self.session_store.login(self, username, password)
+        else:
+            self.login(username, password)
 
     def login(self, username, pw):
         url = '%s/%s' % (self.BASE, "signin" if self.is_studio else "login")
         try:
-            r1 = self.ses.get(url)
+            r1 = self.request('GET', url)
         except Exception as err:
             traceback.print_exc()
             raise Exception("[edxapi] failed to get login page %s, err=%s" % (url, err))
@@ -85,7 +203,7 @@ class edXapi(object):
         url2 = '%s/%s' % (self.BASE, "login_post" if self.is_studio else "user_api/v1/account/login_session/")
         headers = {'X-CSRFToken': self.csrf,
                    'Referer': '%s/login' % self.BASE}
-        r2 = self.ses.post(url2, data={'email': username, 'password': pw}, headers=headers)
+        r2 = self.request('POST', url2, data={'email': username, 'password': pw}, headers=headers)
         self.headers = headers
 
         if self.verbose and not r2.status_code==200:
@@ -125,7 +243,7 @@ class edXapi(object):
         data = {'user_idp': 'https://idp.touchstonenetwork.net/shibboleth-idp',
                 'Select': 's',
                 }
-        r2 = self.ses.post(url, data=data)
+        r2 = self.request('POST', url, data=data)
         if not "Collaboration Account Login" in r2.content:
             print "at r2:"
             print r2.content
@@ -150,12 +268,13 @@ class edXapi(object):
                    'Origin': rurl,
                    }
         print "headers=%s" % headers
-        r3 = self.ses.post(url, data=data, headers=headers)
+        r3 = self.request('POST', url, data=data, headers=headers)
         if not "RelayState" in r3.content:
             print "at r3:"
             print r3.content
             return
         self.headers = headers
+        from lxml import etree
         xml = etree.fromstring(r3.content)
         forms = xml.findall(".//form")
         if not forms:
@@ -171,22 +290,134 @@ class edXapi(object):
                 data[name] = ie.get("value")
         # print ("data=%s" % data)
         print("action=%s" % action)
-        r4 = self.ses.post(action, data=data)
+        r4 = self.request('POST', action, data=data)
         print r4.content
         dashboard_url = "%s/dashboard" % self.BASE
-        r5 = self.ses.get(dashboard_url)
+        r5 = self.request('GET', dashboard_url)
         #print "r5:"
         #print r5.content
         print("Shibboleth login done")
         self.login_ok = True
         return True
 
+    def request(self, method, url, cache=False, **kwargs):
+        '''
+        Make HTTP request (using the logged-in session); all requests to the edX site go through here.
+        Takes the same arguments as requests.request (plus retries); see RequestDispatcher for
+        how transient failures are retried, and requests rate limited.
+
+        cache = (bool) True if the response to this (GET) request may be served from, and stored
+                in, the response cache (if enabled); see ResponseCache
+        '''
+        if cache and self.response_cache and method=='GET':
+            return self.response_cache.request(self, url, **kwargs)
+        return self.dispatcher.request(self.ses, method, url, **kwargs)
+
+    def invalidate_response_cache(self, *fragments):
+        '''
+        Drop cached responses (if caching) whose URL contains any of the given fragments, or
+        all cached responses, if none are given.
+        '''
+        if self.response_cache:
+            self.response_cache.invalidate(*fragments)
+
     def set_course_id( self, course_id ):
+        '''
+        Switch to another course.  A cached outline is for one course, so an instance switching to
+        another course gets a new (in-memory) outline cache, leaving that of the instance it may be
+        a clone of alone.
+        '''
+        if getattr(self, 'outline_cache', None) and not course_id==self.course_id:
+            self.outline_cache = OutlineCache(ttl=self.outline_cache.ttl, verbose=self.verbose)
         self.course_id = course_id
+
+    def clone(self):
+        '''
+        Return a shallow copy of this edXapi instance, for use by a concurrent worker thread.
+        The copy shares the logged-in requests session (cookies and connection pool), but has
+        its own headers dict, since most methods modify self.headers before making a request.
+        '''
+        other = copy.copy(self)
+        other.headers = dict(getattr(self, 'headers', {}))
+        return other
+
+    def use_metrics(self, metrics):
+        '''
+        Record the request and parse timings of this instance (and of its later clones) in metrics,
+        e.g. a new Metrics for a clone serving one request, instead of in the shared collector.
+        Retry and rate limit settings, and rate limit state, stay shared.
+        '''
+        self.metrics = metrics
+        self.dispatcher = copy.copy(self.dispatcher)
+        self.dispatcher.metrics = metrics
+
+    def set_connection_pool_size(self, size):
+        '''
+        Ensure the requests session keeps at least size connections per host, so that
+        concurrent workers sharing the session don't have their connections discarded.
+        '''
+        if size <= getattr(self, 'connection_pool_size', 10):		# 10 is the requests default
+            return
+        self.connection_pool_size = size
+        if self.transport:
+            self.transport.set_pool_size(size)
+            return
+        adapter = requests.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=size)
+        self.ses.mount('http://', adapter)
+        self.ses.mount('https://', adapter)
+
+    def imap_concurrent(self, func, items, max_workers=4):
+        '''
+        Call func(ea, item) for each item, using a pool of up to max_workers threads, where
+        ea is a clone of this edXapi instance, private to the worker thread.  Generates the
+        results in the same order as items (each is yielded as soon as it, and all the results
+        before it, are available).
+
+        With max_workers <= 1, the calls are made serially, using this instance.
+
+        If sys.stdout or sys.stderr route output per thread (as in the edxcut daemon), the workers
+        use the routes of the calling thread, so that what they print goes where the caller's does.
+        '''
+        items = list(items)
+        max_workers = min(max_workers or 1, len(items))
+        if max_workers <= 1:
+            for item in items:
+                yield func(self, item)
+            return
+
+        from multiprocessing.pool import ThreadPool
+        self.set_connection_pool_size(max_workers)
+        local = threading.local()
+        routes = [(stream, stream.routed()) for stream in (sys.stdout, sys.stderr) if hasattr(stream, 'routed')]
+
+        def call(item):
+            if not hasattr(local, 'ea'):
+                local.ea = self.clone()
+                for stream, target in routes:
+                    stream.route(target)
+            return func(local.ea, item)
+
+        pool = ThreadPool(max_workers)
+        try:
+            for ret in pool.imap(call, items):
+                yield ret
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def map_concurrent(self, func, items, max_workers=4):
+        '''
+        Same as imap_concurrent, but returns the list of all results.
+        '''
+        return list(self.imap_concurrent(func, items, max_workers=max_workers))
     
     def ensure_data_dir_exists(self):
         if not os.path.exists(self.data_dir):
-            os.mkdir(self.data_dir)
+            try:
+                os.mkdir(self.data_dir)
+            except OSError:
+                if not os.path.isdir(self.data_dir):	# may have been made by a concurrent worker
+                    raise
 
     def ensure_studio_site(self):
         if not self.is_studio:
@@ -224,7 +455,7 @@ class edXapi(object):
 
     def get_problem_csrf(self, url_name):
         url = self.jump_to_url(url_name)
-        ret = self.ses.get(url)
+        ret = self.request('GET', url)
         csrf = self.ses.cookies['csrftoken']
         if self.verbose:
             print "[edXapi] get_problem_csrf headers=%s" % ret.headers
@@ -241,7 +472,7 @@ class edXapi(object):
             self.headers['X-CSRFToken'] = self.xblock_csrf
         self.headers['Accept'] = "application/json, text/javascript, */*; q=0.01"
         self.headers['Referer'] = self.jump_to_url(url_name)
-        ret = self.ses.post(burl, data=post_data or {}, headers=self.headers)
+        ret = self.request('POST', burl, data=post_data or {}, headers=self.headers)
         try:
             data = ret.json()
         except Exception as err:
@@ -320,7 +551,7 @@ class edXapi(object):
 
     def get_instructor_dashboard_csrf(self):
         url = '%s#view-data_download' % self.instructor_dashboard_url
-        ret = self.ses.get(url)
+        ret = self.request('GET', url)
         domain = self.BASE.rsplit("//", 1)[-1]
         csrf = self.ses.cookies.get('csrftoken', domain=domain)
         return csrf
@@ -333,9 +564,9 @@ class edXapi(object):
                 print "Got csrf=%s from instructor dashboard" % self.xblock_csrf
         data = data or {}
         self.headers['Referer'] = url
-        ret = self.ses.post(url, data=data, headers=self.headers)
-        if not ret.status_code==200:
-            ret = self.ses.get(url, params=data, headers=self.headers)
+        ret = self.request('POST', url, data=data, headers=self.headers)
+        if not (ret.status_code==200 or ret.status_code in self.dispatcher.retry_statuses):	# try GET, unless server is overloaded
+            ret = self.request('GET', url, params=data, headers=self.headers)
         if self.verbose:
             print "[edxapi] do_instructor_dashboard_action url=%s, return=%s" % (url, ret)
         return ret
@@ -345,12 +576,14 @@ class edXapi(object):
         Get basic course info (start date, end date, ...) from instructor dashboard
         '''
         url = "%s#view-course_info" % self.instructor_dashboard_url
-        ret = self.ses.get(url)
+        ret = self.request('GET', url)
         if self.verbose:
             print("course_info ret=%s" % ret)
         # print ret.content
-        parser = etree.HTMLParser()
-        xml = etree.parse(StringIO(ret.content), parser).getroot()
+        from lxml import etree
+        with self.metrics.phase('parse:get_basic_course_info'):
+            parser = etree.HTMLParser()
+            xml = etree.parse(StringIO(ret.content), parser).getroot()
         bci_div = xml.find('.//div[@class="basic-wrapper"]')
         if bci_div is None:
             return None
@@ -428,7 +661,7 @@ class edXapi(object):
             if m:
                 grade_reports_dict[ name ] = dinfo
                 url = dinfo['url']
-                ret = self.ses.get(url)
+                ret = self.request('GET', url)
         return grade_reports_dict
 
     def get_latest_grade_report( self, grade_report_dict, fname, outputdir ):
@@ -445,7 +678,7 @@ class edXapi(object):
 
         # Download 
         url = grade_report_dict[ latest_file ]['url']
-        ret = self.ses.get(url)
+        ret = self.request('GET', url)
         print "[edXapi] writing original file"
         with open(ofn, 'w') as ofp:
             ofp.write( ret.text.encode('utf-8') )
@@ -506,13 +739,16 @@ class edXapi(object):
         course_id = org + str('/') + shortname + str('/') + term
         return course_id
 
-    def download_student_state_reports(self, module_ids=None, date_filter=None):
+    def list_student_state_reports(self, module_ids=None, date_filter=None):
         '''
-        Download all the student state reports available.
+        List the student state reports available for download.
         These are reports with names of the form "<course_id>_student_state_from_<module_id>_<datetime>.csv"
 
         Limit to date in date_filter if specified.
         Limit to module_ids if specified.
+
+        Returns (downloads, missing_mids), where downloads is a list of dicts (with name, url,
+        module_id, and date), and missing_mids lists the module_ids which have no report.
         '''
         all_downloads = self.list_reports_for_download()['downloads']
 
@@ -543,44 +779,248 @@ class edXapi(object):
         if self.verbose:
             print "Downloading:\n", json.dumps(found_mids, indent=4)
 
-        missing_mids = [x for x in module_ids if not x in found_mids]
+        missing_mids = [x for x in (module_ids or []) if not x in found_mids]
         if self.verbose:
             print "Missing:\n", json.dumps(missing_mids, indent=4)
+        return downloads, missing_mids
+
+    def download_student_state_reports(self, module_ids=None, date_filter=None, max_workers=None, manifest_fn=None,
+                                       reports=None, quiet=False):
+        '''
+        Download all the student state reports available (see list_student_state_reports),
+        concurrently, into data_dir.
+
+        Reports already present in data_dir are skipped, if the server reports the same size
+        (Content-Length), or the same ETag or Last-Modified as recorded in the manifest from
+        an earlier run; this is checked with a conditional GET, whose body is only read if
+        the report is to be (re)downloaded.  Reports are streamed to disk, and moved into
+        place once complete (see download_file).
 
+        reports = (list) report dicts (as returned by list_student_state_reports) to download,
+                  instead of listing the reports available
+        quiet = (bool) if True, do not print progress
+
+        A JSON manifest (by default, student_state_manifest.json in data_dir) lists the
+        reports fetched, skipped, and failed, and the module_ids with no report, in this run,
+        and keeps the size and validators of all reports downloaded so far.
+        Returns the manifest.
+        '''
+        if reports is None:
+            downloads, missing_mids = self.list_student_state_reports(module_ids, date_filter)
+        else:
+            downloads, missing_mids = reports, []
+        self.ensure_data_dir_exists()
+        manifest_fn = manifest_fn or os.path.join(self.data_dir, "student_state_manifest.json")
+        known = {}
+        if os.path.exists(manifest_fn):
+            try:
+                known = json.loads(open(manifest_fn).read()).get('reports', {})
+            except Exception as err:
+                print "[edxapi] ignoring unreadable manifest %s, err=%s" % (manifest_fn, err)
+
+        def download_report(ea, dinfo):
+            name = dinfo['name']
+            url = dinfo['url']
+            ofn = os.path.join(ea.data_dir, name)
+            info = {'module_id': dinfo['module_id'], 'date': dinfo['date']}
+            try:
+                if os.path.exists(ofn):
+                    prev = known.get(name, {})
+                    headers = {}
+                    if prev.get('etag'):
+                        headers['If-None-Match'] = prev['etag']
+                    if prev.get('last_modified'):
+                        headers['If-Modified-Since'] = prev['last_modified']
+                    ret = ea.request('GET', url, headers=headers, stream=True)
+                    ret.close()
+                    size = os.path.getsize(ofn)
+                    etag = ret.headers.get('ETag')
+                    last_modified = ret.headers.get('Last-Modified')
+                    if (ret.status_code==304 or (ret.ok and (ret.headers.get('Content-Length')==str(size)
+                                                             or (etag and etag==prev.get('etag'))
+                                                             or (last_modified and last_modified==prev.get('last_modified'))))):
+                        info.update({'status': 'skipped', 'size': size,
+                                     'etag': etag or prev.get('etag'),
+                                     'last_modified': last_modified or prev.get('last_modified')})
+                        return name, info
+                dl = ea.download_file(url, ofn)
+                info.update({'status': 'fetched', 'size': dl['size'], 'etag': dl['etag'],
+                             'last_modified': dl['last_modified']})
+            except Exception as err:
+                info.update({'status': 'failed', 'error': str(err)})
+            return name, info
+
+        manifest = {'reports': known, 'fetched': [], 'skipped': [], 'failed': [], 'missing': missing_mids}
         cnt = 0
-        for dinfo in downloads:
+        for name, info in self.imap_concurrent(download_report, downloads, max_workers=max_workers or self.max_workers):
             cnt += 1
-            name = dinfo['name']
-            if '_student_state_from_' in name:
-                url = dinfo['url']
-                ret = self.ses.get(url)
-                ofn = '%s/%s' % (self.data_dir, name)
-                with open(ofn, 'w') as ofp:
-                    ofp.write(ret.text)
-                print "[%d] Retrieved %s (%d bytes)" % (cnt, ofn, len(ret.text))
-                sys.stdout.flush()
+            manifest['reports'][name] = info
+            manifest[info['status']].append(name)
+            ofn = os.path.join(self.data_dir, name)
+            if quiet:
+                continue
+            if info['status']=='fetched':
+                print "[%d] Retrieved %s (%d bytes)" % (cnt, ofn, info['size'])
+            elif info['status']=='skipped':
+                print "[%d] Skipped %s (already have %d bytes)" % (cnt, ofn, info['size'])
+            else:
+                print "[%d] Failed to retrieve %s: %s" % (cnt, ofn, info['error'])
+            sys.stdout.flush()
+
+        with atomic_write(manifest_fn) as fp:
+            fp.write(json.dumps(manifest, indent=4, sort_keys=True))
+        if quiet:
+            return manifest
+        print "[edxapi] %d reports fetched, %d skipped, %d failed, %d module_ids missing; manifest in %s" % (len(manifest['fetched']),
+                                                                                                               len(manifest['skipped']),
+                                                                                                               len(manifest['failed']),
+                                                                                                               len(missing_mids),
+                                                                                                               manifest_fn)
+        return manifest
 
-    def enqueue_request_for_problem_responses(self, module_id):
+    def enqueue_request_for_problem_responses(self, module_id, wait=True):
         '''
         Submit queued request for problem responses
+
+        wait = (bool) if True, keep retrying (with exponential backoff) while another problem responses
+               report task is in progress; otherwise, return the server's response straight away
         '''
         url = "%s/api/get_problem_responses" % (self.instructor_dashboard_url)
         data = {'problem_location': module_id}
+        intervals = backoff_intervals(initial=2.0, max_interval=60.0)
         while True:
             ret = self.do_instructor_dashboard_action(url, data)
             try:
-                data = ret.json()
+                rdata = ret.json()
             except Exception as err:
                 return ret
-            if "A problem responses report generation task is already in progress." in data.get('status', ''):
-                print data['status']
-                time.sleep(5)
+            if "A problem responses report generation task is already in progress." in rdata.get('status', ''):
+                if not wait:
+                    return rdata
+                print rdata['status']
+                time.sleep(next(intervals))
                 continue
-            if 'The problem responses report is being created' in data.get('status', ''):
+            if 'The problem responses report is being created' in rdata.get('status', ''):
                 break
             if self.verbose:
-                print "Status: %s" % data.get('status', None)
-        return data
+                print "Status: %s" % rdata.get('status', None)
+            if not wait:
+                break
+        return rdata
+
+    @staticmethod
+    def task_problem_locations(tasks):
+        '''
+        Return set of the problem_location values in the task_input of instructor tasks (as listed by
+        list_instructor_tasks, where task_input is a JSON string, or dict)
+        '''
+        locations = set()
+        for task in tasks:
+            task_input = task.get('task_input') or {}
+            if isinstance(task_input, basestring):
+                try:
+                    task_input = json.loads(task_input)
+                except ValueError:
+                    continue
+            if isinstance(task_input, dict) and task_input.get('problem_location'):
+                locations.add(task_input['problem_location'])
+        return locations
+
+    def get_problem_responses_reports(self, module_ids, deadline=3600, max_interval=60.0, max_misses=3, manifest_fn=None):
+        '''
+        Request problem responses (aka student state) reports for many module_ids, and download
+        each report as soon as it is ready.
+
+        The module_ids are queued, and each is submitted as soon as the server accepts it (the
+        instructor dashboard only runs a limited number of these report tasks at once).  Running
+        tasks are polled (via list_instructor_tasks), with exponential backoff which restarts
+        whenever a request is accepted or a report finishes; new reports are downloaded with
+        download_student_state_reports.  A module_id is deemed failed if its task is no longer
+        running, but no report has appeared, max_misses polls in a row.
+
+        Stops after deadline seconds, leaving any remaining module_ids pending.
+        Progress, with an estimated time to completion, is printed after each poll.
+
+        Returns dict with lists of module_ids done, failed, and pending, and the
+        names of the reports downloaded.
+        '''
+        t0 = time.time()
+        queue = list(OrderedDict.fromkeys(module_ids))
+        ntotal = len(queue)
+        in_flight = OrderedDict()		# module_id -> number of polls for which its task has not been seen
+        done = []
+        failed = []
+        reports = []
+        seen = set([x['name'] for x in self.list_student_state_reports()[0]])	# reports predating this run
+
+        def new_intervals():
+            return backoff_intervals(initial=2.0, max_interval=max_interval, deadline=max(deadline - (time.time() - t0), 0))
+        intervals = new_intervals()
+
+        while queue or in_flight:
+            while queue:			# submit as many requests as the server will take
+                mid = queue[0]
+                ret = self.enqueue_request_for_problem_responses(mid, wait=False)
+                status = ret.get('status', '') if isinstance(ret, dict) else ''
+                if 'The problem responses report is being created' in status:
+                    in_flight[queue.pop(0)] = 0
+                    intervals = new_intervals()
+                elif "already in progress" in status:
+                    break
+                else:
+                    print "[edxapi] problem responses request for %s failed: %s" % (mid, getattr(ret, 'content', ret))
+                    failed.append(queue.pop(0))
+
+            if not in_flight and not queue:
+                break
+            try:
+                time.sleep(next(intervals))
+            except StopIteration:
+                print "\n[edxapi] Waited too long (%s seconds) for problem responses reports: stopping" % deadline
+                break
+
+            tasks = self.list_instructor_tasks()
+            tasks = tasks.get('tasks', []) if isinstance(tasks, dict) else []
+            running = self.task_problem_locations(tasks)
+            new_reports = [x for x in self.list_student_state_reports()[0] if x['name'] not in seen]
+            ready = []
+            for dinfo in new_reports:
+                seen.add(dinfo['name'])
+                if dinfo['module_id'] in in_flight:
+                    in_flight.pop(dinfo['module_id'])
+                    done.append(dinfo['module_id'])
+                    ready.append(dinfo)
+            if ready:
+                manifest = self.download_student_state_reports(reports=ready, manifest_fn=manifest_fn, quiet=True)
+                reports += manifest['fetched'] + manifest['skipped']
+                for name in manifest['failed']:
+                    print "\n[edxapi] failed to retrieve %s: %s" % (name, manifest['reports'][name]['error'])
+                for name in manifest['fetched']:
+                    print "\n[edxapi] retrieved %s" % name
+                intervals = new_intervals()
+            for mid in list(in_flight):
+                if mid in running:
+                    in_flight[mid] = 0
+                    continue
+                in_flight[mid] += 1
+                if in_flight[mid] >= max_misses:
+                    print "\n[edxapi] problem responses task for %s finished without a report" % mid
+                    in_flight.pop(mid)
+                    failed.append(mid)
+
+            elapsed = time.time() - t0
+            nfinished = len(done) + len(failed)
+            eta = "%.0f sec" % (elapsed / nfinished * (ntotal - nfinished)) if nfinished else "unknown"
+            sys.stdout.write("\r[edxapi] problem responses: %d/%d done, %d failed, %d running, %d queued; elapsed %.0f sec, ETA %s  " % (
+                len(done), ntotal, len(failed), len(in_flight), len(queue), elapsed, eta))
+            sys.stdout.flush()
+
+        print
+        return {'done': done,
+                'failed': failed,
+                'pending': list(in_flight) + queue,
+                'reports': reports,
+                }
 
     def do_reset_student_attempts(self, url_name, username=None):
         '''
@@ -659,9 +1099,11 @@ class edXapi(object):
         '''
         self.ensure_studio_site()
         url = "%s/home/" % self.BASE
-        ret = self.ses.get(url)
-        parser = etree.HTMLParser()
-        xml = etree.parse(StringIO(ret.content), parser).getroot()
+        ret = self.request('GET', url, cache=True)
+        from lxml import etree
+        with self.metrics.phase('parse:list_courses'):
+            parser = etree.HTMLParser()
+            xml = etree.parse(StringIO(ret.content), parser).getroot()
         courses = []
         course_ids = []
         for course in xml.findall('.//li[@class="course-item"]'):
@@ -687,10 +1129,11 @@ class edXapi(object):
                 'run': run,
         }
         self.headers['Referer'] = url
-        ret = self.ses.post(url, headers=self.headers, json=data)
+        ret = self.request('POST', url, headers=self.headers, json=data)
         if not ret.status_code==200:
             raise Exception("Failed to create course data=%s, ret=%s" % (json.dumps(data, indent=4), ret.status_code))
         rdat = ret.json()
+        self.invalidate_response_cache("/home/")
         if (not nofail) and ('ErrMsg' in rdat):
             raise Exception("Failed to create course data=%s, ErrMsg=%s, ret=%s" % (json.dumps(data, indent=4), rdat['ErrMsg'], rdat))
         return rdat
@@ -702,9 +1145,10 @@ class edXapi(object):
         self.ensure_studio_site()
         url = "%s/course/%s" % (self.BASE, course_key)
         self.headers['Accept'] = "application/json"
-        ret = self.ses.delete(url, headers=self.headers)
+        ret = self.request('DELETE', url, headers=self.headers)
         if not ret.status_code==200:
             raise Exception("Failed to delete course %s, ret=%s" % (course_key, ret.status_code))
+        self.invalidate_response_cache("/home/", course_key)
         data = ret.json()
         return data
 
@@ -715,7 +1159,7 @@ class edXapi(object):
         self.ensure_studio_site()
         url = '%s/settings/details/%s' % (self.BASE, self.course_id)
         self.headers['Accept'] = "application/json"
-        ret = self.ses.get(url, headers=self.headers)
+        ret = self.request('GET', url, headers=self.headers, cache=True)
         if not ret.status_code==200:
             raise Exception("Failed to get course metadata, url=%s, err=%s" % (url, ret.status_code))
         return ret.json()
@@ -737,7 +1181,8 @@ class edXapi(object):
             update_md.update(new_metadata)
         else:
             update_md = new_metadata
-        ret = self.ses.post(url, json=update_md, headers=self.headers)
+        ret = self.request('POST', url, json=update_md, headers=self.headers)
+        self.invalidate_response_cache('/settings/details/%s' % self.course_id, "/xblock/outline/", "/home/")
         if not ret.status_code==200:
             raise Exception("Failed to update course metadata, url=%s, err=%s" % (url, ret.status_code))
         return ret
@@ -753,74 +1198,222 @@ class edXapi(object):
         ret = self.update_course_metadata(md, single_field=True)
         return ret
 
-    def download_course_tarball(self):
+    def start_course_export(self):
         '''
-        Download tar.gz of full course content (via Studio)
+        Start Studio export of the course (creation of the tarball takes some time; use
+        wait_for_course_export to wait for it to finish).  Returns the export status JSON.
         '''
         self.ensure_studio_site()
-        if self.verbose:
-            print "Downloading tar.gz for %s" % (self.course_id)
-    
         url = '%s/export/%s' % (self.BASE, self.course_id)
-        r1 = self.ses.get(url)
+        r1 = self.request('GET', url)
         self.headers['X-CSRFToken'] = self.ses.cookies['csrftoken']
         self.headers['Referer'] = url
         self.headers['Accept'] = 'application/json, text/javascript, */*; q=0.01'
-        r3 = self.ses.post(url, headers=self.headers)	# start the export process - tarball creation takes some time, poll until done
+        r3 = self.request('POST', url, headers=self.headers)
         if r3.status_code==403:
             print("Sorry, access forbidden for %s" % url)
         try:
             r3j = r3.json()
         except Exception as err:
             raise Exception("[edxapi] unknown response from server (%s): %s" % (url, r3.content))
-        try:
-            cnt = 0
-            estat = r3j['ExportStatus']
-            url = '%s/export_status/%s' % (self.BASE, self.course_id)
-            while not estat==3:
-                cnt += 1
-                sys.stdout.write('.')
-                sys.stdout.flush()
-                if (cnt>300):
-                    raise Exception("[edxapi] Waited too long for export of %s: aborting!" % self.course_id)
-                time.sleep(1)
-                r3 = self.ses.get(url, headers=self.headers)	# start the export process - tarball creation takes some time, poll until done
-                r3j = r3.json()
-                estat = r3j['ExportStatus']
-                if estat==2:
-                    print("\n")
-                    print r3j
-                continue
-            eo = r3j['ExportOutput']
-            print("\nRetrieving course tarball from %s" % eo)
+        return r3j
+
+    def wait_for_course_export(self, status=None, deadline=600):
+        '''
+        Poll Studio export status, with exponential backoff, until the export is done, or until
+        deadline seconds have passed.  Returns the URL of the exported course tarball.
+
+        status = (dict) export status JSON returned by start_course_export, if available
+        '''
+        url = '%s/export_status/%s' % (self.BASE, self.course_id)
+        estat = status['ExportStatus'] if status else None
+        intervals = backoff_intervals(initial=1.0, max_interval=15.0, deadline=deadline)
+        while not estat==3:
+            if estat is not None and estat < 0:
+                raise Exception("[edxapi] Export of %s failed: %s" % (self.course_id, status))
+            try:
+                time.sleep(next(intervals))
+            except StopIteration:
+                raise Exception("[edxapi] Waited too long (%s seconds) for export of %s: aborting!" % (deadline, self.course_id))
+            sys.stdout.write('.')
             sys.stdout.flush()
-            r4 = self.ses.get(eo)
+            status = self.request('GET', url, headers=self.headers).json()
+            estat = status['ExportStatus']
+            if estat==2 and self.verbose:
+                print("\n")
+                print status
+        eo = status['ExportOutput']
+        if eo.startswith('/'):
+            eo = self.BASE + eo
+        return eo
+
+    def download_file(self, url, ofn, chunk_size=1024*1024, max_resumes=5):
+        '''
+        Download url to file ofn, streaming it to disk in chunks of chunk_size bytes.
+
+        The download is written to ofn + ".part", and moved to ofn once complete and verified.
+        Interrupted transfers are resumed (up to max_resumes times) with HTTP Range requests;
+        a partial file left by an earlier process is also resumed, if the server's ETag (or
+        Last-Modified), recorded in ofn + ".part.json", shows that the content is unchanged.
+
+        The size of the download is verified against the Content-Length (or Content-Range),
+        and its MD5 checksum against the Content-MD5 or ETag headers, when these give one.
+
+        Returns dict with the size, md5 and sha256 of the downloaded file, and the server's
+        ETag and Last-Modified headers for it (None if not given).
+        '''
+        pfn = ofn + ".part"
+        mfn = pfn + ".json"
+        validator = None
+        if os.path.exists(pfn) and os.path.exists(mfn):
+            try:
+                with open(mfn) as mfp:
+                    meta = json.loads(mfp.read())
+                if meta.get('url')==url:
+                    validator = meta.get('validator')
+            except Exception as err:
+                pass
+        if os.path.exists(pfn) and not validator:
+            os.unlink(pfn)		# can't tell if partial file is for the same content, so restart
+
+        nresumes = 0
+        while True:
+            have = os.path.getsize(pfn) if os.path.exists(pfn) else 0
+            headers = {}
+            if have:
+                headers['Range'] = 'bytes=%d-' % have
+                if validator:
+                    headers['If-Range'] = validator
+            try:
+                ret = self.request('GET', url, headers=headers, stream=True)
+                if ret.status_code==206:
+                    mode = 'ab'
+                    total = ret.headers.get('Content-Range', '').rsplit('/', 1)[-1]
+                elif ret.status_code==200:
+                    mode = 'wb'
+                    have = 0
+                    total = ret.headers.get('Content-Length')
+                elif ret.status_code==416 and have:		# range not satisfiable; start over
+                    os.unlink(pfn)
+                    continue
+                else:
+                    raise Exception("[edxapi] Failed to download %s, ret=%s" % (url, ret.status_code))
+                total = int(total) if (total and total.isdigit()) else None
+                validator = ret.headers.get('ETag') or ret.headers.get('Last-Modified')
+                if validator:
+                    with atomic_write(mfn) as mfp:
+                        mfp.write(json.dumps({'url': url, 'validator': validator}))
+                if self.verbose:
+                    print "[edxapi] downloading %s (%s bytes, starting at %d)" % (url, total, have)
+                with open(pfn, mode) as fp:
+                    for chunk in ret.iter_content(chunk_size):
+                        fp.write(chunk)
+                size = os.path.getsize(pfn)
+                if total is not None and size < total:
+                    raise requests.exceptions.ChunkedEncodingError("only got %d of %d bytes" % (size, total))
+                break
+            except requests.exceptions.RequestException as err:
+                nresumes += 1
+                if nresumes > max_resumes:
+                    raise Exception("[edxapi] Failed to download %s after %d attempts, err=%s" % (url, nresumes, err))
+                print "[edxapi] download of %s interrupted (%s); resuming" % (url, err)
+                sys.stdout.flush()
+                time.sleep(min(2 ** nresumes, 30))
+
+        if total is not None and not size==total:
+            os.unlink(pfn)
+            raise Exception("[edxapi] Downloaded size %d of %s does not match expected size %s" % (size, url, total))
+        md5 = hashlib.md5()
+        sha256 = hashlib.sha256()
+        with open(pfn, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(chunk_size), ''):
+                md5.update(chunk)
+                sha256.update(chunk)
+        expected_md5 = None
+        if ret.headers.get('Content-MD5'):
+            expected_md5 = base64.b64decode(ret.headers['Content-MD5']).encode('hex')
+        elif re.match('^[0-9a-f]{32}$', ret.headers.get('ETag', '').strip('"')):	# S3 style ETag (non-multipart upload)
+            expected_md5 = ret.headers['ETag'].strip('"')
+        if expected_md5 and not expected_md5==md5.hexdigest():
+            os.unlink(pfn)
+            raise Exception("[edxapi] Checksum mismatch for %s: expected md5 %s, got %s" % (url, expected_md5, md5.hexdigest()))
+        os.rename(pfn, ofn)
+        if os.path.exists(mfn):
+            os.unlink(mfn)
+        return {'size': size, 'md5': md5.hexdigest(), 'sha256': sha256.hexdigest(),
+                'etag': ret.headers.get('ETag'), 'last_modified': ret.headers.get('Last-Modified')}
+
+    def download_course_tarball(self, deadline=600, chunk_size=1024*1024, max_resumes=5):
+        '''
+        Download tar.gz of full course content (via Studio).
+
+        Starts a course export, polls (with exponential backoff) for up to deadline seconds for
+        it to finish, then streams the tarball to a file in data_dir (see download_course_export).
+        Returns the tarball filename.
+        '''
+        self.ensure_studio_site()
+        if self.verbose:
+            print "Downloading tar.gz for %s" % (self.course_id)
+    
+        try:
+            status = self.start_course_export()	# tarball creation takes some time, poll until done
+            eo = self.wait_for_course_export(status, deadline=deadline)
         except Exception as err:
             raise Exception("[edxapi] Failed to retrieve course %s tarball, err=%s, traceback=%s" % (self.course_id, err, traceback.format_exc()))
-            
-        if 0:						# old slash export - deprecated
-            if not r3.ok or (r3.status_code==404):
-                url = '%s/export/slashes:%s+%s?_accept=application/x-tgz' % (self.BASE, self.course_id.replace('/','+'), sem)
-                r3 = self.ses.get(url)
+        return self.download_course_export(eo, chunk_size=chunk_size, max_resumes=max_resumes)
 
-        if len(r4.content) < 100:
-            print "--> ERROR!  Content too short, length=%s, content=%s" % (len(r4.content), r4.content)
-            return
-        if len(r4.content) < 40000 and "Page Not Found" in r4.content:
-            print "--> ERROR!  Page not found, length=%s, content=%s" % (len(r4.content), r4.content)
-            return
+    def download_course_export(self, eo, chunk_size=1024*1024, max_resumes=5):
+        '''
+        Download exported course tarball from URL eo (as returned by wait_for_course_export), to
+        a file in data_dir (see download_file for how interrupted downloads are resumed and
+        verified).  A sha256sum-style checksum file is written alongside.
+
+        Returns the tarball filename (or None, if the download is not a tarball).
+        '''
+        print("\nRetrieving course tarball from %s" % eo)
+        sys.stdout.flush()
 
-        dt = time.ctime(time.time()).replace(' ','_').replace(':','')
-        ofn = '%s/COURSE-%s___%s.tar.gz' % (self.data_dir, self.course_id.replace('/','__'), dt)
         self.ensure_data_dir_exists()
-        with open(ofn, 'w') as fp:
-            fp.write(r4.content)
-        print "--> %s" % (ofn)
+        cfn = 'COURSE-%s' % self.course_id.replace('/','__')
+        tfn = '%s/%s.tar.gz' % (self.data_dir, cfn)		# fixed name while downloading, so it can be resumed
+        info = self.download_file(eo, tfn, chunk_size=chunk_size, max_resumes=max_resumes)
+
+        if info['size'] < 40000:
+            content = open(tfn, 'rb').read()
+            if info['size'] < 100 or "Page Not Found" in content:
+                print "--> ERROR!  Page not found or content too short, length=%s, content=%s" % (info['size'], content[:1000])
+                os.unlink(tfn)
+                return
+
+        dt = time.ctime(time.time()).replace(' ','_').replace(':','')
+        ofn = '%s/%s___%s.tar.gz' % (self.data_dir, cfn, dt)
+        os.rename(tfn, ofn)
+        with open(ofn + '.sha256', 'w') as fp:
+            fp.write("%s  %s\n" % (info['sha256'], os.path.basename(ofn)))
+        print "--> %s (%d bytes, sha256 %s)" % (ofn, info['size'], info['sha256'])
         return ofn
     
-    def upload_course_tarball(self, tfn, nwait=20):
+    IMPORT_STAGES = {0: "Pending", 1: "Unpacking", 2: "Verifying", 3: "Updating", 4: "Success"}
+
+    def upload_course_tarball(self, tfn, chunk_size=20*1000*1000, deadline=600):
+        '''
+        Upload tar.gz file of course content (to Studio site), and wait for its import to finish.
+        Returns True if the import succeeded (see import_course_tarball for the stages seen).
         '''
-        Upload tar.gz file of course content (to Studio site)
+        return self.import_course_tarball(tfn, chunk_size=chunk_size, deadline=deadline)['ok']
+
+    def import_course_tarball(self, tfn, chunk_size=20*1000*1000, deadline=600):
+        '''
+        Upload tar.gz file of course content (to Studio site), and wait for its import to finish.
+
+        The file is sent in chunks of chunk_size bytes, each as a separate multipart POST with a
+        Content-Range header, as done by the Studio import page, so the whole tarball is never held
+        in memory.  Import status is then polled, with exponential backoff, for up to deadline seconds.
+
+        Returns dict with:
+          ok = (bool) True if the import succeeded
+          status = last ImportStatus value (4 = success, negative = failed at that stage, None = unknown)
+          stages = list of dicts (status, stage name, elapsed seconds) of import stages seen, in order
         '''
         self.ensure_studio_site()
         if self.verbose:
@@ -828,47 +1421,85 @@ class edXapi(object):
     
         tfnbn = os.path.basename(tfn)
         url = '%s/import/%s' % (self.BASE, self.course_id)
+        size = os.path.getsize(tfn)
+        if not size:
+            raise Exception("[edxapi] Cannot upload %s: the file is empty" % tfn)
     
-        files = {'course-data': (tfnbn, open(tfn, 'rb'), 'application/x-gzip')}
         csrf = self.ses.cookies['csrftoken']
         if self.verbose:
-            # print "csrf=%s" % csrf
             print url
         headers = {'X-CSRFToken':csrf,
                    'Referer': url,
                    'Accept': 'application/json, text/javascript, */*; q=0.01',
                }
 
-        try:
-            r3 = self.ses.post(url, files=files, headers=headers)
-        except Exception as err:
-            print "Error %s" % str(err)
-            print "url=%s, files=%s, headers=%s" % (url, files, headers)
-            sys.stdout.flush()
-            sys.exit(-1)
-    
-        url = '%s/import_status/%s/%s' % (self.BASE, self.course_id, tfnbn.replace('/','-'))
+        t0 = time.time()
+        with open(tfn, 'rb') as fp:
+            start = 0
+            while True:
+                chunk = fp.read(chunk_size)
+                end = start + len(chunk) - 1
+                headers['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+                files = {'course-data': (tfnbn, chunk, 'application/x-gzip')}
+                try:
+                    r3 = self.request('POST', url, files=files, headers=headers)
+                except Exception as err:
+                    raise Exception("[edxapi] Failed to upload %s (bytes %d-%d of %d) to %s, err=%s" % (tfn, start, end, size, url, err))
+                if not r3.ok:
+                    raise Exception("[edxapi] Upload of %s (bytes %d-%d of %d) to %s failed, status=%s, response=%s" % (tfn, start, end, size, url,
+                                                                                                                   r3.status_code, r3.content[:1000]))
+                if self.verbose:
+                    print "--> bytes %d-%d/%d: %s" % (start, end, size, r3.content[:200])
+                    sys.stdout.flush()
+                start = end + 1
+                if start >= size:
+                    break
+        if self.verbose:
+            print "Uploaded %d bytes in %.1f sec" % (size, time.time() - t0)
+
+        ret = self.wait_for_course_import(tfnbn, deadline=deadline)
+        self.invalidate_response_cache()
+        return ret
+
+    def wait_for_course_import(self, tfnbn, deadline=600):
+        '''
+        Poll Studio import status for the uploaded tarball named tfnbn, with exponential backoff,
+        until the import succeeds or fails, or until deadline seconds have passed.
 
+        Returns dict with ok, status, and stages (see import_course_tarball).
+        '''
+        url = '%s/import_status/%s/%s' % (self.BASE, self.course_id, tfnbn.replace('/','-'))
         if self.verbose:
-            # print "r3 = ", r3.status_code
-            print "--> %s" % (r3.content)
             print url
-    
-        for k in range(nwait):
-            r4 = self.ses.get(url)
+        t0 = time.time()
+        ret = {'ok': False, 'status': None, 'stages': []}
+        intervals = backoff_intervals(initial=0.5, max_interval=15.0, deadline=deadline)
+        while True:
+            r4 = self.request('GET', url, headers=self.headers)
             if r4.ok:
-                if self.verbose:
-                    print r4.content
-                if r4.json()["ImportStatus"]==4:
+                istat = r4.json()["ImportStatus"]
+                if not istat==ret['status']:
+                    stage = self.IMPORT_STAGES.get(abs(istat), "Unknown")
+                    if istat < 0:
+                        stage = "Failed at %s" % stage
+                    ret['stages'].append({'status': istat, 'stage': stage, 'elapsed': time.time() - t0})
                     if self.verbose:
-                        print "Done!"
-                    return True
-            else:
-                if self.verbose:
-                    print r4
-                    sys.stdout.flush()
-            time.sleep(2)
-        return False
+                        print "[edxapi] import of %s: %s (%s)" % (tfnbn, stage, istat)
+                        sys.stdout.flush()
+                ret['status'] = istat
+                if istat==4:
+                    ret['ok'] = True
+                    return ret
+                if istat < 0:
+                    return ret
+            elif self.verbose:
+                print r4
+                sys.stdout.flush()
+            try:
+                time.sleep(next(intervals))
+            except StopIteration:
+                print "[edxapi] Waited too long (%s seconds) for import of %s, last status=%s" % (deadline, tfnbn, ret['status'])
+                return ret
 
     def get_outline(self, usage_key=None):
         '''
@@ -920,22 +1551,38 @@ class edXapi(object):
         }
         '''
         self.ensure_studio_site()
-        usage_key = usage_key or self.create_block_key('course', 'course')
+        course_key = self.create_block_key('course', 'course')
+        usage_key = usage_key or course_key
+        cache_key = (self.BASE, self.course_id)
+        if self.outline_cache and usage_key==course_key:
+            data = self.outline_cache.get_outline(cache_key)
+            if data is not None:
+                return data
         url = "%s/xblock/outline/%s" % (self.BASE, usage_key)
-        ret = self.ses.get(url, headers={'Accept': 'application/json'})
+        ret = self.request('GET', url, headers={'Accept': 'application/json'}, cache=True)
         if not ret.status_code==200:
             raise Exception("Failed to get outline for %s via %s, ret(%s)=%s" % (usage_key, url, ret.status_code, ret.content))
         data = ret.json()
         if self.verbose > 1:
             print "Outline for '%s' has %d children" % (usage_key, len(data['child_info']['children']))
+        if self.outline_cache and usage_key==course_key:
+            self.outline_cache.set_outline(cache_key, data)
         return data
 
+    def invalidate_outline_cache(self):
+        '''
+        Drop the cached course outline (if caching), so that it is re-fetched on next use,
+        e.g. after the course has been changed by some other means.
+        '''
+        if self.outline_cache:
+            self.outline_cache.clear()
+
     def get_outline_via_studio_home_page(self, usage_key=None):
         '''
         Get outline for an edX course (via Studio), via the Studio home page.
         '''
         self.ensure_studio_site()
-        ret = self.ses.get("%s/course/%s" % (self.BASE, self.course_id))
+        ret = self.request('GET', "%s/course/%s" % (self.BASE, self.course_id))
         m = re.search('OutlineFactory\((.*), null\);\n', ret.content, flags=re.MULTILINE)
         # open('foo.html', 'w').write(ret.content)
         if not m:
@@ -947,20 +1594,41 @@ class edXapi(object):
     #-----------------------------------------------------------------------------
     # xblocks: chapter, sequential, vertical, units
 
-    def _get_block_child_info_from_content_preview(self, block_id):
+    def _get_block_child_info_from_content_preview(self, block_id, lazy=None):
         '''
-        Get child info dict from content preview
+        Get child info dict from content preview.
+
+        The child xblocks are retrieved concurrently, using up to self.max_workers threads.
+
+        lazy = (bool) if True, then the child xblocks are not retrieved; instead, LazyXBlock's are
+               returned, with the id, category, and display_name given by the preview, and the
+               rest of each xblock is retrieved on first access.  Defaults to self.lazy_children.
         '''
+        if lazy is None:
+            lazy = self.lazy_children
         xblock = self.get_xblock(usage_key=block_id, view="container_preview")
         html = xblock['html']
-        parser = etree.HTMLParser()
-        xml = etree.parse(StringIO(html), parser).getroot()
+        from lxml import etree
+        with self.metrics.phase('parse:container_preview'):
+            parser = etree.HTMLParser()
+            xml = etree.parse(StringIO(html), parser).getroot()
         ids =[]
-        child_blocks = []
+        names = []
         for elem in xml.findall('.//li[@class="studio-xblock-wrapper is-draggable"]'):
             cid = elem.get('data-locator')
             ids.append(cid)
-            child_blocks.append(self.get_xblock(usage_key=cid))
+            name_elem = elem.find('.//span[@class="xblock-display-name"]')
+            names.append((name_elem.text or '') if name_elem is not None else None)
+        if lazy:
+            child_blocks = []
+            for cid, name in zip(ids, names):
+                fields = {'category': cid.split('+type@', 1)[-1].split('+', 1)[0]}
+                if name is not None:
+                    fields['display_name'] = name
+                child_blocks.append(LazyXBlock(self, cid, **fields))
+        else:
+            child_blocks = self.map_concurrent(lambda ea, cid: ea.get_xblock(usage_key=cid), ids,
+                                               max_workers=self.max_workers)
         child_info = {'children': child_blocks,
                       'child_ids': ids,
                       }
@@ -982,6 +1650,11 @@ class edXapi(object):
         '''
         if (not block_name) and path is not None:
             outline = self.get_outline()   # get outline for course
+            if self.outline_cache:
+                the_block = self.outline_cache.find_path(path, key=(self.BASE, self.course_id),
+                                                         categories=self.content_stages)
+                if the_block is not None:
+                    return the_block
             cnt = 0
             for block_name in path:	# get chapter, sequential, vertical, in that order
                 category = self.content_stages[cnt] if cnt < 3 else None	# no default category after vertical
@@ -992,14 +1665,22 @@ class edXapi(object):
             outline = self.get_outline()   # get outline for course
         the_block = None
         the_block_by_name = None
-        if not 'child_info' in outline:
+        if self.outline_cache and 'child_info' in outline and self.outline_cache.has_block(outline):
+            the_block = self.outline_cache.find_child(outline['id'], block_name)
+            if the_block is not None:
+                if block_category and not the_block['category']==block_category:
+                    raise Exception("[edXapi.get_block_by_name_from_outline] expecting category=%s, got category=%s" % (block_category,
+                                                                                                                        the_block['category']))
+                return the_block
+        child_info = outline.get('child_info')
+        if child_info is None:
             if outline['category']=="vertical":
-                outline['child_info'] = self._get_block_child_info_from_content_preview(outline['id'])
+                child_info = self._get_block_child_info_from_content_preview(outline['id'])
             else:
                 if nofail:
                     return False
                 raise Exception("[edXapi.get_block_by_name_from_outline] Missing child_info in outline %s" % outline)
-        for block in outline['child_info']['children']:
+        for block in child_info['children']:
             cid = block['id']
             if block_category:
                 if not block['category']==block_category:
@@ -1137,7 +1818,7 @@ class edXapi(object):
         if view:
             url = url + "/" + view
         self.headers['Accept'] = "application/json"
-        ret = self.ses.get(url, headers=self.headers, timeout=self.timeout)
+        ret = self.request('GET', url, headers=self.headers, cache=True)
         if not ret.status_code in [200, 204]:
             raise Exception("Failed to get xblock %s, view=%s, ret=%s" % (usage_key, view, ret.status_code))
         return ret.json()
@@ -1170,9 +1851,12 @@ class edXapi(object):
         
         url = '%s/xblock/%s' % (self.BASE, usage_key)
         self.headers['Referer'] =  url
-        ret = self.ses.delete(url, headers=self.headers)
+        ret = self.request('DELETE', url, headers=self.headers)
+        self.invalidate_response_cache("/xblock/")		# also parent's children, and transcripts
         if not ret.status_code in [200, 204]:
             raise Exception("Failed to delete %s, ret=%s, url=%s, content=%s" % (usage_key, ret.status_code, url, ret.content[:1000]))
+        if self.outline_cache:
+            self.outline_cache.remove_block(usage_key)
         if self.verbose:
             print "Deleted %s, ret=%s" % (usage_key, ret.status_code)
         return True
@@ -1203,13 +1887,15 @@ class edXapi(object):
             category = outline['category']
         blocks = []
         block_category = None
-        if not 'child_info' in outline:
+        child_info = outline.get('child_info')
+        if child_info is None:
             if outline['category']=="vertical":
-                outline['child_info'] = self._get_block_child_info_from_content_preview(outline['id'])
+                child_info = self._get_block_child_info_from_content_preview(outline['id'])
             else:
                 raise Exception("[edXapi.list_xblocks] Missing child_info in outline %s" % json.dumps(outline, indent=4))
-        for block in outline['child_info']['children']:
+        for block in child_info['children']:
             if 'child_info' in block:
+                block = dict(block)		# don't modify the (possibly cached) outline
                 block.pop('child_info')
             blocks.append(block)
             if not block_category:
@@ -1262,7 +1948,8 @@ class edXapi(object):
         self.headers['Referer'] = url
         if usage_key:
             url += usage_key
-        ret = self.ses.post(url, json=post_data, headers=self.headers)
+        ret = self.request('POST', url, json=post_data, headers=self.headers)
+        self.invalidate_response_cache("/xblock/outline/", parent_locator)
         if not ret.status_code==200:
             msg = "[edXapi] Failed to create new %s in course %s with post_data=%s" % (category, self.course_id, str(post_data)[:200])
             msg += "\nret=%s" % ret.content
@@ -1275,6 +1962,16 @@ class edXapi(object):
                 print "request headers: ", ret.request.headers
             raise Exception(msg)
         rdat = ret.json()
+        if self.outline_cache:
+            block = {'id': rdat['locator'],
+                     'category': category,
+                     'display_name': name,
+            }
+            if category in self.content_stages[:2]:	# the outline lists children of chapters and sequentials
+                block['child_info'] = {'category': self.content_stages[self.content_stages.index(category)+1],
+                                       'children': [],
+                }
+            self.outline_cache.add_block(parent_locator, block)
         if data:
             block_id = rdat['locator']
             return self.update_xblock(usage_key=block_id, data=data)
@@ -1314,7 +2011,8 @@ class edXapi(object):
                     if the_block==False:	# block was missing; create it
                         ret = self.create_xblock(parent_locator=outline['id'], category=block_category, name=name)
                         the_block_id = ret['locator']
-                        the_block = self.get_xblock(usage_key=the_block_id)
+                        the_block = self.outline_cache and self.outline_cache.get_block(the_block_id)
+                        the_block = the_block or self.get_xblock(usage_key=the_block_id)
                         if self.verbose:
                             print "[edXapi.update_xblock] created block '%s' = %s" % (name, the_block_id)
                     outline = the_block
@@ -1333,10 +2031,18 @@ class edXapi(object):
         post_data.update(extra_data or {})
         url = '%s/xblock/%s' % (self.BASE, usage_key)
         self.headers['Referer'] = url
-        ret = self.ses.post(url, json=post_data, headers=self.headers)
+        ret = self.request('POST', url, json=post_data, headers=self.headers)
+        parent_locator = self.outline_cache and self.outline_cache.parent_of.get(usage_key)
+        if parent_locator:		# parent's container preview and children listing show this block
+            self.invalidate_response_cache("/xblock/outline/", usage_key, parent_locator)
+        else:
+            self.invalidate_response_cache("/xblock/")	# parent unknown
         if not ret.status_code==200:
             print("[edXapi.update_xblock] Failure with post_data=%s, headers=%s" % (post_data, self.headers))
             raise Exception("[edXapi.update_xblock] Failed to update xblock %s, ret=%s" % (usage_key, ret.status_code))
+        metadata = post_data.get('metadata') or {}
+        if self.outline_cache and 'display_name' in metadata:
+            self.outline_cache.update_block(usage_key, display_name=metadata['display_name'])
         return ret.json()
 
     def get_xblock_metadata(self, usage_key):
@@ -1364,12 +2070,169 @@ class edXapi(object):
         if not 'type@sequential' in usage_key:
             raise Exception("[get_due_date] block type must be sequential")
         md = self.set_xblock_metadata(usage_key, {'due': due_date})
+        if self.outline_cache:
+            self.outline_cache.update_block(usage_key, due=md.get('due', due_date))
         return md
 
-    def set_all_due_dates(self, due_date):
+    DUE_DATE_PATTERN = re.compile('^(\d{4})-(\d{2})-(\d{2})(?:[T ](\d{1,2}):(\d{2})(?::(\d{2})(?:\.\d*)?)?)?'
+                                  '\s*(Z|[+-]\d{2}:?\d{2})?$')
+
+    @staticmethod
+    def normalize_due_date(due_date):
+        '''
+        Normalize due date (e.g. "2016-01-07 09:00-05:00" -> "2016-01-07T14:00:00Z", "2016-01-07" ->
+        "2016-01-07T00:00:00Z"), for comparisons.  Strings with an offset are converted to UTC; those without
+        are taken to be UTC.  Also accepts datetime objects (e.g. as loaded from YAML), which are taken to
+        be UTC if naive.  Strings which are not ISO 8601 dates are returned as they are (stripped).
+        '''
+        if not due_date:
+            return None
+        if isinstance(due_date, basestring):
+            m = edXapi.DUE_DATE_PATTERN.match(due_date.strip())
+            if m:
+                import datetime
+                fields = [int(x or 0) for x in m.groups()[:6]]
+                if m.group(4) is None:
+                    due_date = datetime.date(*fields[:3])
+                else:
+                    due_date = datetime.datetime(*fields)
+                    offset = m.group(7)
+                    if offset and not offset=='Z':
+                        sign = -1 if offset[0]=='-' else 1
+                        offset = offset[1:].replace(':', '')
+                        due_date -= sign * datetime.timedelta(hours=int(offset[:2]), minutes=int(offset[2:]))
+        if hasattr(due_date, 'isoformat'):
+            if getattr(due_date, 'utcoffset', lambda: None)() is not None:
+                due_date = due_date.replace(tzinfo=None) - due_date.utcoffset()
+            if not hasattr(due_date, 'hour'):		# a date, without a time
+                due_date = "%sT00:00:00Z" % due_date.isoformat()
+            else:
+                due_date = due_date.strftime("%Y-%m-%dT%H:%M:%SZ")
+        due_date = due_date.strip()
+        if due_date.endswith('+00:00'):
+            due_date = due_date[:-6] + 'Z'
+        return due_date
+
+    @staticmethod
+    def load_due_date_map(fn):
+        '''
+        Load mapping of sequentials to due dates from a file, in YAML (or JSON) or CSV format.
+
+        YAML and JSON files should contain a dict, with sequentials (given by usage key, url_name,
+        or display_name) as keys, and due dates (strings like "2016-01-07T14:00:00Z") as values.
+
+        CSV files should have two columns: the sequential, and its due date.  An optional header row is
+        recognized by having a column named "due" or "due_date".  CSV files are read as UTF-8.
+
+        Returns OrderedDict of sequential (unicode): normalized due date, in the order of the file.
+        '''
+        if fn.endswith('.csv'):
+            import csv
+            with open(fn) as fp:
+                rows = [[x.decode('utf8').strip() for x in row] for row in csv.reader(fp) if row]
+            if rows and set(['due', 'due_date']).intersection([x.lower() for x in rows[0]]):
+                rows = rows[1:]
+            pairs = [(row[0], row[1]) for row in rows]
+        else:
+            import yaml
+
+            class OrderedLoader(yaml.SafeLoader):
+                pass
+
+            def construct_mapping(loader, node):
+                loader.flatten_mapping(node)
+                return OrderedDict(loader.construct_pairs(node))
+
+            OrderedLoader.add_constructor(yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG, construct_mapping)
+            with open(fn) as fp:
+                due_dates = yaml.load(fp, Loader=OrderedLoader)
+            if not isinstance(due_dates, dict):
+                raise Exception("[edXapi.load_due_date_map] %s should specify a dict of sequential: due date" % fn)
+            pairs = [(k if isinstance(k, unicode) else str(k).decode('utf8'), v) for (k, v) in due_dates.items()]
+        return OrderedDict([(k, edXapi.normalize_due_date(v)) for (k, v) in pairs])
+
+    def set_due_dates(self, due_dates=None, default_due=None, only_if_due=True, dry_run=False, max_workers=None):
+        '''
+        Set due dates for many sequentials at once, changing only those whose due date differs from
+        the one desired.  Existing due dates are read from the course outline (a single request), and
+        the changed sequentials are then updated concurrently.
+
+        due_dates = (dict) mapping from sequential (usage key, url_name, or display_name) to due date
+        default_due = (string) due date for sequentials not in due_dates (if None, leave those unchanged)
+        only_if_due = (bool) if True, then default_due is only applied to sequentials which already have a due date
+        dry_run = (bool) if True, then report the changes which would be made, but don't make them
+        max_workers = (int) maximum number of concurrent updates (defaults to self.max_workers)
+
+        Due dates should be strings like "2016-01-07T14:00:00Z".
+
+        Returns dict with counts of chapters, sequentials (changed), unchanged sequentials, and
+        sequentials skipped for having no due date (had_no_due), together with the list of changes
+        made, and the list of keys from due_dates which did not match any sequential (unmatched).
+        '''
+        due_dates = due_dates or {}
+        outline = self.get_outline()	# has course, chapter, and sequential blocks in JSON format
+        counts = defaultdict(int)
+        changes = []
+        matched = set()
+        for chapter in outline['child_info']['children']:
+            counts['chapter'] += 1
+            for sequential in chapter.get('child_info', {}).get('children', []):
+                usage_key = sequential['id']
+                if not 'type@sequential' in usage_key:
+                    continue
+                old_due = self.normalize_due_date(sequential.get('due'))
+                for key in [usage_key, usage_key.rsplit('@', 1)[-1], sequential.get('display_name')]:
+                    if key in due_dates:
+                        new_due = self.normalize_due_date(due_dates[key])
+                        matched.add(key)
+                        break
+                else:
+                    if default_due is None or (only_if_due and not old_due):
+                        counts['had_no_due' if not old_due else 'unchanged'] += 1
+                        continue
+                    new_due = self.normalize_due_date(default_due)
+                if new_due==old_due:
+                    counts['unchanged'] += 1
+                    continue
+                changes.append({'id': usage_key,
+                                'display_name': sequential.get('display_name'),
+                                'chapter': chapter.get('display_name'),
+                                'old_due': old_due,
+                                'new_due': new_due,
+                                })
+        unmatched = [x for x in due_dates if x not in matched]
+
+        if dry_run or self.verbose:
+            print "%s due dates of %d sequentials (%d unchanged, %d without due date):" % ("Would change" if dry_run else "Changing",
+                                                                                           len(changes),
+                                                                                           counts['unchanged'],
+                                                                                           counts['had_no_due'])
+            for change in changes:
+                print "    %s / %s: %s -> %s" % (change['chapter'], change['display_name'], change['old_due'], change['new_due'])
+            if unmatched:
+                print "Warning: no sequentials found for %s" % unmatched
+            sys.stdout.flush()
+
+        if not dry_run:
+            def set_due(ea, change):
+                ea.set_due_date(change['id'], change['new_due'])
+                return change
+            for change in self.imap_concurrent(set_due, changes, max_workers=max_workers or self.max_workers):
+                counts['sequential'] += 1
+                if (counts['sequential'] % 10)==0:
+                    print "  ...Processed %d of %d sequentials" % (counts['sequential'], len(changes))
+                    sys.stdout.flush()
+
+        summary = dict(counts)
+        summary['changes'] = changes
+        summary['unmatched'] = unmatched
+        summary['dry_run'] = dry_run
+        return summary
+
+    def set_all_due_dates(self, due_date, dry_run=False):
         '''
-        Set all due dates for sequential blocks in course.
-        Note this can be slow!
+        Set all due dates for sequential blocks in course (which already have a due date).
+        Only the sequentials whose due date differs are updated (see set_due_dates).
 
         outline is JSON with this format:
 
@@ -1402,26 +2265,7 @@ class edXapi(object):
         '''
         print("Changing due dates in all sequentials in course to %s" % due_date)
         sys.stdout.flush()
-        outline = self.get_outline()	# has course, chapter, and sequential blocks in JSON format
-        counts = defaultdict(int)
-        for chapter in outline['child_info']['children']:
-            counts['chapter'] += 1
-            sys.stdout.write("  Changing due dates in %s" % chapter['id'])
-            sys.stdout.flush()
-            for sequential in chapter['child_info']['children']:
-                usage_key = sequential['id']
-                if not 'type@sequential' in usage_key:
-                    continue
-                old_due = self.get_due_date(usage_key)
-                if old_due:
-                    md = self.set_due_date(usage_key, due_date)
-                    counts['sequential'] += 1
-                else:
-                    counts['had_no_due'] += 1
-                if (counts['sequential'] % 10)==0:
-                    sys.stdout.write("  ...Processed %d chapters and %d sequentials (skipped %s)" % (counts['chapter'], counts['sequential'], counts['had_no_due']))
-                    sys.stdout.flush()
-        return counts
+        return self.set_due_dates(default_due=due_date, only_if_due=True, dry_run=dry_run)
 
     #-----------------------------------------------------------------------------
     # static assets
@@ -1468,7 +2312,7 @@ class edXapi(object):
             }
             url = '%s/assets/%s/' % (self.BASE, self.course_id)        # http://192.168.33.10:18010/assets/course-v1:edX+DemoX+Demo_Course/
             self.headers['Accept'] = "application/json"
-            ret = self.ses.get(url, params=data, headers=self.headers)
+            ret = self.request('GET', url, params=data, headers=self.headers, cache=True)
             if not ret.status_code==200:
                 raise Exception('[edXapi.list_static_assets] Failed to get static asset loist, url=%s, err=%s' % (url, ret.status_code))
             retdat = ret.json()
@@ -1505,7 +2349,7 @@ class edXapi(object):
         static_asset_url = "%s/asset-v1:%s+type@asset+block/%s" % (self.BASE, course_key, normalized_url)
         self.csrf = self.ses.cookies['csrftoken']
         self.headers = {'X-CSRFToken': self.csrf}
-        ret = self.ses.get(static_asset_url, headers=self.headers)
+        ret = self.request('GET', static_asset_url, headers=self.headers)
         if not ret.status_code==200:
             if nofail:
                 return None
@@ -1529,7 +2373,8 @@ class edXapi(object):
         url = '%s/assets/%s/' % (self.BASE, self.course_id)        # http://192.168.33.10:18010/assets/course-v1:edX+DemoX+Demo_Course/
         self.headers['Accept'] = "application/json"
         self.headers['Referer'] = url
-        ret = self.ses.post(url, files=files, data=data, headers=self.headers)
+        ret = self.request('POST', url, files=files, data=data, headers=self.headers)
+        self.invalidate_response_cache('/assets/%s/' % self.course_id)
         if not ret.status_code==200:
             print('[edXapi.upload_static_asset] Failed, headers=%s, cookies=%s' % (self.headers, self.ses.cookies))
             raise Exception('[edXapi.upload_static_asset] Failed to upload %s, to url=%s, err=%s' % (fn, url, ret.status_code))
@@ -1557,7 +2402,8 @@ class edXapi(object):
         data = {'format': 'json'}
         url = '%s/assets/%s/%s' % (self.BASE, self.course_id, asset_key)
         self.headers['Accept'] = "application/json"
-        ret = self.ses.delete(url, data=data, headers=self.headers)
+        ret = self.request('DELETE', url, data=data, headers=self.headers)
+        self.invalidate_response_cache('/assets/%s/' % self.course_id)
         if not ret.status_code in [200, 204]:
             raise Exception('[edXapi.delete_static_asset] Failed to delete %s, using url=%s, err=%s' % (fn, url, ret.status_code))
         try:
@@ -1590,7 +2436,7 @@ class edXapi(object):
                                                                              lang,
         )
         self.headers['Accept'] = "application/json"
-        ret = self.ses.get(url, params=data, headers=self.headers)
+        ret = self.request('GET', url, params=data, headers=self.headers, cache=True)
         if not ret.status_code==200:
             raise Exception('[edXapi.get_video_transcript] Failed to retrieve transcript for %s, via url=%s, err=%s' % (url_name,
                                                                                                                         ret.request.url,
@@ -1628,7 +2474,8 @@ class edXapi(object):
         url = '%s/transcripts/upload' % (self.BASE)	# http://192.168.33.10:18010/transcripts/upload
         self.headers['Accept'] = "application/json"
         self.headers['Referer'] = url
-        ret = self.ses.post(url, files=files, data=data, headers=self.headers)
+        ret = self.request('POST', url, files=files, data=data, headers=self.headers)
+        self.invalidate_response_cache("/handler/transcript/")
         if not ret.status_code==200:
             if self.verbose:
                 print "[edXapi.upload_transcript] failed, data=%s" % json.dumps(data, indent=4)
@@ -1646,6 +2493,7 @@ class edXapi(object):
         :param speed: speed of `sjson_subs`.
         :returns: "srt" subs.
         """
+        from pysrt import SubRipTime, SubRipItem
     
         output = ''
     
@@ -1671,18 +2519,6 @@ class edXapi(object):
 #-----------------------------------------------------------------------------
 # unit tests for edXapi
 
-@pytest.fixture(scope="module")
-def eapi():
-    course_id = "course-v1:edX+DemoX+Demo_Course"
-    ea = edXapi("http://192.168.33.10:18000", "staff@example.com", "edx", course_id=course_id)
-    return ea
-
-@pytest.fixture(scope="module")
-def eapi_studio():
-    cid = "course-v1:edX+DemoX+Demo_Course"
-    ea = edXapi("http://192.168.33.10:18010", "staff@example.com", "edx", studio=True, course_id=cid)
-    return ea
-
 def test_course_info(eapi):
     ea = eapi
     data = ea.get_basic_course_info()
@@ -1776,9 +2612,10 @@ def x_test_upload_course():
     cid = "course-v1:edX+DemoX+Demo_Course"
     tfn = glob.glob("DATA/COURSE-course-v1:edX+DemoX+Demo_Course___*.tar.gz")[0]
     ea = edXapi("http://192.168.33.10:18010", "staff@example.com", "edx", studio=True, course_id=cid)
-    ret = ea.upload_course_tarball(tfn)
+    ret = ea.import_course_tarball(tfn)
     print "returned %s" % ret
-    assert ret
+    assert ret['ok']
+    assert ret['stages'][-1]['stage']=="Success"
 
 def test_course_outline(eapi_studio):
     ea = eapi_studio
@@ -1803,6 +2640,44 @@ def test_list_xblocks2(eapi_studio):
     assert ("Code Grader" in data['titles'])
     assert ("The edX system is capable of reviewing computer code" in data['blocks'][0]['data'])
 
+def test_list_xblocks_lazy():
+    cid = "course-v1:edX+DemoX+Demo_Course"
+    ea = edXapi("http://192.168.33.10:18010", "staff@example.com", "edx", studio=True, course_id=cid,
+                lazy_children=True)
+    data = ea.list_xblocks(path=["Example Week 2: Get Interactive", "Homework - Labs and Demos", "Code Grader"])
+    assert ("Code Grader" in data['titles'])
+    block = data['blocks'][0]
+    assert isinstance(block, LazyXBlock) and not block.loaded
+    assert block['category']=="html"
+    assert ("The edX system is capable of reviewing computer code" in block['data'])
+    assert block.loaded
+
+def test_load_due_date_map():
+    fn = "/tmp/edxapi_tmp_due_dates.csv"
+    open(fn, 'w').write("sequential,due\nhw1,2016-01-07T14:00:00Z\nLab 2,2016-01-14T14:00:00+00:00\nD\xc3\xa9fi,2016-01-21\n")
+    due_dates = edXapi.load_due_date_map(fn)
+    assert due_dates.keys()==['hw1', 'Lab 2', u'D\xe9fi']
+    assert due_dates['Lab 2']=="2016-01-14T14:00:00Z"
+    assert due_dates[u'D\xe9fi']=="2016-01-21T00:00:00Z"
+    assert edXapi.normalize_due_date("2016-01-21T14:00:00-05:00")=="2016-01-21T19:00:00Z"
+    assert edXapi.normalize_due_date("2016-01-21 14:00")=="2016-01-21T14:00:00Z"
+    assert edXapi.normalize_due_date("2016-01-21T23:30:00.5+0130")=="2016-01-21T22:00:00Z"
+    assert edXapi.normalize_due_date(" next week ")=="next week"
+    fn = "/tmp/edxapi_tmp_due_dates.yaml"
+    open(fn, 'w').write("hw3: 2016-01-21\n'Lab 2': 2016-01-14 09:00:00-05:00\nD\xc3\xa9fi: 2016-01-07T14:00:00Z\n12: 2016-02-01\n")
+    due_dates = edXapi.load_due_date_map(fn)
+    assert due_dates.items()==[('hw3', "2016-01-21T00:00:00Z"), ('Lab 2', "2016-01-14T14:00:00Z"),
+                               (u'D\xe9fi', "2016-01-07T14:00:00Z"), ('12', "2016-02-01T00:00:00Z")]
+    assert all([isinstance(k, unicode) for k in due_dates])
+
+def test_task_problem_locations():
+    mid = "block-v1:edX+DemoX+Demo_Course+type@problem+block@p1"
+    tasks = [{'task_input': json.dumps({'problem_location': mid + "0"})},
+             {'task_input': {'problem_location': mid + "1"}},
+             {'task_input': "not json"}, {}]
+    locations = edXapi.task_problem_locations(tasks)
+    assert locations==set([mid + "0", mid + "1"]) and not mid in locations
+
 def test_get_xblock1(eapi_studio):
     ea = eapi_studio
     data = ea.get_xblock(path=["Example Week 2: Get Interactive", "Homework - Labs and Demos", "Code Grader", "Code Grader"])
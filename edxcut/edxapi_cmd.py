@@ -1,9 +1,16 @@
+import os
 import sys
 import json
+import time
 import argparse
+import threading
+
+from contextlib import contextmanager
+from collections import OrderedDict
 
 from edxapi import edXapi
 from ccxapi import ccXapi
+from cassette import make_transport
 
 #-----------------------------------------------------------------------------
 
@@ -15,21 +22,24 @@ class VAction(argparse.Action):
 
 #-----------------------------------------------------------------------------
 
-def CommandLine(args=None, arglist=None):
+def make_parser():
     '''
-    edxapi command line.  Accepts args, to allow for simple unit testing.
+    Return the argparse parser for the edxapi command line
     '''
     help_text = """usage: edxcut edxapi [command] [args...] ...
 
 Commands:
 
 list_reports               - list reports available for download in the instructor dashboard
-get_problem_responses      - enqueue request for problem responses; specify module_id (as block_id)
-                             or use --module-id-from-csv 
+get_problem_responses      - request problem responses reports, and download each when ready; specify module_id
+                             (as block_id) or use --module-id-from-csv; stops after --deadline seconds (default 3600)
 download_student_state     - download problem response (aka student state) reports which are avaialble
 get_course_info            - extract basic course info (eg start and end dates) from the instructor dashboard
 download_course            - downlaod course tarball (from edX CMS studio site)
 upload_course <tfn>        - upload the specified course .tar.gz file
+download_courses [<id>...] - download tarballs of the specified courses, concurrently (defaults to all courses,
+                             or those listed in --course-list, or the failed ones in --retry-failed manifest)
+upload_courses <tfn>...    - upload the specified course .tar.gz files (as named by download_course), concurrently
 list_courses               - list courses (in an edX CMS studio site), e.g.
                              edxcut edxapi --json-output -s http://192.168.33.10:18010 -u staff@example.com -p edx -S list_courses
 get_course_metadata        - get course metadata (JSON), e.g. start and end dates (from Studio)
@@ -59,6 +69,9 @@ update_xblock <path>       - update (and optionally create all needed) xblock at
 get_due_date <id>          - get due date for specified block ID (should be a sequential)
 set_due_date <id> <date>   - set due date for specified block ID (should be a sequential); date should be like "2016-01-07T14:00:00Z"
 set_all_due_dates <date>   - set all due dates for sequential blocks in course, to that specified
+set_due_dates <fn> [<date>] - set due dates of sequentials given by mapping file (YAML or CSV, of sequential
+                             url_name, display_name, or block ID, and due date); optionally set all other
+                             sequentials which have due dates to <date>.  Use --dry-run to just list changes.
 get_video_transcript <id>  - get transcript srt.sjson data for a given url_name (id), e.g.:
                              edxcut edxapi -v -j -s http://192.168.33.10 -u staff@example.com -p edx \
                                     -c course-v1:edX+DemoX+Demo_Course \
@@ -73,6 +86,13 @@ get_asset_info <fn>         - retrieve metadata about single static asset file
 upload_asset <fn>           - upload a single static asset file
 delete_asset <fn | blockid> - delete a single static asset file (or specify usage key / block ID)
 
+batch [<fn>]                - run many of the commands above, read from file fn (or stdin, if fn is missing or "-"),
+                              with one login; commands are JSON lines or a YAML list, e.g.
+                              {"cmd": "update_xblock", "args": ["ch1", "seq1", "vert1", "intro"], "type": "html", "data": "<p>hi</p>"}
+                              Results are written as JSON lines, to stdout (or --batch-results).  With --batch-jobs N,
+                              commands run concurrently, except for those in the same "group", which run in order;
+                              {"cmd": "barrier"} waits for all earlier commands to finish.
+
 Commands for CCX course instances:
 
 list_students               - list students enrolled in CCX instance
@@ -105,36 +125,154 @@ enroll_student <email>      - enroll student in CCX instance
     parser.add_argument("--auth", help="http basic auth username,pw to use for OpenEdX site access", default=None)
     parser.add_argument("--date", type=str, help="date filter for selecting which files to download, in YYYY-MM-DD format", default=None)
     parser.add_argument("--ccx", help="Perform actions on a CCX course instance", action="store_true")
-    
-    if not args:
-        args = parser.parse_args(arglist)
-    
-    if args.auth:
-        args.auth = tuple(args.auth.split(',', 1))
-
+    parser.add_argument("--outline-cache", type=str, help="file in which to cache the course outline, for reuse by later commands", default=None)
+    parser.add_argument("--outline-cache-ttl", type=float, help="seconds for which a cached course outline remains valid", default=300)
+    parser.add_argument("--jobs", type=int, help="maximum number of concurrent requests to the edX site", default=8)
+    parser.add_argument("--deadline", type=float, help="seconds to wait for long-running server tasks, e.g. course export", default=None)
+    parser.add_argument("--dry-run", help="for set_due_dates and set_all_due_dates, only show changes which would be made", action="store_true")
+    parser.add_argument("--course-list", type=str, help="file with course_id values (one per line), for download_courses", default=None)
+    parser.add_argument("--retry-failed", type=str, help="manifest file from earlier download_courses or upload_courses; only retry failed courses", default=None)
+    parser.add_argument("--max-exports", type=int, help="maximum number of course exports to run at once on Studio, for download_courses", default=2)
+    parser.add_argument("--manifest", type=str, help="output manifest file for download_courses, upload_courses, download_student_state, and get_problem_responses", default=None)
+    parser.add_argument("--record", type=str, help="record all HTTP requests and responses to this cassette file (.jsonl.gz)", default=None)
+    parser.add_argument("--replay", type=str, help="replay HTTP responses from this cassette file, instead of accessing the edX site", default=None)
+    parser.add_argument("--replay-latency", type=str, help="delay for each replayed request: seconds, or 'recorded' for the recorded times", default=None)
+    parser.add_argument("--session-cache", type=str, nargs='?', const=True, default=None,
+                        help="reuse the login session from earlier runs, stored in this directory (default ~/.edxcut/sessions)")
+    parser.add_argument("--retries", type=int, help="number of times to retry requests which fail transiently (e.g. 429, 502, 503, 504)", default=3)
+    parser.add_argument("--rate-limit", type=float, help="maximum number of requests per second to the edX site", default=None)
+    parser.add_argument("--timeout", type=float, help="seconds to wait for each request to the edX site to respond", default=None)
+    parser.add_argument("--metrics-file", type=str, help="write request and parse timings to this file (Prometheus text if it ends in .prom, else JSON)", default=None)
+    parser.add_argument("--response-cache", type=str, nargs='?', const=True, default=None,
+                        help="cache responses of read-only requests (e.g. outline, xblocks, assets), revalidating them with "
+                        "conditional requests; in memory, and also in this directory, if given")
+    parser.add_argument("--response-cache-ttl", type=float, help="seconds for which cached responses without ETag or "
+                        "Last-Modified are used without revalidation", default=60)
+    parser.add_argument("--lazy-children", help="only list ids and names of xblocks in verticals, without retrieving their content", action="store_true")
+    parser.add_argument("--batch-jobs", type=int, help="for batch, number of commands to run concurrently", default=1)
+    parser.add_argument("--batch-results", type=str, help="for batch, file to write results (JSON lines) to, instead of stdout", default=None)
+    parser.add_argument("--stop-on-error", help="for batch, start no more commands after one fails", action="store_true")
+    parser.add_argument("--daemon", help="run the command in the edxcut serve daemon (started if needed), which keeps "
+                        "logged-in sessions warm; runs in-process if the daemon is unavailable", action="store_true")
+    parser.add_argument("--daemon-socket", type=str, help="Unix socket of the edxcut serve daemon (default ~/.edxcut/edxcut.sock)",
+                        default=None)
+    return parser
+
+def make_api(args, **kwargs):
+    '''
+    Return a logged-in edXapi (or ccXapi, for CCX courses) instance, as specified by args.
+    Additional keyword arguments are passed on to the instance constructor.
+    '''
     apimod = edXapi
-    if args.ccx or args.course_id.startswith("ccx-v1:"):
+    if args.ccx or (args.course_id or '').startswith("ccx-v1:"):
         apimod = ccXapi			# enable additioanl CCX-specific commands for CCX course instances
 
+    return apimod(base=args.site_base_url, username=args.username, password=args.password,
+                  course_id=args.course_id, data_dir=args.data_dir, verbose=args.verbose,
+                  studio=args.studio, auth=tuple(args.auth.split(',', 1)) if args.auth else None,
+                  outline_cache_file=args.outline_cache, outline_cache_ttl=args.outline_cache_ttl,
+                  max_workers=args.jobs, lazy_children=args.lazy_children, session_cache=args.session_cache,
+                  retries=args.retries, rate_limit=args.rate_limit, timeout=args.timeout,
+                  response_cache=args.response_cache, response_cache_ttl=args.response_cache_ttl,
+                  transport=make_transport(record=args.record, replay=args.replay, latency=args.replay_latency),
+                  **kwargs)
+
+def CommandLine(args=None, arglist=None):
+    '''
+    edxapi command line.  Accepts args, to allow for simple unit testing.
+    '''
+    if not args:
+        args = make_parser().parse_args(arglist)
+
     try:
-        ea = apimod(base=args.site_base_url, username=args.username, password=args.password,
-                    course_id=args.course_id, data_dir=args.data_dir, verbose=args.verbose,
-                    studio=args.studio, auth=args.auth)
+        ea = make_api(args)
     except Exception as err:
         print err
         print "Error accessing OpenEdX site - if you're accessing Studio, did you specify the -S flag?"
         sys.exit(-1)
 
+    if not ea.login_ok:
+        print "Error - login failed, aborting actions"
+        sys.exit(-1)
+
+    execute(ea, args)
+
+def execute(ea, args, batch_in=None, batch_out=None):
+    '''
+    Run the command given by args (a single command, or a batch), with the logged-in instance ea,
+    write metrics (if requested), and print the result as requested by args.  For a batch,
+    batch_in and batch_out may be given, to use instead of stdin and stdout.
+    '''
     ret = None
+    if args.cmd=="batch":
+        nfailed = run_batch(ea, args, ifp=batch_in, ofp=batch_out)
+    else:
+        try:
+            ret = run_command(ea, args)
+        except UnknownCommand as err:
+            print err
+
+    if args.metrics_file:
+        ea.metrics.write(args.metrics_file)
+        if args.verbose:
+            ea.metrics.print_summary()
+
+    if args.cmd=="batch":
+        if nfailed:
+            sys.exit(1)
+        return
+
+    if args.json_output_html:
+        print ret['html']
+    elif args.output_srt:
+        print ret
+    elif args.json_output and ret is not None:
+        try:
+            print json.dumps(ret, indent=4)
+        except Exception as err:
+            print("Output is not JSON serializable, ret=%s" % ret)
+
+#-----------------------------------------------------------------------------
+
+class UnknownCommand(Exception):
+    pass
+
+PATH_OPTIONS = ['data_dir', 'data_file', 'output_file_name', 'module_id_from_csv', 'course_list', 'retry_failed',
+                'manifest', 'outline_cache', 'metrics_file', 'batch_results', 'record', 'replay']
+PATH_OR_FLAG_OPTIONS = ['session_cache', 'response_cache']		# True, or a directory
+
+PATH_ARGUMENTS = {'upload_course': None, 'upload_courses': None, 'set_due_dates': 1, 'upload_asset': 1,
+                  'upload_transcript': 1, 'batch': 1}	# command: number of leading ifn which are files (None: all)
+
+def make_paths_absolute(args, cwd):
+    '''
+    Make the file names in args (in options, and in the arguments of commands which take files)
+    absolute, relative to directory cwd, e.g. for commands run by a daemon on behalf of a client.
+    '''
+    def fix(fn):
+        if not isinstance(fn, basestring) or fn=="-":
+            return fn
+        return os.path.join(cwd, os.path.expanduser(fn))
+    for dest in PATH_OPTIONS:
+        if getattr(args, dest, None):
+            setattr(args, dest, fix(getattr(args, dest)))
+    for dest in PATH_OR_FLAG_OPTIONS:
+        if isinstance(getattr(args, dest, None), basestring):
+            setattr(args, dest, fix(getattr(args, dest)))
+    if args.cmd in PATH_ARGUMENTS:
+        nfiles = PATH_ARGUMENTS[args.cmd] or len(args.ifn)
+        args.ifn = [fix(x) for x in args.ifn[:nfiles]] + args.ifn[nfiles:]
+
+def run_command(ea, args):
+    '''
+    Run one edxapi command, args.cmd, with arguments args.ifn and options from args, using
+    the logged-in edXapi (or ccXapi) instance ea.  Returns the result of the command.
+    '''
     if args.data_file:
         args.data = open(args.data_file).read()
         if args.verbose:
             print("Read data from %s" % args.data_file)
 
-    if not ea.login_ok:
-        print "Error - login failed, aborting actions"
-        sys.exit(-1)
-
     if args.module_id_from_csv:
         import csv
         args.ifn = args.ifn or []
@@ -147,6 +285,7 @@ enroll_student <email>      - enroll student in CCX instance
         print "Found %d module ID's in csv file %s" % (len(mids), args.module_id_from_csv)
         args.ifn += mids
 
+    ret = None
     if args.cmd=="list_reports":
         ret = ea.list_reports_for_download()
         if args.verbose:
@@ -155,14 +294,11 @@ enroll_student <email>      - enroll student in CCX instance
         print json.dumps(names, indent=4)
 
     elif args.cmd=="download_student_state":
-        ea.download_student_state_reports(module_ids=args.ifn, date_filter=args.date)
+        ret = ea.download_student_state_reports(module_ids=args.ifn, date_filter=args.date, manifest_fn=args.manifest)
 
     elif args.cmd=="get_problem_responses":
-        module_ids = args.ifn
-        for mid in module_ids:
-            ret = ea.enqueue_request_for_problem_responses(mid)
-            print "%s -> %s" % (mid, ret)
-            time.sleep(20)
+        ret = ea.get_problem_responses_reports(args.ifn, deadline=args.deadline or 3600, manifest_fn=args.manifest)
+        print "%d reports done, %d failed, %d pending" % (len(ret['done']), len(ret['failed']), len(ret['pending']))
 
     elif args.cmd=="get_course_info":
         ret = ea.get_basic_course_info()
@@ -170,10 +306,32 @@ enroll_student <email>      - enroll student in CCX instance
             print("course info ret=%s" % ret)
 
     elif args.cmd=="download_course":
-        ea.download_course_tarball()
+        ret = ea.download_course_tarball(deadline=args.deadline or 600)
 
     elif args.cmd=="upload_course":
-        ea.upload_course_tarball(args.ifn[0])
+        ret = ea.import_course_tarball(args.ifn[0], deadline=args.deadline or 600)
+
+    elif args.cmd in ["download_courses", "upload_courses"]:
+        from course_batch import CourseBatch
+        cb = CourseBatch(ea, jobs=args.jobs, max_exports=args.max_exports, manifest_fn=args.manifest,
+                         deadline=args.deadline or 600, verbose=args.verbose)
+        items = args.ifn
+        if args.course_list:
+            items = items + [x.strip() for x in open(args.course_list) if x.strip()]
+        if args.retry_failed:
+            failed = CourseBatch.failed_course_ids(args.retry_failed)
+            if args.cmd=="upload_courses":
+                items = [x for x in items if CourseBatch.course_id_from_tarball_name(x) in failed]
+            else:
+                items = [x for x in items if x in failed] if items else failed
+        if args.retry_failed and not items:
+            print "Nothing to retry: no failed courses (of those given) in %s" % args.retry_failed
+            ret = {}
+        elif args.cmd=="download_courses":
+            selected = args.ifn or args.course_list or args.retry_failed
+            ret = cb.download_courses(items if selected else None)['courses']	# all courses, if none were selected
+        else:
+            ret = cb.upload_courses(items)['courses']
 
     elif args.cmd=="list_courses":
         ret = ea.list_courses()['course_ids']
@@ -182,7 +340,9 @@ enroll_student <email>      - enroll student in CCX instance
         ret = ea.get_course_metadata()
 
     elif args.cmd=="update_course_metadata":
-        if args.data:
+        if isinstance(args.data, dict):
+            md = args.data
+        elif args.data:
             try:
                 md = json.loads(args.data)
             except Exception as err:
@@ -241,12 +401,11 @@ enroll_student <email>      - enroll student in CCX instance
         ret = ea.create_xblock(path=args.ifn, category=args.type, data=args.data)
 
     elif args.cmd=="update_xblock":
-        if args.extra_data:
+        if isinstance(args.extra_data, basestring):
             try:
                 args.extra_data = json.loads(args.extra_data)
             except Exception as err:
-                print "Error!  Could not parse extra_data argument as JSON, extra_data=%s" % args.extra_data
-                sys.exit(-1)
+                raise Exception("Error!  Could not parse extra_data argument as JSON, extra_data=%s" % args.extra_data)
         ret = ea.update_xblock(path=args.ifn, category=args.type, data=args.data, create=args.create, extra_data=args.extra_data)
 
     elif args.cmd=="get_xblock":
@@ -262,7 +421,12 @@ enroll_student <email>      - enroll student in CCX instance
         ret = ea.set_due_date(args.ifn[0], args.ifn[1])
 
     elif args.cmd=="set_all_due_dates":
-        ret = ea.set_all_due_dates(args.ifn[0])
+        ret = ea.set_all_due_dates(args.ifn[0], dry_run=args.dry_run)
+
+    elif args.cmd=="set_due_dates":
+        due_dates = ea.load_due_date_map(args.ifn[0])
+        default_due = args.ifn[1] if len(args.ifn) > 1 else None
+        ret = ea.set_due_dates(due_dates, default_due=default_due, dry_run=args.dry_run)
 
     elif args.cmd=="list_assets":
         ret = ea.list_static_assets()
@@ -311,16 +475,273 @@ enroll_student <email>      - enroll student in CCX instance
     # unknown
 
     else:
-        print ("Unknown command %s" % args.cmd)
+        raise UnknownCommand("Unknown command %s" % args.cmd)
+    return ret
 
-    if args.json_output_html:
-        print ret['html']
-    elif args.output_srt:
-        print ret
-    elif args.json_output and ret is not None:
-        try:
-            print json.dumps(ret, indent=4)
-        except Exception as err:
-            print("Output is not JSON serializable, ret=%s" % ret)
+#-----------------------------------------------------------------------------
+# batch mode
+
+BATCH_OPTIONS = ['type', 'view', 'output_file_name', 'data', 'data_file', 'extra_data', 'videoid', 'output_srt',
+                 'create', 'date', 'deadline', 'dry_run', 'module_id_from_csv', 'course_list', 'retry_failed',
+                 'max_exports', 'manifest']
+
+def read_batch_commands(fp, fn=None):
+    '''
+    Generate the commands (dicts) of a batch, read from file object fp.  Commands are JSON lines,
+    each a dict (e.g. {"cmd": "get_xblock", "args": ["block-v1:..."], "view": "..."}) or a list
+    [cmd, arg, ...]; blank lines and lines starting with # are skipped.  JSON lines are read one at
+    a time, so that commands may be streamed in on stdin.  If fn ends in .yaml or .yml, or the
+    first line is not JSON, the whole input is instead read as a YAML list of commands.
+    '''
+    def to_command(item):
+        if isinstance(item, list) and item:
+            return {'cmd': item[0], 'args': item[1:]}
+        return item
+
+    lines = []
+    if not (fn or '').endswith(('.yaml', '.yml')):
+        for line in iter(fp.readline, ''):		# not "for line in fp", which reads ahead
+            sline = line.strip()
+            if not sline or sline.startswith('#'):
+                continue
+            if not sline[0] in '{[':
+                lines.append(line)
+                break
+            yield to_command(json.loads(sline))
+        if not lines:
+            return
+    import yaml
+    for item in yaml.safe_load(''.join(lines) + fp.read()) or []:
+        yield to_command(item)
+
+def batch_command_args(args, item):
+    '''
+    Return args for one batch command (dict item): the command line args, with cmd and ifn
+    from the command, overridden by any of the BATCH_OPTIONS given in the command.
+    '''
+    if not isinstance(item, dict) or not item.get('cmd'):
+        raise Exception("Batch command should be a dict with a cmd, or a list [cmd, arg, ...], not %r" % (item,))
+    cargs = argparse.Namespace(**vars(args))
+    cargs.cmd = item['cmd']
+    cargs.ifn = item.get('args', [])
+    if not isinstance(cargs.ifn, list):
+        cargs.ifn = [cargs.ifn]
+    for key, val in item.items():
+        if key in ['cmd', 'args', 'id', 'group']:
+            continue
+        dest = key.replace('-', '_')
+        if not dest in BATCH_OPTIONS:
+            raise Exception("Unknown option %s for batch command %s" % (key, cargs.cmd))
+        setattr(cargs, dest, val)
+    if getattr(args, 'cwd', None):
+        make_paths_absolute(cargs, args.cwd)
+    return cargs
+
+ROUTE_LOCK = threading.Lock()
+
+@contextmanager
+def stdout_routed_to(stream):
+    '''
+    Send what the current thread (and worker threads it starts) prints to stream, instead of
+    stdout, leaving the output of other threads as it is.  A ThreadRoutedStream is installed as
+    sys.stdout for this, if there is none.
+    '''
+    if stream is None:
+        yield
+        return
+    from edxcut_daemon import ThreadRoutedStream
+    with ROUTE_LOCK:
+        if not hasattr(sys.stdout, 'routed'):
+            sys.stdout = ThreadRoutedStream(sys.stdout)
+        stdout = sys.stdout
+    previous = stdout.routed()
+    stdout.route(stream)
+    try:
+        yield
+    finally:
+        stdout.route(previous)
+
+def run_batch_command(ea, args, index, item, out=None):
+    '''
+    Run one batch command, returning a result dict with its index (and id, if given), cmd,
+    ok, result or error, and elapsed_sec.  What the command prints goes to out, if given.
+    '''
+    result = OrderedDict([('index', index)])
+    if isinstance(item, dict) and 'id' in item:
+        result['id'] = item['id']
+    result['cmd'] = item.get('cmd') if isinstance(item, dict) else None
+    t0 = time.time()
+    try:
+        with stdout_routed_to(out):
+            ret = run_command(ea, batch_command_args(args, item))
+        result['ok'] = True
+        result['result'] = ret
+    except Exception as err:
+        result['ok'] = False
+        result['error'] = str(err)
+    result['elapsed_sec'] = round(time.time() - t0, 4)
+    return result
+
+def execute_batch(ea, args, commands, jobs=1, stop_on_error=False, out=None):
+    '''
+    Run batch commands (an iterable of dicts), generating a result dict for each.
+
+    With jobs > 1, the commands between barriers ({"cmd": "barrier"}) are run concurrently, on
+    up to jobs clones of ea, except that commands with the same "group" run one after another,
+    in order.  Results are then generated group by group, in order of each group's first command.
+    With jobs <= 1, each command is run (and its result generated) as soon as it is read.
+
+    With stop_on_error, no more commands are started after one fails.  What the commands print
+    goes to out, if given (see run_batch_command).
+    '''
+    failed = threading.Event()
+
+    def run_group(ea, group):
+        results = []
+        for index, item in group:
+            if stop_on_error and failed.is_set():
+                break
+            result = run_batch_command(ea, args, index, item, out=out)
+            if not result['ok']:
+                failed.set()
+            results.append(result)
+        return results
+
+    def run_segment(segment):
+        groups = OrderedDict()
+        for index, item in segment:
+            key = item.get('group', ('#', index)) if isinstance(item, dict) else ('#', index)
+            groups.setdefault(key, []).append((index, item))
+        for results in ea.imap_concurrent(run_group, groups.values(), max_workers=jobs):
+            for result in results:
+                yield result
+
+    segment = []
+    for index, item in enumerate(commands):
+        if not (isinstance(item, dict) and item.get('cmd')=="barrier"):
+            segment.append((index, item))
+            if jobs > 1:
+                continue
+        for result in run_segment(segment):
+            yield result
+        segment = []
+        if stop_on_error and failed.is_set():
+            return
+    for result in run_segment(segment):
+        yield result
+
+def run_batch(ea, args, ifp=None, ofp=None):
+    '''
+    Run the batch command: read commands from file args.ifn[0] (or ifp, or stdin), run them all
+    with the one logged-in instance ea, and write their results as JSON lines, to args.batch_results
+    (or ofp, or stdout).  Returns the number of commands which failed.
+    '''
+    fn = args.ifn[0] if args.ifn else '-'
+    fp = (ifp or sys.stdin) if fn=='-' else open(fn)
+    log = None
+    if args.batch_results:
+        ofp = open(args.batch_results, 'w')
+    else:
+        ofp = ofp or sys.stdout
+        log = sys.stderr			# keep output printed by commands out of the results
+    nok = nfailed = 0
+    t0 = time.time()
+    try:
+        for result in execute_batch(ea, args, read_batch_commands(fp, fn), jobs=args.batch_jobs,
+                                    stop_on_error=args.stop_on_error, out=log):
+            try:
+                line = json.dumps(result)
+            except (TypeError, ValueError):
+                result['result'] = repr(result['result'])
+                line = json.dumps(result)
+            ofp.write(line + '\n')
+            ofp.flush()
+            if result['ok']:
+                nok += 1
+            else:
+                nfailed += 1
+    except Exception as err:
+        sys.stderr.write("Error reading batch commands from %s: %s\n" % (fn, err))
+        nfailed += 1
+    finally:
+        if args.batch_results:
+            ofp.close()
+    sys.stderr.write("[batch] %d commands ok, %d failed, in %.1f sec\n" % (nok, nfailed, time.time() - t0))
+    return nfailed
 
 #-----------------------------------------------------------------------------
+# unit tests
+
+def test_batch():
+    from fake_edx import FakeCourse, FakeEdxServer
+    srv = FakeEdxServer([FakeCourse(chapters=2, sequentials=2, verticals=2, problems=2, assets=5)]).start()
+    bfn = "/tmp/edxcut_tmp_batch.jsonl"
+    rfn = "/tmp/edxcut_tmp_batch_results.jsonl"
+    path = ["chapter_1", "sequential_1", "vertical_1"]
+    commands = [{'cmd': "update_xblock", 'args': path + ["new_%d" % k], 'type': "html", 'create': True,
+                 'data': "<p>%d</p>" % k, 'group': k % 2, 'id': "u%d" % k} for k in range(6)]
+    commands += [{'cmd': "barrier"},
+                 ["list_assets"],
+                 {'cmd': "get_xblock", 'args': path + ["new_4"]},
+                 {'cmd': "get_xblock", 'args': path + ["missing"]},
+                 {'cmd': "list_xblocks", 'args': path, 'colour': "blue"}]
+    with open(bfn, 'w') as fp:
+        for cmd in commands:
+            fp.write(json.dumps(cmd) + '\n')
+    try:
+        for jobs in [1, 4]:
+            try:
+                CommandLine(arglist=["batch", bfn, "-S", "-s", srv.base_url, "-u", "staff@example.com", "-p", "edx",
+                                     "-c", srv.courses.keys()[0], "--batch-jobs", str(jobs), "--batch-results", rfn])
+                assert False
+            except SystemExit as err:
+                assert err.code==1
+            results = sorted([json.loads(x) for x in open(rfn)], key=lambda x: x['index'])
+            assert [x['index'] for x in results]==range(6) + range(7, 11)
+            assert [x['ok'] for x in results]==[True] * 8 + [False, False]
+            assert results[0]['id']=="u0" and results[5]['cmd']=="update_xblock"
+            assert len(results[6]['result'])==5
+            assert results[7]['result']['data']=="<p>4</p>"
+            assert "colour" in results[9]['error']
+    finally:
+        srv.stop()
+        os.unlink(bfn)
+
+def test_retry_nothing_failed():
+    from fake_edx import FakeCourse, FakeEdxServer
+    srv = FakeEdxServer([FakeCourse(assets=0)]).start()
+    mfn = "/tmp/edxcut_tmp_manifest.json"
+    open(mfn, 'w').write(json.dumps({'courses': {srv.courses.keys()[0]: {'status': "ok"}}}))
+    try:
+        for cmd in ["download_courses", "upload_courses"]:
+            CommandLine(arglist=[cmd, "-S", "-s", srv.base_url, "-u", "staff@example.com", "-p", "edx",
+                                 "--retry-failed", mfn, "--data-dir", "/tmp/edxcut_tmp_retry"])
+        assert not [x for x in srv.metrics.summary()['requests'] if "export" in x['endpoint']]
+    finally:
+        srv.stop()
+
+def test_batch_output():
+    from StringIO import StringIO
+    from fake_edx import FakeCourse, FakeEdxServer, fake_api
+    srv = FakeEdxServer([FakeCourse()]).start()
+    stderr = sys.stderr
+    try:
+        ea = fake_api(srv, studio=False)
+        args = make_parser().parse_args(["batch", "--batch-jobs", "3"])
+        out, sys.stderr = StringIO(), StringIO()
+        stdout = sys.stdout
+        assert run_batch(ea, args, ifp=StringIO('["list_reports"]\n' * 4), ofp=out)==0
+        assert sys.stdout is stdout or sys.stdout.routed() is None
+        assert [json.loads(x)['ok'] for x in out.getvalue().splitlines()]==[True] * 4
+        assert sys.stderr.getvalue().count("[]")==4		# printed by list_reports
+    finally:
+        sys.stderr = stderr
+        srv.stop()
+
+def test_read_batch_commands():
+    from StringIO import StringIO
+    jsonl = '# comment\n\n{"cmd": "list_assets"}\n["get_xblock", "a", "b"]\n'
+    assert list(read_batch_commands(StringIO(jsonl)))==[{'cmd': "list_assets"}, {'cmd': "get_xblock", 'args': ["a", "b"]}]
+    yml = "# comment\n- cmd: list_assets\n- [get_xblock, a, b]\n- cmd: barrier\n"
+    assert list(read_batch_commands(StringIO(yml)))==[{'cmd': "list_assets"}, {'cmd': "get_xblock", 'args': ["a", "b"]},
+                                                     {'cmd': "barrier"}]
@@ -0,0 +1,507 @@
+'''
+edxcut daemon: a long-running process which keeps logged-in edXapi instances warm (one per
+site, course, and user, with their sessions, CSRF tokens, connection pools, and outline caches),
+and runs edxapi commands for clients, sent over a local Unix socket.
+
+The protocol is newline-delimited JSON.  The client sends a request, e.g.
+
+    {"op": "edxapi", "argv": ["list_chapters", "-s", "...", ...], "cwd": "/home/me"}
+
+and the daemon replies with messages {"stdout": text} and {"stderr": text}, as the command
+prints them, and ends with {"exit": code}; or {"fallback": reason}, if the command should
+instead be run by the client itself (e.g. when recording a cassette).  If the command reads
+stdin (a batch from stdin), the daemon sends {"want_stdin": true}, and the client then sends
+{"stdin": text} messages, ending with {"stdin": null}.  Other requests are {"op": "ping"}
+and {"op": "shutdown"}.
+
+This module is imported by the edxcut command line before anything heavy, so the client
+side only uses the standard library.
+'''
+
+import os
+import sys
+import json
+import time
+import errno
+import fcntl
+import socket
+import hashlib
+import threading
+import traceback
+import subprocess
+import SocketServer
+
+DEFAULT_SOCKET = "~/.edxcut/edxcut.sock"
+
+def socket_path(path=None):
+    '''
+    Return the daemon socket path: path if given, else $EDXCUT_SOCKET, else ~/.edxcut/edxcut.sock
+    '''
+    return os.path.abspath(os.path.expanduser(path or os.environ.get('EDXCUT_SOCKET') or DEFAULT_SOCKET))
+
+#-----------------------------------------------------------------------------
+# server
+
+class ThreadRoutedStream(object):
+    '''
+    Stand-in for sys.stdout or sys.stderr, which sends what a thread writes to the stream
+    routed for that thread (e.g. to a client), or else to the original stream.  Worker threads
+    started for a request (see edXapi.imap_concurrent) take on the route of the thread starting them.
+    '''
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def route(self, target):
+        self.local.target = target
+
+    def routed(self):
+        '''
+        Return the stream routed for the current thread (None if not routed)
+        '''
+        return getattr(self.local, 'target', None)
+
+    def target(self):
+        return getattr(self.local, 'target', None) or self.stream
+
+    def write(self, data):
+        self.target().write(data)
+
+    def flush(self):
+        self.target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+class ClientStream(object):
+    '''
+    File-like object which sends what is written to it to a client, as {key: text} messages
+    '''
+    def __init__(self, handler, key):
+        self.handler = handler
+        self.key = key
+
+    def write(self, data):
+        if data:
+            self.handler.send({self.key: data})
+
+    def flush(self):
+        pass
+
+class ClientStdin(object):
+    '''
+    File-like object for reading the stdin of a client, which is asked for it on first use
+    '''
+    def __init__(self, handler):
+        self.handler = handler
+        self.buffer = ""
+        self.eof = False
+        self.asked = False
+
+    def fill(self):
+        if not self.asked:
+            self.handler.send({'want_stdin': True})
+            self.asked = True
+        line = self.handler.rfile.readline()
+        data = json.loads(line).get('stdin') if line else None
+        if data is None:
+            self.eof = True
+        else:
+            self.buffer += data
+
+    def readline(self):
+        while not '\n' in self.buffer and not self.eof:
+            self.fill()
+        if '\n' in self.buffer:
+            line, self.buffer = self.buffer.split('\n', 1)
+            return line + '\n'
+        line, self.buffer = self.buffer, ""
+        return line
+
+    def read(self):
+        while not self.eof:
+            self.fill()
+        data, self.buffer = self.buffer, ""
+        return data
+
+class DaemonRequestHandler(SocketServer.StreamRequestHandler):
+    '''
+    Handle one client connection (one request)
+    '''
+    def send(self, msg):
+        with self.send_lock:
+            self.wfile.write(json.dumps(msg) + '\n')
+            self.wfile.flush()
+
+    def handle(self):
+        self.send_lock = threading.Lock()
+        line = self.rfile.readline()
+        if not line:
+            return
+        req = json.loads(line)
+        op = req.get('op')
+        if op=="ping":
+            self.send({'ok': True, 'pid': os.getpid(), 'instances': len(self.server.instances)})
+        elif op=="shutdown":
+            self.send({'ok': True})
+            threading.Thread(target=self.server.shutdown).start()
+        elif op=="edxapi":
+            self.server.run_edxapi(self, req.get('argv', []), req.get('cwd') or os.getcwd())
+        else:
+            self.send({'exit': 2, 'stderr': "[edxcut daemon] unknown request %s\n" % op})
+
+class EdxcutDaemon(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    '''
+    Daemon serving edxapi commands over a Unix socket (readable only by its owner), using warm
+    edXapi instances, kept per site, course, user, and connection options.  Each request runs
+    on its own clone of the instance (see edXapi.clone), so requests may run concurrently, while
+    sharing the session and the (in-memory) outline cache.  Each clone records its timings in
+    its own Metrics, so that those of a warm instance do not grow for the daemon's lifetime.
+
+    The daemon exits after idle_timeout seconds without requests, and drops instances unused for
+    that long, so that stale sessions are not kept.  Only one daemon runs per socket (a lock file
+    is held while it runs).
+    '''
+    daemon_threads = True
+
+    def __init__(self, path=None, idle_timeout=1800, verbose=False):
+        self.path = socket_path(path)
+        self.idle_timeout = idle_timeout
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.instances = {}
+        self.active = 0
+        self.running = False
+        self.last_request = time.time()
+        dn = os.path.dirname(self.path)
+        if not os.path.exists(dn):
+            os.makedirs(dn, 0700)
+        self.lock_fp = open(self.path + ".lock", 'a')
+        try:
+            fcntl.flock(self.lock_fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            self.lock_fp.close()
+            raise Exception("[edxcut daemon] another daemon is already running on %s" % self.path)
+        if os.path.exists(self.path):
+            os.unlink(self.path)				# left by a daemon which did not exit cleanly
+        umask = os.umask(0077)
+        try:
+            SocketServer.UnixStreamServer.__init__(self, self.path, DaemonRequestHandler)
+        finally:
+            os.umask(umask)
+
+    def serve(self):
+        '''
+        Serve requests until shut down, or idle for idle_timeout seconds
+        '''
+        stdout, stderr = sys.stdout, sys.stderr
+        if not isinstance(sys.stdout, ThreadRoutedStream):
+            sys.stdout = ThreadRoutedStream(sys.stdout)
+            sys.stderr = ThreadRoutedStream(sys.stderr)
+        self.running = True
+        watchdog = threading.Thread(target=self.watch_idle)
+        watchdog.daemon = True
+        watchdog.start()
+        self.log("[edxcut daemon] pid %d serving on %s" % (os.getpid(), self.path))
+        try:
+            self.serve_forever(poll_interval=0.5)
+        finally:
+            self.running = False
+            sys.stdout, sys.stderr = stdout, stderr
+            self.server_close()
+
+    def start(self):
+        '''
+        Serve requests in a background thread (e.g. for tests); returns self
+        '''
+        thr = threading.Thread(target=self.serve)
+        thr.daemon = True
+        thr.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.lock_fp.close()
+
+    def log(self, msg):
+        if self.verbose:
+            sys.__stderr__.write(msg + '\n')
+
+    def watch_idle(self):
+        while self.running:
+            time.sleep(min(self.idle_timeout, 10))
+            now = time.time()
+            with self.lock:
+                for key, entry in self.instances.items():
+                    if entry['used'] < now - self.idle_timeout:
+                        self.log("[edxcut daemon] dropping idle instance for %s" % (key[:4],))
+                        del self.instances[key]
+                idle = not self.active and self.last_request < now - self.idle_timeout
+            if idle:
+                self.log("[edxcut daemon] idle for %d sec, exiting" % self.idle_timeout)
+                self.shutdown()
+                return
+
+    @staticmethod
+    def instance_key(args):
+        '''
+        Key for the warm instance to use for a request: everything in args which determines
+        the login and connection.  Options which may differ between requests using one login
+        (e.g. verbose, data_dir) are set on the per-request clone instead.
+        '''
+        return (args.site_base_url, args.course_id, args.username,
+                hashlib.sha1(args.password or '').hexdigest(), args.studio,
+                args.ccx or (args.course_id or '').startswith("ccx-v1:"), args.auth, args.session_cache,
+                args.retries, args.rate_limit, args.timeout, args.outline_cache, args.outline_cache_ttl,
+                args.response_cache, args.response_cache_ttl)
+
+    def get_api(self, args):
+        '''
+        Return a clone of the warm instance for args (logging in first, if there is none)
+        '''
+        import edxapi_cmd
+        from metrics import Metrics
+        key = self.instance_key(args)
+        with self.lock:
+            entry = self.instances.get(key)
+            if entry is None:
+                entry = self.instances[key] = {'ea': None, 'lock': threading.Lock(), 'used': time.time()}
+        with entry['lock']:
+            if entry['ea'] is None:
+                ea = edxapi_cmd.make_api(args, outline_cache=True)
+                if not ea.login_ok:
+                    return ea
+                entry['ea'] = ea
+                self.log("[edxcut daemon] logged in to %s as %s" % (args.site_base_url, args.username))
+            entry['used'] = time.time()
+        ea = entry['ea'].clone()
+        ea.use_metrics(Metrics())
+        ea.verbose = args.verbose
+        ea.data_dir = args.data_dir
+        ea.max_workers = args.jobs
+        ea.lazy_children = args.lazy_children
+        return ea
+
+    def run_edxapi(self, handler, argv, cwd):
+        '''
+        Run an edxapi command line (argv) for a client, sending its output to the client
+        '''
+        import edxapi_cmd
+        with self.lock:
+            self.active += 1
+            self.last_request = time.time()
+        out = ClientStream(handler, 'stdout')
+        err = ClientStream(handler, 'stderr')
+        sys.stdout.route(out)
+        sys.stderr.route(err)
+        code = 0
+        try:
+            args = edxapi_cmd.make_parser().parse_args(argv)
+            if args.record or args.replay:
+                handler.send({'fallback': "recording and replaying are done in-process"})
+                return
+            args.cwd = cwd
+            edxapi_cmd.make_paths_absolute(args, cwd)
+            try:
+                ea = self.get_api(args)
+            except Exception as error:
+                print error
+                print "Error accessing OpenEdX site - if you're accessing Studio, did you specify the -S flag?"
+                code = -1
+                return
+            if not ea.login_ok:
+                print "Error - login failed, aborting actions"
+                code = -1
+                return
+            batch_in = batch_out = None
+            if args.cmd=="batch":
+                batch_in = ClientStdin(handler)
+                if not args.batch_results:
+                    batch_out = out
+            edxapi_cmd.execute(ea, args, batch_in=batch_in, batch_out=batch_out)
+        except SystemExit as error:
+            code = error.code if isinstance(error.code, int) else (0 if error.code is None else 1)
+        except Exception as error:
+            traceback.print_exc()
+            code = 1
+        finally:
+            sys.stdout.route(None)
+            sys.stderr.route(None)
+            with self.lock:
+                self.active -= 1
+                self.last_request = time.time()
+            if not handler.wfile.closed:
+                handler.send({'exit': code})
+
+#-----------------------------------------------------------------------------
+# client
+
+def connect(path, timeout=None):
+    '''
+    Return a socket connected to the daemon at path, or None if no daemon is listening there
+    '''
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+    except socket.error as err:
+        sock.close()
+        if err.errno in [errno.ENOENT, errno.ECONNREFUSED]:
+            return None
+        raise
+    sock.settimeout(None)
+    return sock
+
+def start_daemon(path, wait=10):
+    '''
+    Start a daemon in the background, serving on path; return a socket connected to it, or
+    None if it could not be started within wait seconds.  The daemon logs to path + ".log".
+    '''
+    main = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    dn = os.path.dirname(path)
+    if not os.path.exists(dn):
+        os.makedirs(dn, 0700)
+    log = open(path + ".log", 'a')
+    subprocess.Popen([sys.executable, main, "serve", "--socket", path, "-v"], stdin=open(os.devnull),
+                     stdout=log, stderr=log, close_fds=True, preexec_fn=os.setsid)
+    log.close()
+    t0 = time.time()
+    while time.time() - t0 < wait:
+        sock = connect(path)
+        if sock:
+            return sock
+        time.sleep(0.05)
+    return None
+
+def request(path, msg, timeout=5):
+    '''
+    Send a simple request (e.g. ping, or shutdown) to the daemon at path; return its reply, or
+    None if no daemon is listening
+    '''
+    sock = connect(path, timeout=timeout)
+    if not sock:
+        return None
+    try:
+        sock.sendall(json.dumps(msg) + '\n')
+        return json.loads(sock.makefile('rb').readline() or 'null')
+    finally:
+        sock.close()
+
+def run_client(argv, path=None, autostart=True, stdin=None, stdout=None, stderr=None):
+    '''
+    Run an edxapi command line (argv) in the daemon (starting it, if autostart and it is not
+    running), copying its output to stdout and stderr.  Returns the exit code of the command, or
+    None if the command could not be run in the daemon, and should instead be run in-process.
+    '''
+    if path is None and "--daemon-socket" in argv[:-1]:
+        path = argv[argv.index("--daemon-socket") + 1]
+    path = socket_path(path)
+    stdin, stdout, stderr = stdin or sys.stdin, stdout or sys.stdout, stderr or sys.stderr
+    verbose = [x for x in argv if x=="--verbose" or (x.startswith('-v') and x.strip('v')=='-')]
+    try:
+        sock = connect(path) or (autostart and start_daemon(path))
+    except Exception as err:
+        sock = None
+    if not sock:
+        if verbose:
+            stderr.write("[edxcut] daemon on %s unavailable, running in-process\n" % path)
+        return None
+
+    sfp = sock.makefile('rb')
+    def pump_stdin():
+        for line in iter(stdin.readline, ''):
+            sock.sendall(json.dumps({'stdin': line}) + '\n')
+        sock.sendall(json.dumps({'stdin': None}) + '\n')
+
+    started = False
+    try:
+        sock.sendall(json.dumps({'op': "edxapi", 'argv': argv, 'cwd': os.getcwd()}) + '\n')
+        for line in iter(sfp.readline, ''):
+            msg = json.loads(line)
+            if 'stdout' in msg:
+                started = True
+                stdout.write(msg['stdout'])
+                stdout.flush()
+            if 'stderr' in msg:
+                started = True
+                stderr.write(msg['stderr'])
+            if msg.get('want_stdin'):
+                started = True
+                pump = threading.Thread(target=pump_stdin)
+                pump.daemon = True
+                pump.start()
+            if 'fallback' in msg:
+                if verbose:
+                    stderr.write("[edxcut] %s\n" % msg['fallback'])
+                return None
+            if 'exit' in msg:
+                return msg['exit']
+    except socket.error as err:
+        if not started:
+            return None
+    finally:
+        sock.close()
+    if not started:
+        return None			# daemon went away before starting the command
+    stderr.write("[edxcut] lost connection to daemon on %s\n" % path)
+    return 1
+
+#-----------------------------------------------------------------------------
+# unit tests
+
+def test_routed_workers():
+    from StringIO import StringIO
+    from fake_edx import FakeCourse, FakeEdxServer, fake_api
+    srv = FakeEdxServer([FakeCourse()]).start()
+    stdout = sys.stdout
+    sys.stdout = ThreadRoutedStream(stdout)
+    try:
+        ea = fake_api(srv)
+        out = StringIO()
+        sys.stdout.route(out)
+        list(ea.imap_concurrent(lambda ea, k: sys.stdout.write("item %d\n" % k), range(6), max_workers=3))
+        sys.stdout.route(None)
+        assert sorted(out.getvalue().splitlines())==["item %d" % k for k in range(6)]
+    finally:
+        sys.stdout = stdout
+        srv.stop()
+
+def test_daemon():
+    from StringIO import StringIO
+    from fake_edx import FakeCourse, FakeEdxServer
+    srv = FakeEdxServer([FakeCourse(chapters=3)]).start()
+    path = "/tmp/edxcut_tmp_daemon/edxcut.sock"
+    daemon = EdxcutDaemon(path).start()
+    conn = ["-S", "-s", srv.base_url, "-u", "staff@example.com", "-p", "edx", "-c", srv.courses.keys()[0]]
+    try:
+        try:
+            EdxcutDaemon(path)
+            assert False
+        except Exception as err:
+            assert "already running" in str(err)
+        assert request(path, {'op': "ping"})['instances']==0
+        out = StringIO()
+        assert run_client(["list_chapters", "-j"] + conn, path=path, autostart=False, stdout=out)==0
+        assert json.loads(out.getvalue())['titles']==["Chapter 1", "Chapter 2", "Chapter 3"]
+        out, err = StringIO(), StringIO()
+        stdin = StringIO('["list_chapters"]\n{"cmd": "nope"}\n')
+        assert run_client(["batch"] + conn, path=path, autostart=False, stdin=stdin, stdout=out, stderr=err)==1
+        assert [json.loads(x)['ok'] for x in out.getvalue().splitlines()]==[True, False]
+        assert "1 failed" in err.getvalue()
+        assert request(path, {'op': "ping"})['instances']==1
+        assert run_client(["list_chapters", "--replay", "x.jsonl.gz"] + conn, path=path, autostart=False) is None
+        assert run_client(["list_chapters"] + conn, path="/tmp/edxcut_tmp_daemon/none.sock", autostart=False) is None
+        logins = [x for x in srv.metrics.summary()['requests'] if x['endpoint'].endswith('/login_post')]
+        assert sum([x['count'] for x in logins])==1
+        warm = daemon.instances.values()[0]['ea']
+        nwarm = sum([x['count'] for x in warm.metrics.summary()['requests']])
+        assert run_client(["list_chapters"] + conn, path=path, autostart=False, stdout=StringIO())==0
+        assert sum([x['count'] for x in warm.metrics.summary()['requests']])==nwarm	# recorded per request
+    finally:
+        assert request(path, {'op': "shutdown"})['ok']
+        srv.stop()
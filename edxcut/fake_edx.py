@@ -0,0 +1,1081 @@
+'''
+Local stand-in for an edX LMS and Studio site, serving synthetic courses, for offline
+tests, benchmarks, and load testing of edxcut (without a devstack).
+
+Implements the subset of the edX-platform HTTP interface used by edXapi: login, Studio
+course listing, outline, xblock get/create/update/delete and container preview, static
+assets, course export and import, course settings, problem_check (and problem_get,
+problem_show), and the instructor dashboard API (reports, tasks, reset attempts).
+'''
+
+import re
+import cgi
+import json
+import time
+import uuid
+import Cookie
+import random
+import hashlib
+import tarfile
+import urllib
+import urlparse
+import threading
+
+from StringIO import StringIO
+from collections import OrderedDict, defaultdict
+from SocketServer import ThreadingMixIn
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from metrics import Metrics
+
+#-----------------------------------------------------------------------------
+
+class FakeCourse(object):
+    '''
+    Synthetic edX course: chapters of sequentials of verticals of problems, plus static assets.
+
+    Problems are named problem_<n> (n counting from 1 across the course), and likewise for
+    chapters, sequentials, and verticals.  Every third problem is a multiple choice problem
+    (one input, with choices choice_0 to choice_3); the rest are numerical problems with
+    boxes input boxes each.  The correct answers are given by answers(url_name).
+    '''
+    CHOICES = ["choice_0", "choice_1", "choice_2", "choice_3"]
+
+    def __init__(self, course_id="course-v1:edX+FakeX+2026", chapters=2, sequentials=2, verticals=2, problems=2,
+                 boxes=2, assets=10, status_index_offset=2, max_attempts=None, display_name=None):
+        '''
+        chapters = number of chapters; sequentials = number of sequentials per chapter;
+        verticals = number of verticals per sequential; problems = number of problems per vertical
+        boxes = number of answer boxes in each numerical problem
+        assets = number of static assets
+        status_index_offset = first answer box number in the ids of status (and choice label) elements;
+                              input names always number boxes from 2, but edX platform versions
+                              differ in numbering statuses from 2 or from 1
+        max_attempts = (int) if given, problem_check asks for a page refresh (as the edX platform
+                       does when attempts run out) after this many checks per user and problem,
+                       until the student's attempts are reset
+        '''
+        self.course_id = course_id
+        self.course_key = course_id.split(':', 1)[1]
+        self.boxes = boxes
+        self.status_index_offset = status_index_offset
+        self.max_attempts = max_attempts
+        self.metadata = {'course_id': course_id,
+                         'display_name': display_name or "Fake course %s" % self.course_key,
+                         'start_date': "2026-01-01T00:00:00Z",
+                         'end_date': None,
+                         'enrollment_end': None,
+                         }
+        self.blocks = OrderedDict()
+        self.assets = OrderedDict()
+        self.counters = defaultdict(int)
+        self.modified = time.time()
+        self._tarball = None
+        self.lock = threading.RLock()
+        root = self.add_block(None, 'course', 'course', self.metadata['display_name'])
+        sizes = [('chapter', chapters), ('sequential', sequentials), ('vertical', verticals), ('problem', problems)]
+
+        def populate(parent, level):
+            category, count = sizes[level]
+            for k in range(count):
+                block = self.add_block(parent, category)
+                if level + 1 < len(sizes):
+                    populate(block, level + 1)
+        populate(root, 0)
+        for k in range(assets):
+            self.add_asset("asset_%d.png" % (k + 1), "\x89PNG fake image %d\n" % (k + 1) * 40, "image/png")
+
+    @property
+    def root_key(self):
+        return self.block_key('course', 'course')
+
+    def block_key(self, category, url_name):
+        return "block-v1:%s+type@%s+block@%s" % (self.course_key, category, url_name)
+
+    def asset_key(self, fn):
+        return "asset-v1:%s+type@asset+block@%s" % (self.course_key, fn.replace('/', '_'))
+
+    def touch(self):
+        self.modified = time.time()
+        self._tarball = None
+
+    @staticmethod
+    def timestamp():
+        return time.strftime("%b %d, %Y at %H:%M:%S UTC", time.gmtime())
+
+    def add_block(self, parent, category, url_name=None, display_name=None, usage_key=None):
+        '''
+        Add new block of given category as last child of block parent (None for the course);
+        returns the new block (dict)
+        '''
+        with self.lock:
+            if not url_name and usage_key:
+                url_name = usage_key.rsplit('@', 1)[-1]
+            if not url_name:
+                self.counters[category] += 1
+                url_name = "%s_%d" % (category, self.counters[category])
+            key = usage_key or self.block_key(category, url_name)
+            block = {'id': key,
+                     'category': category,
+                     'url_name': url_name,
+                     'display_name': display_name or url_name.replace('_', ' ').title(),
+                     'parent': parent['id'] if parent else None,
+                     'children': [],
+                     'data': "",
+                     'metadata': {},
+                     'published_on': self.timestamp(),
+                     'has_changes': False,
+                     }
+            if category=="problem":
+                block['data'] = self.problem_xml(url_name)
+            self.blocks[key] = block
+            if parent:
+                parent['children'].append(key)
+            self.touch()
+            return block
+
+    def delete_block(self, key):
+        with self.lock:
+            block = self.blocks.pop(key)
+            if block['parent'] in self.blocks:
+                self.blocks[block['parent']]['children'].remove(key)
+            for ckey in list(block['children']):
+                self.delete_block(ckey)
+            self.touch()
+
+    def add_asset(self, fn, content, content_type):
+        with self.lock:
+            key = self.asset_key(fn)
+            url = "/asset-v1:%s+type@asset+block/%s" % (self.course_key, fn.replace('/', '_'))
+            self.assets[key] = {'id': key,
+                                'display_name': fn,
+                                'content_type': content_type,
+                                'date_added': time.strftime("%b %d, %Y at %H:%M UTC", time.gmtime()),
+                                'url': url,
+                                'external_url': url,
+                                'portable_url': "/static/%s" % fn,
+                                'thumbnail': None,
+                                'locked': False,
+                                'content': content,
+                                }
+            self.touch()
+            return self.assets[key]
+
+    def find_asset(self, fn):
+        return self.assets.get(self.asset_key(fn))
+
+    #-----------------------------------------------------------------------------
+    # problems
+
+    def is_choice_problem(self, url_name):
+        num = url_name.rsplit('_', 1)[-1]
+        return num.isdigit() and int(num) % 3==0
+
+    def answers(self, url_name):
+        '''
+        Return list of correct answers (strings), one per answer box, for the given problem
+        '''
+        digest = hashlib.md5(url_name).hexdigest()
+        if self.is_choice_problem(url_name):
+            return [self.CHOICES[int(digest[:2], 16) % len(self.CHOICES)]]
+        return [str(int(hashlib.md5("%s_%d" % (url_name, k)).hexdigest()[:4], 16) % 100) for k in range(self.boxes)]
+
+    def problem_xml(self, url_name):
+        if self.is_choice_problem(url_name):
+            answer = self.answers(url_name)[0]
+            choices = ''.join(['<choice correct="%s">%s</choice>' % (str(x==answer).lower(), x) for x in self.CHOICES])
+            return '<problem><multiplechoiceresponse><choicegroup type="MultipleChoice">%s</choicegroup></multiplechoiceresponse></problem>' % choices
+        boxes = ''.join(['<numericalresponse answer="%s"><formulaequationinput/></numericalresponse>' % x for x in self.answers(url_name)])
+        return '<problem>%s</problem>' % boxes
+
+    INPUT_INDEX_OFFSET = 2
+
+    def input_id(self, url_name, k):
+        return "%s_%d_1" % (url_name, k + self.INPUT_INDEX_OFFSET)
+
+    def status_id(self, url_name, k):
+        return "%s_%d_1" % (url_name, k + self.status_index_offset)
+
+    def problem_html(self, url_name, statuses=None):
+        '''
+        Return HTML for problem, with the status of each answer box (if statuses is given,
+        as a list of (response, correctness) pairs), in the form rendered by the LMS.
+        '''
+        parts = ['<div class="problem"><div>']
+        if self.is_choice_problem(url_name):
+            iid = self.input_id(url_name, 0)
+            sid = self.status_id(url_name, 0)
+            response, correctness = statuses[0] if statuses else (None, None)
+            parts.append('<fieldset id="%s">' % iid)
+            for choice in self.CHOICES:
+                label_class = "response-label field-label label-inline"
+                if choice==response:
+                    label_class += " choicegroup_%s" % correctness
+                parts.append('<label id="%s-%s-label" class="%s"><input type="radio" name="input_%s" id="input_%s_%s" value="%s"/>%s</label>' % (
+                    sid, choice, label_class, iid, iid, choice, choice, choice))
+            parts.append('</fieldset>')
+            if not statuses:
+                parts.append('<span id="status_%s" class="unanswered"></span>' % sid)
+        else:
+            for k in range(self.boxes):
+                iid = self.input_id(url_name, k)
+                sid = self.status_id(url_name, k)
+                response, correctness = statuses[k] if statuses else ("", "unanswered")
+                parts.append('<div class="inputtype"><input type="text" name="input_%s" id="input_%s" value="%s"/>'
+                             '<div class="%s " id="status_%s"><span class="sr">%s</span></div></div>' % (
+                                 iid, iid, cgi.escape(response or "", True), correctness, sid, correctness))
+        parts.append('</div></div>')
+        return '\n'.join(parts)
+
+    def check_problem(self, url_name, form):
+        '''
+        Grade submitted form (list of (name, value) pairs), as problem_check does; returns dict
+        with success (overall correctness, or an error message) and contents (problem HTML).
+        '''
+        values = defaultdict(list)
+        for name, value in form:
+            values[name[:-2] if name.endswith('[]') else name].append(value)
+        statuses = []
+        error = None
+        for k, answer in enumerate(self.answers(url_name)):
+            response = values.get("input_%s" % self.input_id(url_name, k), [None])
+            response = response[0] if len(response)==1 else response
+            if response is None:
+                statuses.append((None, "unanswered"))
+                continue
+            if self.is_choice_problem(url_name):
+                statuses.append((response, "correct" if response==answer else "incorrect"))
+                continue
+            try:
+                ok = abs(float(response) - float(answer)) < 1e-6
+            except (TypeError, ValueError):
+                error = "Error: could not interpret '%s' as a number" % response
+                ok = False
+            statuses.append((response, "correct" if ok else "incorrect"))
+        if error:
+            success = error
+        elif all([x[1]=="correct" for x in statuses]):
+            success = "correct"
+        else:
+            success = "incorrect"
+        return {'success': success, 'contents': self.problem_html(url_name, statuses)}
+
+    def make_tests(self, max_problems=None):
+        '''
+        Return list of unit test specs (dicts with url_name, responses, expected), one correct and
+        one incorrect submission for each problem (up to max_problems problems).
+        '''
+        tests = []
+        problems = [x for x in self.blocks.values() if x['category']=="problem"][:max_problems]
+        for block in problems:
+            url_name = block['url_name']
+            answers = self.answers(url_name)
+            if self.is_choice_problem(url_name):
+                wrong = [self.CHOICES[(self.CHOICES.index(answers[0]) + 1) % len(self.CHOICES)]]
+            else:
+                wrong = answers[:-1] + [str(int(answers[-1]) + 1)]
+            tests.append({'url_name': url_name, 'responses': answers, 'expected': "correct"})
+            tests.append({'url_name': url_name, 'responses': wrong,
+                          'expected': ["correct"] * (len(wrong) - 1) + ["incorrect"]})
+        return tests
+
+    #-----------------------------------------------------------------------------
+    # Studio views
+
+    def xblock_info(self, key, depth=3):
+        '''
+        Return outline (xblock info) for block key, with children down to the given depth
+        (verticals are listed by the outline, but not their children).
+        '''
+        block = self.blocks[key]
+        info = {'id': key,
+                'category': block['category'],
+                'display_name': block['display_name'],
+                'studio_url': "/course/%s" % self.course_id,
+                'published': True,
+                'published_on': block['published_on'],
+                'has_changes': block['has_changes'],
+                'due': block['metadata'].get('due'),
+                'graded': False,
+                }
+        if block['category'] in ['course', 'chapter', 'sequential'] and depth > 0:
+            ccategory = {'course': 'chapter', 'chapter': 'sequential', 'sequential': 'vertical'}[block['category']]
+            info['child_info'] = {'category': ccategory,
+                                  'display_name': ccategory.title(),
+                                  'children': [self.xblock_info(x, depth - 1) for x in block['children']],
+                                  }
+        return info
+
+    def xblock_json(self, key):
+        block = self.blocks[key]
+        info = self.xblock_info(key, depth=0 if block['category']=="vertical" else 3)
+        metadata = dict(block['metadata'])
+        metadata['display_name'] = block['display_name']
+        info.update({'data': block['data'], 'metadata': metadata})
+        return info
+
+    def container_preview(self, key):
+        items = []
+        for ckey in self.blocks[key]['children']:
+            child = self.blocks[ckey]
+            items.append('<li class="studio-xblock-wrapper is-draggable" data-locator="%s"><div class="xblock-header">'
+                         '<span class="xblock-display-name">%s</span></div></li>' % (ckey, cgi.escape(child['display_name'])))
+        return {'html': '<div class="xblock"><ol class="reorderable-container">%s</ol></div>' % ''.join(items),
+                'resources': []}
+
+    def tarball(self):
+        '''
+        Return course export tarball (gzipped tar of OLX), regenerated when the course changes
+        '''
+        with self.lock:
+            if self._tarball is None:
+                sio = StringIO()
+                tfp = tarfile.open(fileobj=sio, mode='w:gz')
+
+                def add(fn, content):
+                    info = tarfile.TarInfo("course/%s" % fn)
+                    info.size = len(content)
+                    info.mtime = int(self.modified)
+                    tfp.addfile(info, StringIO(content))
+                add("course.xml", '<course url_name="course" org="%s" course="%s"/>\n' % tuple(self.course_key.split('+')[:2]))
+                for block in self.blocks.values():
+                    children = ''.join(['<%s url_name="%s"/>' % (self.blocks[x]['category'], self.blocks[x]['url_name'])
+                                        for x in block['children']])
+                    if block['category']=="problem":
+                        content = block['data']
+                    else:
+                        content = '<%s display_name="%s">%s</%s>' % (block['category'], cgi.escape(block['display_name'], True),
+                                                                     children, block['category'])
+                    add("%s/%s.xml" % (block['category'], block['url_name']), content + "\n")
+                for asset in self.assets.values():
+                    add("static/%s" % asset['display_name'], asset['content'])
+                tfp.close()
+                self._tarball = sio.getvalue()
+            return self._tarball
+
+#-----------------------------------------------------------------------------
+
+class FakeEdxHandler(BaseHTTPRequestHandler):
+    '''
+    Request handler for FakeEdxServer: dispatches to do_<name> methods, via ROUTES.
+    '''
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeEdX/0.1"
+
+    ROUTES = [
+        ('GET', r'/(signin|login)', 'login_page'),
+        ('POST', r'/login_post', 'studio_login'),
+        ('POST', r'/user_api/v1/account/login_session/', 'lms_login'),
+        ('GET', r'/home/', 'studio_home'),
+        ('GET', r'/dashboard', 'dashboard'),
+        ('POST', r'/course/', 'create_course'),
+        ('DELETE', r'/course/(?P<cid>[^/]+)', 'delete_course'),
+        ('GET', r'/settings/details/(?P<cid>[^/]+)', 'get_course_details'),
+        ('POST', r'/settings/details/(?P<cid>[^/]+)', 'update_course_details'),
+        ('GET', r'/xblock/outline/(?P<key>[^/]+)', 'outline'),
+        ('GET', r'/xblock/(?P<key>block-v1:[^/]+)(/(?P<view>[^/]+))?', 'get_xblock'),
+        ('POST', r'/xblock/(?P<key>block-v1:[^/]+)?', 'post_xblock'),
+        ('DELETE', r'/xblock/(?P<key>block-v1:[^/]+)', 'delete_xblock'),
+        ('GET', r'/assets/(?P<cid>[^/]+)/', 'list_assets'),
+        ('POST', r'/assets/(?P<cid>[^/]+)/', 'upload_asset'),
+        ('DELETE', r'/assets/(?P<cid>[^/]+)/(?P<asset_key>[^/]+)', 'delete_asset'),
+        ('GET', r'/asset-v1:(?P<ckey>[^/]+)\+type@asset\+block/(?P<fn>[^/]+)', 'get_asset'),
+        ('GET', r'/export/(?P<cid>[^/]+)', 'export_page'),
+        ('POST', r'/export/(?P<cid>[^/]+)', 'start_export'),
+        ('GET', r'/export_status/(?P<cid>[^/]+)', 'export_status'),
+        ('GET', r'/export_output/(?P<cid>[^/]+)/course.tar.gz', 'export_output'),
+        ('POST', r'/import/(?P<cid>[^/]+)', 'import_chunk'),
+        ('GET', r'/import_status/(?P<cid>[^/]+)/(?P<fn>[^/]+)', 'import_status'),
+        ('GET', r'/courses/(?P<cid>[^/]+)/jump_to_id/(?P<url_name>[^/]+)', 'jump_to_id'),
+        ('POST', r'/courses/(?P<cid>[^/]+)/xblock/(?P<key>[^/]+)/handler/xmodule_handler/(?P<handler>\w+)', 'xmodule_handler'),
+        ('GET', r'/courses/(?P<cid>[^/]+)/instructor', 'instructor_dashboard'),
+        ('POST', r'/courses/(?P<cid>[^/]+)/instructor/api/(?P<action>\w+)', 'instructor_api'),
+        ('GET', r'/courses/(?P<cid>[^/]+)/instructor/api/(?P<action>\w+)', 'instructor_api'),
+        ('GET', r'/reports/(?P<name>[^/]+)', 'get_report'),
+    ]
+    COMPILED_ROUTES = [(method, re.compile('^%s$' % pattern), name) for (method, pattern, name) in ROUTES]
+    LOGIN_PATHS = ['login_page', 'studio_login', 'lms_login']
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, fmt, *args)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+    def handle_request(self, method):
+        t0 = time.time()
+        srv = self.server
+        parts = urlparse.urlsplit(self.path)
+        self.path_only = urllib.unquote(parts.path)
+        self.query = urlparse.parse_qs(parts.query)
+        nbytes = int(self.headers.get('Content-Length') or 0)
+        self.body = self.rfile.read(nbytes) if nbytes else ""
+        self.cookies = Cookie.SimpleCookie(self.headers.get('Cookie', ''))
+        self.new_cookies = []
+        self.status = None
+        try:
+            delay = srv.delay(method, self.path_only)
+            if delay:
+                time.sleep(delay)
+            for rmethod, pattern, name in self.COMPILED_ROUTES:
+                if not rmethod==method:
+                    continue
+                m = pattern.match(self.path_only)
+                if m:
+                    break
+            else:
+                return self.send(404, "<html><body>Page Not Found</body></html>", "text/html")
+            if name not in self.LOGIN_PATHS:
+                if srv.error_rate and srv.random() < srv.error_rate:
+                    headers = [('Retry-After', str(srv.retry_after))] if srv.retry_after is not None else []
+                    return self.send(srv.error_status, "Service unavailable (injected error)\n", "text/plain", headers)
+                if not self.user:
+                    if method=='GET':
+                        return self.send(302, "", "text/html", [('Location', '/signin?next=%s' % urllib.quote(self.path))])
+                    return self.send(403, "Login required\n", "text/plain")
+                if method in ['POST', 'DELETE'] and not self.csrf_ok():
+                    return self.send(403, "CSRF verification failed\n", "text/plain")
+            kwargs = dict([(k, v) for (k, v) in m.groupdict().items()])
+            getattr(self, "do_%s" % name)(**kwargs)
+        except Exception as err:
+            import traceback
+            traceback.print_exc()
+            self.send(500, "Server error: %s\n" % err, "text/plain")
+        finally:
+            srv.metrics.record_request(method, "http://fake%s" % self.path_only, self.status, 0, time.time() - t0)
+
+    #-----------------------------------------------------------------------------
+    # helpers
+
+    def send(self, status, body, content_type="application/json", headers=None):
+        if not isinstance(body, basestring):
+            body = json.dumps(body)
+        if isinstance(body, unicode):
+            body = body.encode('utf8')
+        self.status = status
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for (name, value) in (headers or []):
+            self.send_header(name, value)
+        for cookie in self.new_cookies:
+            self.send_header('Set-Cookie', cookie)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, data, status=200):
+        self.send(status, data, "application/json")
+
+    def send_validated(self, body, content_type="application/json"):
+        '''
+        Send body, with an ETag (if the server sends them), or 304 if it matches If-None-Match
+        '''
+        if not self.server.etags:
+            return self.send(200, body, content_type)
+        if not isinstance(body, basestring):
+            body = json.dumps(body)
+        if isinstance(body, unicode):
+            body = body.encode('utf8')
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        if self.headers.get('If-None-Match')==etag:
+            return self.send(304, "", content_type, [('ETag', etag)])
+        self.send(200, body, content_type, [('ETag', etag)])
+
+    def set_cookie(self, name, value):
+        self.new_cookies.append("%s=%s; Path=/" % (name, value))
+
+    def cookie(self, name):
+        return self.cookies[name].value if name in self.cookies else None
+
+    @property
+    def user(self):
+        return self.server.sessions.get(self.cookie('sessionid'))
+
+    def csrf_ok(self):
+        token = self.cookie('csrftoken')
+        return bool(token) and self.headers.get('X-CSRFToken')==token
+
+    def form(self):
+        '''
+        Return the request's form data (urlencoded, or query parameters) as a list of (name, value) pairs
+        '''
+        pairs = urlparse.parse_qsl(self.body, keep_blank_values=True)
+        for name, values in self.query.items():
+            pairs += [(name, x) for x in values]
+        return pairs
+
+    def json_body(self):
+        return json.loads(self.body) if self.body else {}
+
+    def multipart(self):
+        environ = {'REQUEST_METHOD': 'POST',
+                   'CONTENT_TYPE': self.headers.get('Content-Type', ''),
+                   'CONTENT_LENGTH': str(len(self.body)),
+                   }
+        return cgi.FieldStorage(fp=StringIO(self.body), headers=self.headers, environ=environ)
+
+    def get_course(self, cid=None, key=None):
+        '''
+        Return the FakeCourse for the given course id (or block, or asset, key), or send a 404 and return None
+        '''
+        if key:
+            cid = "course-v1:%s" % key.split(':', 1)[-1].split('+type@', 1)[0]
+        course = self.server.courses.get(cid)
+        if course is None:
+            self.send(404, {'error': "no such course %s" % cid})
+        return course
+
+    def get_block(self, key):
+        course = self.get_course(key=key)
+        if course is None:
+            return None, None
+        block = course.blocks.get(key)
+        if block is None:
+            self.send(404, {'error': "no such xblock %s" % key})
+        return course, block
+
+    #-----------------------------------------------------------------------------
+    # login
+
+    def do_login_page(self):
+        if not self.cookie('csrftoken'):
+            self.set_cookie('csrftoken', uuid.uuid4().hex)
+        self.send(200, '<html><body><form id="login"><input name="email"/><input name="password" type="password"/></form></body></html>',
+                  "text/html")
+
+    def check_login(self):
+        if not self.csrf_ok():
+            return False
+        form = dict(self.form())
+        username = form.get('email')
+        users = self.server.users
+        if users is not None and not users.get(username)==form.get('password'):
+            return False
+        sessionid = uuid.uuid4().hex
+        self.server.sessions[sessionid] = username
+        self.set_cookie('sessionid', sessionid)
+        return True
+
+    def do_studio_login(self):
+        ok = self.check_login()
+        self.send_json({'success': ok} if ok else {'success': False, 'value': "Email or password is incorrect."})
+
+    def do_lms_login(self):
+        if self.check_login():
+            return self.send_json({})
+        self.send(400, "Email or password is incorrect.", "text/plain")
+
+    def do_studio_home(self):
+        items = ['<li class="course-item" data-course-key="%s"><h3 class="course-title">%s</h3></li>' % (cid, cgi.escape(course.metadata['display_name']))
+                 for cid, course in self.server.courses.items()]
+        self.send_validated('<html><body><ul class="list-courses">%s</ul></body></html>' % ''.join(items), "text/html")
+
+    def do_dashboard(self):
+        self.send(200, "<html><body>Dashboard for %s</body></html>" % cgi.escape(self.user), "text/html")
+
+    #-----------------------------------------------------------------------------
+    # Studio: courses
+
+    def do_create_course(self):
+        data = self.json_body()
+        cid = "course-v1:%s+%s+%s" % (data['org'], data['number'], data['run'])
+        if cid in self.server.courses:
+            return self.send_json({'ErrMsg': "There is already a course defined with the same organization and course number."})
+        self.server.add_course(FakeCourse(cid, chapters=0, assets=0, display_name=data.get('display_name')))
+        self.send_json({'url': "/course/%s" % cid, 'course_key': cid})
+
+    def do_delete_course(self, cid):
+        if self.get_course(cid) is None:
+            return
+        self.server.courses.pop(cid, None)
+        self.send_json({'deleted': cid})
+
+    def do_get_course_details(self, cid):
+        course = self.get_course(cid)
+        if course:
+            self.send_validated(course.metadata)
+
+    def do_update_course_details(self, cid):
+        course = self.get_course(cid)
+        if course:
+            with course.lock:
+                course.metadata.update(self.json_body())
+                course.touch()
+            self.send_json(course.metadata)
+
+    #-----------------------------------------------------------------------------
+    # Studio: xblocks
+
+    def do_outline(self, key):
+        course, block = self.get_block(key)
+        if block:
+            with course.lock:
+                self.send_validated(course.xblock_info(key))
+
+    def do_get_xblock(self, key, view=None):
+        course, block = self.get_block(key)
+        if not block:
+            return
+        with course.lock:
+            if view=="container_preview":
+                return self.send_validated(course.container_preview(key))
+            self.send_validated(course.xblock_json(key))
+
+    def do_post_xblock(self, key=None):
+        data = self.json_body()
+        course = self.get_course(key=key or data.get('parent_locator') or '')
+        if not course:
+            return
+        if key is None or (key not in course.blocks and data.get('parent_locator')):	# create
+            course, parent = self.get_block(data.get('parent_locator'))
+            if not parent:
+                return
+            block = course.add_block(parent, data['category'], display_name=data.get('display_name'), usage_key=key)
+            return self.send_json({'locator': block['id'], 'courseKey': course.course_id})
+        course, block = self.get_block(key)
+        if not block:
+            return
+        with course.lock:
+            if data.get('data') is not None:
+                block['data'] = data['data']
+            metadata = data.get('metadata') or {}
+            if 'display_name' in metadata:
+                block['display_name'] = metadata.pop('display_name')
+            block['metadata'].update(metadata)
+            if data.get('publish')=="make_public":
+                block['published_on'] = course.timestamp()
+                block['has_changes'] = False
+            elif data.get('data') is not None or metadata:
+                block['has_changes'] = True			# edited draft, not yet seen by the LMS
+            course.touch()
+            self.send_json(course.xblock_json(key))
+
+    def do_delete_xblock(self, key):
+        course, block = self.get_block(key)
+        if block:
+            course.delete_block(key)
+            self.send(204, "", "text/plain")
+
+    #-----------------------------------------------------------------------------
+    # Studio: static assets
+
+    def do_list_assets(self, cid):
+        course = self.get_course(cid)
+        if not course:
+            return
+        page = int(self.query.get('page', ['0'])[0])
+        page_size = int(self.query.get('page_size', ['50'])[0])
+        with course.lock:
+            assets = course.assets.values()
+        items = [dict([(k, v) for (k, v) in x.items() if not k=='content']) for x in assets[page * page_size:(page + 1) * page_size]]
+        self.send_validated({'assets': items,
+                             'start': page * page_size,
+                             'end': page * page_size + len(items),
+                             'page': page,
+                             'pageSize': page_size,
+                             'totalCount': len(assets),
+                             })
+
+    def do_upload_asset(self, cid):
+        course = self.get_course(cid)
+        if not course:
+            return
+        field = self.multipart()['file']
+        asset = course.add_asset(field.filename, field.value, field.type or "application/octet-stream")
+        self.send_json({'asset': dict([(k, v) for (k, v) in asset.items() if not k=='content']), 'msg': "Upload completed"})
+
+    def do_delete_asset(self, cid, asset_key):
+        course = self.get_course(cid)
+        if not course:
+            return
+        with course.lock:
+            if course.assets.pop(asset_key, None) is None:
+                return self.send(404, {'error': "no such asset %s" % asset_key})
+            course.touch()
+        self.send(204, "", "text/plain")
+
+    def do_get_asset(self, ckey, fn):
+        course = self.get_course("course-v1:%s" % ckey)
+        if not course:
+            return
+        asset = course.find_asset(fn)
+        if not asset:
+            return self.send(404, "<html><body>Page Not Found</body></html>", "text/html")
+        self.send(200, asset['content'], asset['content_type'])
+
+    #-----------------------------------------------------------------------------
+    # Studio: export and import
+
+    def do_export_page(self, cid):
+        if self.get_course(cid):
+            self.send(200, "<html><body>Export course %s</body></html>" % cgi.escape(cid), "text/html")
+
+    def do_start_export(self, cid):
+        if self.get_course(cid):
+            self.server.exports[cid] = 0
+            self.send_json({'ExportStatus': 1})
+
+    def do_export_status(self, cid):
+        if not self.get_course(cid):
+            return
+        nstatus = self.server.exports.get(cid)
+        if nstatus is None:
+            return self.send_json({'ExportStatus': 0})
+        self.server.exports[cid] = nstatus + 1
+        if nstatus < 1:		# report "exporting" once, before done
+            return self.send_json({'ExportStatus': 2})
+        self.send_json({'ExportStatus': 3, 'ExportOutput': "/export_output/%s/course.tar.gz" % cid})
+
+    def do_export_output(self, cid):
+        course = self.get_course(cid)
+        if not course:
+            return
+        content = course.tarball()
+        etag = '"%s"' % hashlib.md5(content).hexdigest()
+        if self.headers.get('If-None-Match')==etag:
+            return self.send(304, "", "application/x-gzip", [('ETag', etag)])
+        rng = re.match('bytes=([0-9]+)-$', self.headers.get('Range', ''))
+        if rng and (not self.headers.get('If-Range') or self.headers.get('If-Range')==etag):
+            start = int(rng.group(1))
+            if start >= len(content):
+                return self.send(416, "", "text/plain", [('Content-Range', 'bytes */%d' % len(content))])
+            return self.send(206, content[start:], "application/x-gzip",
+                             [('ETag', etag), ('Content-Range', 'bytes %d-%d/%d' % (start, len(content) - 1, len(content)))])
+        self.send(200, content, "application/x-gzip", [('ETag', etag)])
+
+    def do_import_chunk(self, cid):
+        course = self.get_course(cid)
+        if not course:
+            return
+        m = re.match('bytes ([0-9]+)-([0-9]+)/([0-9]+)', self.headers.get('Content-Range', ''))
+        field = self.multipart()['course-data']
+        fn = field.filename.replace('/', '-')
+        imports = self.server.imports
+        with course.lock:
+            upload = imports.setdefault((cid, fn), {'data': "", 'status': None})
+            start, end, total = [int(x) for x in m.groups()] if m else (0, len(field.value) - 1, len(field.value))
+            if start==0:
+                upload.update({'data': "", 'status': None})
+            if not start==len(upload['data']):
+                return self.send(400, {'ErrMsg': "File upload corrupted. Please try again"})
+            upload['data'] += field.value
+            if len(upload['data']) >= total:
+                try:
+                    tarfile.open(fileobj=StringIO(upload['data']), mode='r:gz').getmembers()
+                    upload['status'] = 0
+                except Exception as err:
+                    upload['status'] = -2			# failed at verifying
+        self.send_json({'ImportStatus': 1})
+
+    def do_import_status(self, cid, fn):
+        upload = self.server.imports.get((cid, fn))
+        if upload is None or upload['status'] is None:
+            return self.send_json({'ImportStatus': 0})
+        status = upload['status']
+        if 0 <= status < 4:			# advance one stage per poll
+            upload['status'] = status + 1
+        self.send_json({'ImportStatus': status})
+
+    #-----------------------------------------------------------------------------
+    # LMS: problems
+
+    def do_jump_to_id(self, cid, url_name):
+        if self.get_course(cid):
+            self.send(200, "<html><body>Problem %s</body></html>" % cgi.escape(url_name), "text/html")
+
+    def do_xmodule_handler(self, cid, key, handler):
+        course, block = self.get_block(key)
+        if not block:
+            return
+        url_name = block['url_name']
+        if handler=="problem_get":
+            return self.send_json({'html': course.problem_html(url_name)})
+        if handler=="problem_show":
+            answers = course.answers(url_name)
+            return self.send_json({'answers': dict([(course.input_id(url_name, k), x) for (k, x) in enumerate(answers)])})
+        if not handler=="problem_check":
+            return self.send(404, {'error': "unknown handler %s" % handler})
+        attempts = self.server.attempts
+        akey = (self.user, key)
+        with course.lock:
+            attempts[akey] += 1
+            if course.max_attempts and attempts[akey] > course.max_attempts:
+                return self.send_json({'success': "Please refresh your page: you have used all your attempts."})
+        self.send_json(course.check_problem(url_name, self.form()))
+
+    #-----------------------------------------------------------------------------
+    # LMS: instructor dashboard
+
+    def do_instructor_dashboard(self, cid):
+        course = self.get_course(cid)
+        if not course:
+            return
+        fields = OrderedDict([('course-organization', course.course_key.split('+')[0]),
+                              ('course-number', course.course_key.split('+')[1]),
+                              ('course-name', course.course_key.split('+')[-1]),
+                              ('course-display-name', course.metadata['display_name']),
+                              ('course-start-date', course.metadata['start_date']),
+                              ('course-end-date', course.metadata['end_date'] or "No end date set"),
+                              ('course-started', "yes"),
+                              ('course-num-sections', str(len(course.blocks[course.root_key]['children']))),
+                              ('grade-cutoffs', "{'Pass': 0.5}"),
+                              ])
+        items = ''.join(['<li class="field text is-not-editable" id="field-%s"><label>%s</label><b>%s</b></li>' % (k, k, cgi.escape(v))
+                         for (k, v) in fields.items()])
+        self.send(200, '<html><body><section id="course_info"><div class="basic-wrapper"><ul>%s</ul></div></section></body></html>' % items,
+                  "text/html")
+
+    def add_report(self, course, name, content):
+        self.server.reports[name] = content
+        course.reports.append({'name': name, 'url': "%s/reports/%s" % (self.server.base_url, urllib.quote(name)),
+                               'link': '<a href="/reports/%s">%s</a>' % (urllib.quote(name), name)})
+
+    def do_instructor_api(self, cid, action):
+        course = self.get_course(cid)
+        if not course:
+            return
+        form = dict(self.form())
+        date = time.strftime("%Y-%m-%d-%H%M", time.gmtime())
+        prefix = cid.replace(':', '_').replace('+', '_')
+        if action=="list_report_downloads":
+            return self.send_json({'downloads': list(reversed(course.reports))})
+        if action=="list_instructor_tasks":
+            return self.send_json({'tasks': []})
+        if action=="get_problem_responses":
+            mid = form.get('problem_location', '')
+            if mid not in course.blocks:
+                return self.send(400, {'error': "no such problem %s" % mid})
+            rows = "username,state\n" + ''.join(["student%d,{}\n" % k for k in range(5)])
+            self.add_report(course, "%s_student_state_from_%s_%s.csv" % (prefix, mid.replace(':', '_'), date), rows)
+            return self.send_json({'status': "The problem responses report is being created. To view the status of the report, "
+                                             "see Pending Tasks below.", 'task_id': uuid.uuid4().hex})
+        if action=="calculate_grades_csv":
+            self.add_report(course, "%s_grade_report_%s.csv" % (prefix, date), "Student ID,Email,Username,Grade\n")
+            return self.send_json({'status': "The grade report is being created."})
+        if action=="reset_student_attempts":
+            student = form.get('unique_student_identifier') or self.user
+            self.server.attempts.pop((student, form.get('problem_to_reset')), None)
+            return self.send_json({'student': student, 'problem_to_reset': form.get('problem_to_reset')})
+        if action in ["modify_access", "update_forum_role_membership"]:
+            return self.send_json({'unique_student_identifier': form.get('unique_student_identifier'),
+                                   'rolename': form.get('rolename'), 'action': form.get('action'), 'success': "yes"})
+        self.send(404, {'error': "unknown instructor api action %s" % action})
+
+    def do_get_report(self, name):
+        content = self.server.reports.get(name)
+        if content is None:
+            return self.send(404, "<html><body>Page Not Found</body></html>", "text/html")
+        etag = '"%s"' % hashlib.md5(content).hexdigest()
+        if self.headers.get('If-None-Match')==etag:
+            return self.send(304, "", "text/csv", [('ETag', etag)])
+        self.send(200, content, "text/csv", [('ETag', etag)])
+
+#-----------------------------------------------------------------------------
+
+class FakeEdxServer(ThreadingMixIn, HTTPServer):
+    '''
+    Threaded HTTP server acting as both edX LMS and Studio, for the given FakeCourse's.
+
+    Logins succeed for the username and password pairs in users (any, if users is None).
+    Each request is delayed by latency (seconds, or a function of method and path returning
+    seconds), and fails with error_status (e.g. 503, with a Retry-After of retry_after seconds,
+    if given) with probability error_rate (except for login requests, so that clients can
+    always get started).  Server side handling times are collected in
+    self.metrics (by endpoint template, see Metrics).  If etags, the course listing, course
+    details, outline, xblock, and asset list responses have ETags, and are answered with 304
+    when the client has the current version.
+
+    Use start() to serve from a background thread, and base_url to point edXapi at it.
+    '''
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, courses=None, host="127.0.0.1", port=0, users=None, latency=None, error_rate=0,
+                 error_status=503, retry_after=None, seed=None, etags=True, verbose=False):
+        HTTPServer.__init__(self, (host, port), FakeEdxHandler)
+        self.courses = OrderedDict()
+        for course in (courses or [FakeCourse()]):
+            self.add_course(course)
+        self.users = users
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.etags = etags
+        self.verbose = verbose
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.sessions = {}
+        self.exports = {}
+        self.imports = {}
+        self.reports = {}
+        self.attempts = defaultdict(int)
+        self.metrics = Metrics()
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return "http://%s:%d" % (host, port)
+
+    def add_course(self, course):
+        course.reports = []
+        self.courses[course.course_id] = course
+
+    def handle_error(self, request, client_address):
+        if self.verbose:				# else ignore, e.g. clients dropping keep-alive connections
+            HTTPServer.handle_error(self, request, client_address)
+
+    def random(self):
+        with self.rng_lock:
+            return self.rng.random()
+
+    def delay(self, method, path):
+        if not self.latency:
+            return 0
+        if callable(self.latency):
+            return self.latency(method, path)
+        return float(self.latency)
+
+    def start(self):
+        '''
+        Serve requests from a background (daemon) thread; returns self
+        '''
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self.thread:
+            self.thread.join()
+
+#-----------------------------------------------------------------------------
+
+def make_test_file(course, ofn, base_url, username, password, max_problems=None):
+    '''
+    Write a course unit test (YAML) file, with tests of every problem in the FakeCourse course
+    (or of the first max_problems), for the fake server at base_url.  Returns the number of tests.
+    '''
+    import yaml
+    tests = course.make_tests(max_problems=max_problems)
+    cut_spec = {'config': {'course_id': course.course_id,
+                           'site_base_url': base_url,
+                           'username': username,
+                           'password': password,
+                           },
+                'tests': tests,
+                }
+    with open(ofn, 'w') as fp:
+        fp.write(yaml.safe_dump(cut_spec))
+    return len(tests)
+
+#-----------------------------------------------------------------------------
+# unit tests
+
+def fake_api(srv, studio=True, **kwargs):
+    from edxapi import edXapi
+    course_id = srv.courses.keys()[0]
+    return edXapi(srv.base_url, "staff@example.com", "edx", course_id, studio=studio, **kwargs)
+
+def test_fake_edx_studio():
+    import os
+    import shutil
+    srv = FakeEdxServer([FakeCourse(chapters=3, sequentials=2, verticals=2, problems=3, assets=60)],
+                        users={'staff@example.com': "edx"}).start()
+    try:
+        ea = fake_api(srv)
+        assert ea.login_ok
+        assert ea.list_courses()['course_ids']==["course-v1:edX+FakeX+2026"]
+        assert fake_api(srv) and not edxapi_login_ok(srv, "wrong")
+        assert ea.list_chapters()['titles']==["Chapter 1", "Chapter 2", "Chapter 3"]
+        assert len(ea.list_xblocks(path=["chapter_2", "sequential_3", "vertical_5"])['blocks'])==3
+        ret = ea.create_xblock(path=["chapter_1", "sequential_1", "vertical_1"], name="new problem", category="problem",
+                               data="<problem/>")
+        assert ret['data']=="<problem/>"
+        blocks = ea.list_xblocks(path=["chapter_1", "sequential_1", "vertical_1"])['blocks']
+        assert [x['display_name'] for x in blocks][-1]=="new problem"
+        ea.delete_xblock(blocks[-1]['id'])
+        assert len(ea.list_static_assets())==60
+        assert ea.get_static_asset("asset_7.png").startswith("\x89PNG")
+        ea.data_dir = "/tmp/edxcut_tmp_fake_edx"
+        shutil.rmtree(ea.data_dir, True)
+        tfn = ea.download_course_tarball()
+        assert tarfile.open(tfn).getmember("course/problem/problem_4.xml")
+        ret = ea.import_course_tarball(tfn, chunk_size=1000)
+        assert ret['ok'] and [x['status'] for x in ret['stages']]==[0, 1, 2, 3, 4]
+        assert ea.upload_course_tarball(tfn, chunk_size=1000) is True
+        open(ea.data_dir + "/empty.tar.gz", 'w').close()
+        try:
+            ea.upload_course_tarball(ea.data_dir + "/empty.tar.gz")
+            assert False, "empty tarball uploaded"
+        except Exception as err:
+            assert "empty" in str(err)
+        ea.update_course_metadata({'end_date': "2027-01-01T00:00:00Z"}, single_field=True)
+        assert ea.get_course_metadata()['end_date']=="2027-01-01T00:00:00Z"
+    finally:
+        srv.stop()
+
+def test_outline_cache_clones():
+    srv = FakeEdxServer([FakeCourse(chapters=2), FakeCourse(course_id="course-v1:edX+FakeY+2026", chapters=3)]).start()
+    cids = sorted(srv.courses)
+    try:
+        ea = fake_api(srv, outline_cache=True)
+        ea.set_course_id(cids[0])
+        assert len(ea.list_chapters()['titles'])==2
+        other = ea.clone()
+        other.set_course_id(cids[1])
+        assert len(other.list_chapters()['titles'])==3
+        assert ea._get_block_by_name_from_outline(path=["chapter_2", "sequential_3"])['id'].startswith("block-v1:edX+FakeX")
+        assert other._get_block_by_name_from_outline(path=["chapter_3", "sequential_5"])['id'].startswith("block-v1:edX+FakeY")
+        outlines = [x['count'] for x in srv.metrics.summary()['requests'] if "/xblock/outline/" in x['endpoint']]
+        assert sum(outlines)==2
+    finally:
+        srv.stop()
+
+def edxapi_login_ok(srv, password):
+    from edxapi import edXapi
+    try:
+        return edXapi(srv.base_url, "staff@example.com", password, studio=True).login_ok
+    except Exception as err:
+        return False
+
+def test_fake_edx_lms():
+    import os
+    from course_unit_tester import CourseUnitTester
+    course = FakeCourse(chapters=1, sequentials=2, verticals=2, problems=3, max_attempts=1)
+    srv = FakeEdxServer([course], latency=0.001).start()
+    try:
+        ea = fake_api(srv, studio=False)
+        assert ea.get_basic_course_info()['course-num-sections']=="1"
+        answers = course.answers("problem_1")
+        ret = ea.do_xblock_check_problem("problem_1", answers)
+        assert ret['success']=="correct"
+        tfn = "/tmp/edxcut_tmp_fake_edx_tests.yaml"
+        assert make_test_file(course, tfn, srv.base_url, "staff@example.com", "edx")==24
+        cut = CourseUnitTester(cutfn=tfn, jobs=4)
+        cut.run_all_tests()
+        assert cut.test_results['n_passed']==24 and cut.test_results['n_problems']==12
+        ea.data_dir = "/tmp/edxcut_tmp_fake_edx"
+        ret = ea.get_problem_responses_reports([course.block_key('problem', 'problem_2')], max_interval=0.1)
+        assert ret['done']==[course.block_key('problem', 'problem_2')] and len(ret['reports'])==1
+    finally:
+        srv.stop()
+
+def test_fake_edx_errors():
+    srv = FakeEdxServer(error_rate=0.3, retry_after=0, seed=1).start()
+    try:
+        ea = fake_api(srv, retries=8)
+        assert len(ea.list_chapters()['blocks'])==2
+        assert any([x['status'].get('503') for x in srv.metrics.summary()['requests']])
+    finally:
+        srv.stop()
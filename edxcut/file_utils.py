@@ -0,0 +1,79 @@
+'''
+Helpers for files shared between edxcut runs (sessions, site profiles, caches, results, and
+manifests): lock files held across processes, and atomic writes, so that a reader never sees
+a partly written file, even if the writer crashes.
+'''
+
+import os
+import fcntl
+import threading
+
+from contextlib import contextmanager
+
+#-----------------------------------------------------------------------------
+
+def ensure_dir(dn, mode=0700):
+    '''
+    Create directory dn (with its parents) if it does not exist; safe against concurrent creation
+    '''
+    if dn and not os.path.exists(dn):
+        try:
+            os.makedirs(dn, mode)
+        except OSError:
+            if not os.path.isdir(dn):
+                raise
+
+@contextmanager
+def locked(fn):
+    '''
+    Hold an exclusive lock, shared with other processes (and threads), for file fn, using the
+    lock file fn + ".lock" (its directory is created, readable only by the owner, if missing)
+    '''
+    ensure_dir(os.path.dirname(fn))
+    with open(fn + ".lock", 'a') as lfp:
+        fcntl.flock(lfp, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lfp, fcntl.LOCK_UN)
+
+@contextmanager
+def atomic_write(fn, mode=None):
+    '''
+    Return (as a context manager) a file object for writing fn atomically: it is written as
+    a temporary file, named for the process and thread, which is renamed to fn when the body
+    completes, and removed if it raises.
+
+    mode = (int) permissions for the file, e.g. 0600 for credentials (default as for open)
+    '''
+    tfn = "%s.tmp%d.%d" % (fn, os.getpid(), threading.current_thread().ident)
+    fd = os.open(tfn, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0666 if mode is None else mode)
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            yield fp
+        os.rename(tfn, fn)
+    except BaseException:
+        if os.path.exists(tfn):
+            os.unlink(tfn)
+        raise
+
+#-----------------------------------------------------------------------------
+# unit tests
+
+def test_atomic_write():
+    import shutil
+    dn = "/tmp/edxcut_tmp_file_utils"
+    shutil.rmtree(dn, True)
+    fn = os.path.join(dn, "sub", "data.txt")
+    with locked(fn):
+        with atomic_write(fn, mode=0600) as fp:
+            fp.write("one")
+    assert open(fn).read()=="one" and oct(os.stat(fn).st_mode & 0777)=='0600'
+    assert oct(os.stat(os.path.dirname(fn)).st_mode & 0777)=='0700'
+    try:
+        with atomic_write(fn) as fp:
+            fp.write("partial")
+            raise ValueError("crash")
+    except ValueError:
+        pass
+    assert open(fn).read()=="one" and sorted(os.listdir(os.path.dirname(fn)))==["data.txt", "data.txt.lock"]
@@ -3,9 +3,9 @@ Run unit tests on edX courses, to ensure problem responses are graded properly.
 Also can be used to create unit tests, from an xbundle file.
 '''
 
+import os
 import sys
 import argparse
-from course_unit_tester import CourseUnitTester
 from collections import defaultdict
 
 #-----------------------------------------------------------------------------
@@ -26,18 +26,36 @@ def CommandLine(args=None, arglist=None):
 
 Commands:
 
-test               - give unit test yaml file(s) as argument(s)
+test               - give unit test yaml file(s) as argument(s); use --jobs N to run N tests concurrently;
+                     use --shard i/N to run only shard i of N (e.g. on N hosts), and --results-file to
+                     save the results as JSON
+merge_results      - give the JSON results files of shard runs as arguments; prints the combined report,
+                     and writes the combined results to the file given with -o
 make_tests         - give xbundle file(s) as argument(s); produces test yaml file as output
                      (on stdout, or use -o)
 edxapi             - run edxapi (edxapi -h for more)
+benchmark          - run benchmarks of edxcut, offline (benchmark -h for more)
+fake_server        - run a local stand-in edX site with a synthetic course (see --course-size, --latency,
+                     --error-rate); if a yaml file is given as argument, tests for the course are written to it
+serve              - run the edxcut daemon, which keeps logged-in edX sessions warm, and runs commands for
+                     "edxcut edxapi --daemon ..." (started automatically by those); "serve status" and
+                     "serve stop" check on, and stop, a running daemon
 
 Examples:
 
 - ...
 """
     if len(sys.argv)>1 and sys.argv[1]=="edxapi":
+        if "--daemon" in sys.argv[2:] or os.environ.get("EDXCUT_DAEMON"):
+            import edxcut_daemon
+            code = edxcut_daemon.run_client(sys.argv[2:])
+            if code is not None:
+                sys.exit(code)
         import edxapi_cmd
         return edxapi_cmd.CommandLine(arglist=sys.argv[2:])
+    if len(sys.argv)>1 and sys.argv[1]=="benchmark":
+        import benchmarks
+        return benchmarks.CommandLine(arglist=sys.argv[2:])
 
     parser = argparse.ArgumentParser(description=help_text, formatter_class=argparse.RawTextHelpFormatter)
     
@@ -48,12 +66,52 @@ Examples:
     parser.add_argument("-u", "--username", type=str, help="username for course site access", default=None)
     parser.add_argument("-p", "--password", type=str, help="password for course site access", default=None)
     parser.add_argument("-c", "--course_id", type=str, help="course_id, e.g. course-v1:edX+DemoX+Demo_Course", default=None)
+    parser.add_argument("--jobs", type=int, help="number of tests to run concurrently (tests on the same problem are always run serially)", default=None)
+    parser.add_argument("--metrics-file", type=str, help="write request and parse timings to this file (Prometheus text if it ends in .prom, else JSON)", default=None)
+    parser.add_argument("--record", type=str, help="record all HTTP requests and responses to this cassette file (.jsonl.gz)", default=None)
+    parser.add_argument("--replay", type=str, help="replay HTTP responses from this cassette file, instead of accessing the edX site", default=None)
+    parser.add_argument("--replay-latency", type=str, help="delay for each replayed request: seconds, or 'recorded' for the recorded times", default=None)
+    parser.add_argument("--session-cache", type=str, nargs='?', const=True, default=None,
+                        help="reuse the login session from earlier runs, stored in this directory (default ~/.edxcut/sessions)")
+    parser.add_argument("--site-profile", type=str, nargs='?', const=True, default=None,
+                        help="keep the status index offsets learned for the site, for later runs, in this directory (default ~/.edxcut/sites)")
+    parser.add_argument("--incremental", type=str, nargs='?', const=True, default=None,
+                        help="only re-run tests whose problem, grader library, or definition changed since their results were "
+                        "stored in this file (default <test file base>.results.json); needs --studio-base-url")
+    parser.add_argument("--studio-base-url", type=str, help="base url for the course's Studio site, e.g. http://192.168.33.10:18010", default=None)
+    parser.add_argument("--shard", type=str, help="run only the tests in shard i of N (as i/N, with 1 <= i <= N); "
+                        "all the tests of a problem are in the same shard", default=None)
+    parser.add_argument("--combine-tests", action="store_true", help="submit tests of the same problem, on different answer boxes, "
+                        "together in one problem check (only tests expecting a list of per-box results)", default=None)
+    parser.add_argument("--results-file", type=str, help="write the test results to this JSON file (e.g. for merge_results)", default=None)
+    parser.add_argument("-o", "--output-file", type=str, help="output file, for merge_results", default=None)
+    parser.add_argument("--port", type=int, help="port for fake_server to listen on", default=18010)
+    parser.add_argument("--course-size", type=str, help="fake_server course size, as chapters,sequentials,verticals,problems "
+                        "(the last three per parent)", default="2,2,2,2")
+    parser.add_argument("--assets", type=int, help="number of static assets in the fake_server course", default=10)
+    parser.add_argument("--latency", type=float, help="seconds of delay for each fake_server request", default=None)
+    parser.add_argument("--error-rate", type=float, help="fraction of fake_server requests failing with 503", default=0)
+    parser.add_argument("--socket", type=str, help="Unix socket for serve (default ~/.edxcut/edxcut.sock)", default=None)
+    parser.add_argument("--idle-timeout", type=float, help="seconds without requests after which serve exits", default=1800)
     
     if not args:
         args = parser.parse_args(arglist)
 
     if args.cmd=="test":
+        from course_unit_tester import CourseUnitTester
+        from metrics import Metrics
+        from cassette import make_transport
         counts = defaultdict(int)
+        metrics = Metrics()
+        transport = make_transport(record=args.record, replay=args.replay, latency=args.replay_latency)
+        shard = None
+        if args.shard:
+            try:
+                shard = tuple([int(x) for x in args.shard.split('/')])
+                assert len(shard)==2 and 1 <= shard[0] <= shard[1]
+            except Exception:
+                raise Exception("Illegal --shard %s -- must be i/N, with 1 <= i <= N" % args.shard)
+        runs = []
         if len(args.ifn) > 1:
             print "="*70
             print "Running tests from %d files" % len(args.ifn)
@@ -65,8 +123,18 @@ Examples:
                                    password=args.password,
                                    verbose=args.verbose,
                                    course_id=args.course_id,
-                                   cutfn=fn)
+                                   cutfn=fn,
+                                   jobs=args.jobs,
+                                   session_cache=args.session_cache,
+                                   site_profile=args.site_profile,
+                                   results_db=args.incremental,
+                                   studio_base_url=args.studio_base_url,
+                                   shard=shard,
+                                   combine_tests=args.combine_tests,
+                                   metrics=metrics,
+                                   transport=transport)
             cut.run_all_tests()
+            runs.append(cut.results_as_dict())
             for k,v in cut.test_results.items():
                 counts[k] += v
         print "="*70
@@ -76,6 +144,53 @@ Examples:
                                          counts['n_problems'],
                                          counts['n_passed'],
                                          counts['n_failed']))
+        if args.incremental:
+            print "%s tests were unchanged since last run, and not re-run" % counts['n_cached']
+        if args.results_file:
+            CourseUnitTester.write_results(runs, args.results_file)
+        if args.metrics_file:
+            metrics.write(args.metrics_file)
+            if args.verbose:
+                metrics.print_summary()
+
+    elif args.cmd=="merge_results":
+        from course_unit_tester import merge_shard_results
+        merge_shard_results(args.ifn, args.output_file)
+
+    elif args.cmd=="fake_server":
+        import fake_edx
+        sizes = [int(x) for x in args.course_size.split(',')]
+        course = fake_edx.FakeCourse(args.course_id or "course-v1:edX+FakeX+2026", *sizes, assets=args.assets)
+        users = {args.username: args.password} if args.username else None
+        srv = fake_edx.FakeEdxServer([course], host="127.0.0.1", port=args.port, users=users, latency=args.latency,
+                                     error_rate=args.error_rate, verbose=args.verbose)
+        print "Serving %s (%d blocks) at %s" % (course.course_id, len(course.blocks), srv.base_url)
+        for fn in args.ifn:
+            ntests = fake_edx.make_test_file(course, fn, srv.base_url, args.username or "staff@example.com", args.password or "edx")
+            print "Wrote %d tests to %s" % (ntests, fn)
+        sys.stdout.flush()
+        try:
+            srv.serve_forever()
+        except KeyboardInterrupt:
+            srv.server_close()
+            if args.verbose:
+                srv.metrics.print_summary()
+
+    elif args.cmd=="serve":
+        import edxcut_daemon
+        path = edxcut_daemon.socket_path(args.socket)
+        if args.ifn and args.ifn[0] in ["status", "stop"]:
+            ret = edxcut_daemon.request(path, {'op': "ping" if args.ifn[0]=="status" else "shutdown"})
+            if ret is None:
+                print "No edxcut daemon running on %s" % path
+            elif args.ifn[0]=="status":
+                print "edxcut daemon pid %d running on %s, with %d logged-in sessions" % (ret['pid'], path, ret['instances'])
+            return
+        daemon = edxcut_daemon.EdxcutDaemon(path, idle_timeout=args.idle_timeout, verbose=args.verbose)
+        try:
+            daemon.serve()
+        except KeyboardInterrupt:
+            pass
 
     elif args.cmd=="make_tests":
         import make_tests
@@ -84,6 +199,39 @@ Examples:
     else:
         print ("Unknown command %s" % args.cmd)
 
+#-----------------------------------------------------------------------------
+# unit tests
+
+HEAVY_MODULES = ['pytest', 'lxml.etree', 'pysrt', 'yaml']
+STARTUP_IMPORT_BOUND = 0.15	# seconds that importing the command line modules may add to python startup
+
+def test_startup_imports():
+    '''
+    The command line modules must not import the test framework, or parsing and subtitle
+    libraries, until a command needs them (the CLI is run many times by scripts).
+    '''
+    import subprocess
+    code = "import sys, main, edxapi_cmd, edxcut_daemon; print ' '.join([m for m in %r if m in sys.modules])" % HEAVY_MODULES
+    out = subprocess.check_output([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert out.split()==[]
+
+def test_startup_time():
+    '''
+    Importing the command line modules must add less than STARTUP_IMPORT_BOUND seconds to the startup
+    of python itself (fastest of several runs of each, to discount noise)
+    '''
+    import time
+    import subprocess
+    def startup_time(code):
+        times = []
+        for k in range(5):
+            t0 = time.time()
+            subprocess.check_call([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)))
+            times.append(time.time() - t0)
+        return min(times)
+    extra = startup_time("import main, edxapi_cmd, edxcut_daemon") - startup_time("pass")
+    assert extra < STARTUP_IMPORT_BOUND, "importing the command line took %.3f sec more than python -c pass" % extra
+
 #-----------------------------------------------------------------------------
 
 if __name__=="__main__":
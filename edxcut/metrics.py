@@ -0,0 +1,225 @@
+'''
+Timing metrics for edXapi: latency, status, and size of HTTP requests (aggregated
+by endpoint template), and durations of named processing phases (e.g. HTML parsing).
+'''
+
+import os
+import re
+import json
+import math
+import time
+import urlparse
+import threading
+
+from contextlib import contextmanager
+from collections import defaultdict
+from file_utils import atomic_write
+
+#-----------------------------------------------------------------------------
+
+class Metrics(object):
+    '''
+    Thread-safe collector of request and phase timings.
+
+    Requests are grouped by (method, endpoint template), where the template is the URL host
+    and path, with course ids, usage keys, hex ids, numbers, and file names replaced by
+    placeholders (see endpoint_template), so that e.g. all get_xblock calls fall together.
+
+    Aggregates (count, total and p50/p95/p99 seconds, bytes, and counts by status) are
+    available from summary(), and can be written as JSON or as Prometheus text (see write).
+    '''
+    TEMPLATE_RULES = [
+        (re.compile('block-v1:[^/?#]+'), '{usage_key}'),
+        (re.compile('asset-v1:[^/?#]+'), '{asset_key}'),
+        (re.compile('(course|ccx)-v1:[^/?#]+'), '{course_id}'),
+        (re.compile('/[^/]+\.(tar\.gz|csv|srt|sjson|json)$'), '/{file}'),
+        (re.compile('/[0-9a-f]{32}(?=/|$)'), '/{id}'),
+        (re.compile('/[0-9]+(?=/|$)'), '/{n}'),
+    ]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.requests = defaultdict(lambda: {'times': [], 'bytes': 0, 'status': defaultdict(int)})
+            self.phases = defaultdict(list)
+            self.started = time.time()
+
+    @classmethod
+    def endpoint_template(cls, url):
+        '''
+        Return the URL host and path, with variable parts replaced by placeholders
+        '''
+        parts = urlparse.urlsplit(url)
+        path = parts.path
+        for pattern, repl in cls.TEMPLATE_RULES:
+            path = pattern.sub(repl, path)
+        return parts.netloc + path
+
+    def record_request(self, method, url, status, nbytes, elapsed):
+        '''
+        Record one HTTP request: status is the HTTP status code (or the name of the
+        exception raised), nbytes the size of the response body (if known).
+        '''
+        key = (method.upper(), self.endpoint_template(url))
+        with self.lock:
+            stat = self.requests[key]
+            stat['times'].append(elapsed)
+            stat['bytes'] += nbytes or 0
+            stat['status'][str(status)] += 1
+
+    def record_phase(self, name, elapsed):
+        with self.lock:
+            self.phases[name].append(elapsed)
+
+    @contextmanager
+    def phase(self, name):
+        '''
+        Context manager which records the time taken by its body, as phase name
+        '''
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            self.record_phase(name, time.time() - t0)
+
+    @staticmethod
+    def percentile(times, pct):
+        '''
+        Nearest-rank percentile of a sorted list
+        '''
+        if not times:
+            return None
+        k = max(0, min(len(times) - 1, int(math.ceil(pct / 100.0 * len(times))) - 1))
+        return times[k]
+
+    def timing_summary(self, times):
+        times = sorted(times)
+        return {'count': len(times),
+                'total_sec': sum(times),
+                'p50_sec': self.percentile(times, 50),
+                'p95_sec': self.percentile(times, 95),
+                'p99_sec': self.percentile(times, 99),
+                'max_sec': times[-1] if times else None,
+                }
+
+    def summary(self):
+        '''
+        Return dict of aggregate metrics: {'requests': [...], 'phases': [...], 'elapsed_sec': ...},
+        with requests sorted by total time, most first.
+        '''
+        with self.lock:
+            requests = []
+            for (method, template), stat in self.requests.items():
+                data = self.timing_summary(stat['times'])
+                data.update({'method': method,
+                             'endpoint': template,
+                             'bytes': stat['bytes'],
+                             'status': dict(stat['status']),
+                             })
+                requests.append(data)
+            phases = []
+            for name, times in self.phases.items():
+                data = self.timing_summary(times)
+                data['phase'] = name
+                phases.append(data)
+            elapsed = time.time() - self.started
+        return {'elapsed_sec': elapsed,
+                'requests': sorted(requests, key=lambda x: -x['total_sec']),
+                'phases': sorted(phases, key=lambda x: -x['total_sec']),
+                }
+
+    def to_prometheus(self):
+        '''
+        Return metrics in Prometheus text exposition format (e.g. for the node exporter's textfile collector)
+        '''
+        def esc(val):
+            return str(val).replace('\\', '\\\\').replace('"', '\\"')
+        summary = self.summary()
+        lines = []
+        lines.append("# HELP edxcut_request_seconds Latency of HTTP requests made by edxcut, by endpoint template")
+        lines.append("# TYPE edxcut_request_seconds summary")
+        for req in summary['requests']:
+            labels = 'method="%s",endpoint="%s"' % (esc(req['method']), esc(req['endpoint']))
+            for pct in [50, 95, 99]:
+                lines.append('edxcut_request_seconds{%s,quantile="%s"} %f' % (labels, pct / 100.0, req['p%d_sec' % pct]))
+            lines.append('edxcut_request_seconds_sum{%s} %f' % (labels, req['total_sec']))
+            lines.append('edxcut_request_seconds_count{%s} %d' % (labels, req['count']))
+        lines.append("# HELP edxcut_request_bytes_total Bytes received in HTTP responses, by endpoint template")
+        lines.append("# TYPE edxcut_request_bytes_total counter")
+        for req in summary['requests']:
+            lines.append('edxcut_request_bytes_total{method="%s",endpoint="%s"} %d' % (esc(req['method']), esc(req['endpoint']), req['bytes']))
+        lines.append("# HELP edxcut_requests_total HTTP requests made by edxcut, by endpoint template and status")
+        lines.append("# TYPE edxcut_requests_total counter")
+        for req in summary['requests']:
+            for status, cnt in sorted(req['status'].items()):
+                lines.append('edxcut_requests_total{method="%s",endpoint="%s",status="%s"} %d' % (esc(req['method']),
+                                                                                                esc(req['endpoint']),
+                                                                                                esc(status), cnt))
+        lines.append("# HELP edxcut_phase_seconds Time spent in processing phases (e.g. HTML parsing)")
+        lines.append("# TYPE edxcut_phase_seconds summary")
+        for phase in summary['phases']:
+            labels = 'phase="%s"' % esc(phase['phase'])
+            for pct in [50, 95, 99]:
+                lines.append('edxcut_phase_seconds{%s,quantile="%s"} %f' % (labels, pct / 100.0, phase['p%d_sec' % pct]))
+            lines.append('edxcut_phase_seconds_sum{%s} %f' % (labels, phase['total_sec']))
+            lines.append('edxcut_phase_seconds_count{%s} %d' % (labels, phase['count']))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, fn):
+        '''
+        Write metrics to file fn (atomically): Prometheus text format if fn ends in .prom,
+        and JSON otherwise.
+        '''
+        if fn.endswith('.prom'):
+            data = self.to_prometheus()
+        else:
+            data = json.dumps(self.summary(), indent=4)
+        with atomic_write(fn) as fp:
+            fp.write(data)
+
+    def print_summary(self, top=10):
+        '''
+        Print the endpoints and phases taking the most time
+        '''
+        summary = self.summary()
+        print "[Metrics] %d requests in %.1f sec" % (sum([x['count'] for x in summary['requests']]), summary['elapsed_sec'])
+        for req in summary['requests'][:top]:
+            print "    %-6s %-70s n=%-5d total=%7.2fs p50=%6.3fs p95=%6.3fs %8d bytes" % (req['method'], req['endpoint'], req['count'],
+                                                                                      req['total_sec'], req['p50_sec'], req['p95_sec'],
+                                                                                      req['bytes'])
+        for phase in summary['phases'][:top]:
+            print "    phase  %-70s n=%-5d total=%7.2fs p50=%6.3fs p95=%6.3fs" % (phase['phase'], phase['count'], phase['total_sec'],
+                                                                                phase['p50_sec'], phase['p95_sec'])
+
+#-----------------------------------------------------------------------------
+# unit tests
+
+def test_endpoint_template():
+    et = Metrics.endpoint_template
+    assert et("http://localhost:18010/xblock/block-v1:edX+DemoX+Demo_Course+type@html+block@abc?x=1")=="localhost:18010/xblock/{usage_key}"
+    assert et("https://lms/courses/course-v1:edX+DemoX+Demo_Course/instructor/api/list_report_downloads")==\
+        "lms/courses/{course_id}/instructor/api/list_report_downloads"
+    assert et("http://s/import_status/course-v1:a+b+c/COURSE-x.tar.gz")=="s/import_status/{course_id}/{file}"
+    assert et("http://s/assets/course-v1:a+b+c/asset-v1:a+b+c+type@asset+block@x.png")=="s/assets/{course_id}/{asset_key}"
+    assert et("http://s/transcripts/75f9562c77bc4858b61f907bb810d974/5")=="s/transcripts/{id}/{n}"
+
+def test_metrics_summary():
+    m = Metrics()
+    for k in range(100):
+        m.record_request('get', "http://s/xblock/block-v1:a+b+c+type@html+block@x%d" % k, 200, 10, (k + 1) / 100.0)
+    m.record_request('post', "http://s/xblock/", 'ConnectionError', None, 1.5)
+    with m.phase('parse:test'):
+        pass
+    summary = m.summary()
+    req = [x for x in summary['requests'] if x['method']=='GET'][0]
+    assert req['count']==100 and req['bytes']==1000
+    assert req['p50_sec']==0.5 and req['p95_sec']==0.95 and req['p99_sec']==0.99
+    assert summary['requests'][0]['method']=='GET'
+    assert [x for x in summary['requests'] if x['method']=='POST'][0]['status']=={'ConnectionError': 1}
+    assert summary['phases'][0]['phase']=='parse:test'
+    prom = m.to_prometheus()
+    assert 'edxcut_request_seconds_count{method="GET",endpoint="s/xblock/{usage_key}"} 100' in prom
+    assert 'edxcut_phase_seconds_count{phase="parse:test"} 1' in prom
@@ -0,0 +1,308 @@
+'''
+Indexed cache of an edX course outline (as retrieved from Studio), for resolving
+chapter, sequential, and vertical names and paths without re-fetching the outline.
+'''
+
+import os
+import json
+import time
+import threading
+
+from file_utils import atomic_write
+
+#-----------------------------------------------------------------------------
+
+class OutlineCache(object):
+    '''
+    Cache of the course outline returned by edXapi.get_outline, indexed by usage key, and,
+    within each parent block, by url_name and display_name of its children.  Paths (lists
+    of names, starting at the course) which have been resolved are also indexed.
+
+    The outline may optionally be snapshotted to disk (fn), so that it can be reused by
+    later processes, until it is older than ttl seconds.
+    '''
+    def __init__(self, fn=None, ttl=None, verbose=False):
+        '''
+        fn = (string) name of file to use for on-disk snapshot of the outline (none if None)
+        ttl = (float) number of seconds for which a fetched outline remains valid (forever if None)
+        '''
+        self.fn = fn
+        self.ttl = ttl
+        self.verbose = verbose
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        '''
+        Drop the cached outline and all its indexes.
+        '''
+        with self.lock:
+            self.key = None
+            self.outline = None
+            self.fetched_at = None
+            self.by_id = {}
+            self.parent_of = {}
+            self.children_by_url_name = {}
+            self.children_by_name = {}
+            self.by_path = {}
+
+    @staticmethod
+    def url_name(usage_key):
+        return usage_key.rsplit('@', 1)[-1]
+
+    def _index_block(self, block, parent_id=None):
+        bid = block['id']
+        self.by_id[bid] = block
+        self.parent_of[bid] = parent_id
+        if parent_id is not None:
+            self.children_by_url_name[parent_id][self.url_name(bid)] = block
+            self.children_by_name[parent_id].setdefault(block.get('display_name'), block)
+        self.children_by_url_name[bid] = {}
+        self.children_by_name[bid] = {}
+        for child in block.get('child_info', {}).get('children', []):
+            self._index_block(child, bid)
+
+    def _unindex_block(self, bid):
+        block = self.by_id.pop(bid, None)
+        self.parent_of.pop(bid, None)
+        self.children_by_url_name.pop(bid, None)
+        self.children_by_name.pop(bid, None)
+        if block is not None:
+            for child in block.get('child_info', {}).get('children', []):
+                self._unindex_block(child['id'])
+
+    def _reindex_children_by_name(self, parent_id):
+        '''
+        Rebuild display_name index for the children of a block (first child of a given name wins)
+        '''
+        parent = self.by_id[parent_id]
+        names = {}
+        for child in parent.get('child_info', {}).get('children', []):
+            names.setdefault(child.get('display_name'), child)
+        self.children_by_name[parent_id] = names
+
+    def set_outline(self, key, outline, fetched_at=None, save=True):
+        '''
+        Set the cached outline, for the specified key (e.g. (site base url, course_id)), and index it.
+        '''
+        with self.lock:
+            self.clear()
+            self.key = list(key)
+            self.outline = outline
+            self.fetched_at = fetched_at or time.time()
+            self._index_block(outline)
+            if save:
+                self.save()
+
+    def get_outline(self, key):
+        '''
+        Return the cached outline for key, if present and not expired, else None.
+        Loads the on-disk snapshot, if one is specified and nothing is cached in memory.
+        '''
+        with self.lock:
+            if self.outline is None:
+                self.load(key)
+            if self.outline is None or not self.key==list(key):
+                return None
+            if self.ttl is not None and (time.time() - self.fetched_at) > self.ttl:
+                if self.verbose:
+                    print "[OutlineCache] cached outline expired"
+                self.clear()
+                return None
+            return self.outline
+
+    def get_block(self, usage_key):
+        with self.lock:
+            return self.by_id.get(usage_key)
+
+    def has_block(self, block):
+        '''
+        Return True if block (a dict) is part of the cached outline (and thus indexed)
+        '''
+        with self.lock:
+            return self.by_id.get(block.get('id')) is block
+
+    def find_child(self, parent_id, name):
+        '''
+        Return the child of the specified block, with the given url_name (or, failing that,
+        display_name), or None if no such child.
+        '''
+        with self.lock:
+            block = self.children_by_url_name.get(parent_id, {}).get(name)
+            if block is None:
+                block = self.children_by_name.get(parent_id, {}).get(name)
+            return block
+
+    def find_path(self, path, key=None, categories=None):
+        '''
+        Return the block at the specified path (list of names, starting below the course
+        block), or None if any name along the path is missing from the cached outline, or the
+        cached outline is not the one for key (if given).
+
+        categories = (list) expected category of the block at each level (e.g. chapter, sequential,
+                     vertical); None is returned if any block along the path has another category.
+        '''
+        with self.lock:
+            if self.outline is None or (key is not None and not self.key==list(key)):
+                return None
+            path_key = (tuple(path), tuple(categories or []))
+            if path_key in self.by_path:
+                return self.by_path[path_key]
+            block = self.outline
+            for cnt, name in enumerate(path):
+                block = self.find_child(block['id'], name)
+                if block is None:
+                    return None
+                if categories and cnt < len(categories) and not block.get('category')==categories[cnt]:
+                    return None
+            self.by_path[path_key] = block
+            return block
+
+    def add_block(self, parent_id, block):
+        '''
+        Patch a newly created block into the cached outline, as the last child of its parent.
+        Does nothing if the parent is not in the outline, or does not list its children
+        (e.g. blocks inside verticals).
+        '''
+        with self.lock:
+            parent = self.by_id.get(parent_id)
+            if parent is None or 'child_info' not in parent:
+                return
+            parent['child_info']['children'].append(block)
+            self._index_block(block, parent_id)
+            self.by_path = {}
+            self.save()
+
+    def remove_block(self, usage_key):
+        '''
+        Remove a deleted block (and its descendants) from the cached outline.
+        '''
+        with self.lock:
+            if usage_key not in self.by_id:
+                return
+            parent_id = self.parent_of.get(usage_key)
+            self._unindex_block(usage_key)
+            if parent_id is not None and parent_id in self.by_id:
+                children = self.by_id[parent_id]['child_info']['children']
+                children[:] = [x for x in children if not x['id']==usage_key]
+                self.children_by_url_name[parent_id].pop(self.url_name(usage_key), None)
+                self._reindex_children_by_name(parent_id)
+            self.by_path = {}
+            self.save()
+
+    def update_block(self, usage_key, **fields):
+        '''
+        Update fields (e.g. display_name, due) of a block in the cached outline.
+        '''
+        with self.lock:
+            block = self.by_id.get(usage_key)
+            if block is None:
+                return
+            block.update(fields)
+            parent_id = self.parent_of.get(usage_key)
+            if 'display_name' in fields and parent_id is not None:
+                self._reindex_children_by_name(parent_id)
+                self.by_path = {}
+            self.save()
+
+    def save(self):
+        '''
+        Write on-disk snapshot of the cached outline (if a snapshot file was specified).
+        '''
+        if not self.fn or self.outline is None:
+            return
+        with self.lock:
+            data = {'key': self.key,
+                    'fetched_at': self.fetched_at,
+                    'outline': self.outline,
+                    }
+            with atomic_write(self.fn) as fp:
+                json.dump(data, fp)
+
+    def load(self, key):
+        '''
+        Load on-disk snapshot of the outline, if it exists, is for key, and has not expired.
+        '''
+        if not self.fn or not os.path.exists(self.fn):
+            return False
+        try:
+            with open(self.fn) as fp:
+                data = json.load(fp)
+        except Exception as err:
+            if self.verbose:
+                print "[OutlineCache] ignoring unreadable outline snapshot %s, err=%s" % (self.fn, err)
+            return False
+        if not data.get('key')==list(key):
+            return False
+        if self.ttl is not None and (time.time() - data['fetched_at']) > self.ttl:
+            return False
+        self.set_outline(key, data['outline'], fetched_at=data['fetched_at'], save=False)
+        if self.verbose:
+            print "[OutlineCache] loaded outline snapshot from %s" % self.fn
+        return True
+
+#-----------------------------------------------------------------------------
+# unit tests
+
+def make_test_outline():
+    def block(category, url_name, display_name, children=None, child_category=None):
+        data = {'id': "block-v1:UnivX+T1+2099+type@%s+block@%s" % (category, url_name),
+                'category': category,
+                'display_name': display_name,
+                }
+        if children is not None:
+            data['child_info'] = {'category': child_category, 'children': children}
+        return data
+    verticals = [block('vertical', 'v%d' % k, 'Unit %d' % k) for k in range(3)]
+    seqs = [block('sequential', 's1', 'Seq 1', verticals, 'vertical'),
+            block('sequential', 's2', 'Seq 2', [], 'vertical')]
+    chapters = [block('chapter', 'c1', 'Chapter 1', seqs, 'sequential'),
+                block('chapter', 'c2', 'Chapter 1', [], 'sequential')]
+    return block('course', 'course', 'Test course', chapters, 'chapter')
+
+def test_outline_cache_lookup():
+    oc = OutlineCache()
+    key = ('http://localhost', 'course-v1:UnivX+T1+2099')
+    assert oc.get_outline(key) is None
+    oc.set_outline(key, make_test_outline())
+    assert oc.get_outline(key)['category']=='course'
+    assert oc.get_outline(('http://localhost', 'course-v1:other')) is None
+    assert oc.find_path(['c2'])['id'].endswith('@c2')
+    assert oc.find_path(['Chapter 1'])['id'].endswith('@c1')	# first by display_name
+    assert oc.find_path(['c1', 'Seq 1', 'Unit 2'])['id'].endswith('@v2')
+    assert oc.find_path(['c1', 'Seq 1', 'nope']) is None
+    assert oc.find_path(['c1', 's1'], key=key)['id'].endswith('@s1')
+    assert oc.find_path(['c1', 's1'], key=('http://localhost', 'course-v1:other')) is None
+    assert oc.find_path(['c1', 's1'], categories=['chapter', 'sequential'])['id'].endswith('@s1')
+    assert oc.find_path(['c1', 's1'], categories=['chapter', 'vertical']) is None
+
+def test_outline_cache_mutations():
+    oc = OutlineCache()
+    key = ('http://localhost', 'course-v1:UnivX+T1+2099')
+    oc.set_outline(key, make_test_outline())
+    seq2 = oc.find_path(['c1', 's2'])
+    new_id = "block-v1:UnivX+T1+2099+type@vertical+block@newv"
+    oc.add_block(seq2['id'], {'id': new_id, 'category': 'vertical', 'display_name': 'New unit'})
+    assert oc.find_path(['c1', 'Seq 2', 'New unit'])['id']==new_id
+    assert oc.get_block(new_id)['display_name']=='New unit'
+    oc.update_block(new_id, display_name='Renamed unit')
+    assert oc.find_path(['c1', 'Seq 2', 'New unit']) is None
+    assert oc.find_path(['c1', 'Seq 2', 'Renamed unit'])['id']==new_id
+    oc.remove_block(oc.find_path(['c1'])['id'])
+    assert oc.find_path(['c1', 'Seq 2', 'Renamed unit']) is None
+    assert oc.get_block(new_id) is None
+    assert oc.find_path(['Chapter 1'])['id'].endswith('@c2')
+
+def test_outline_cache_snapshot():
+    fn = "/tmp/edxcut_tmp_outline_cache.json"
+    if os.path.exists(fn):
+        os.unlink(fn)
+    key = ('http://localhost', 'course-v1:UnivX+T1+2099')
+    oc = OutlineCache(fn=fn, ttl=60)
+    oc.set_outline(key, make_test_outline())
+    oc2 = OutlineCache(fn=fn, ttl=60)
+    assert oc2.get_outline(key)['id']==oc.outline['id']
+    assert oc2.find_path(['c1', 's1', 'v0'])['display_name']=='Unit 0'
+    oc3 = OutlineCache(fn=fn, ttl=0)
+    time.sleep(0.01)
+    assert oc3.get_outline(key) is None
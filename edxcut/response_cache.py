@@ -0,0 +1,369 @@
+'''
+Cache of responses to read-only GET requests made by edXapi (e.g. for the course outline,
+xblocks, static asset lists, and course metadata), kept in memory, and optionally on disk,
+and revalidated with conditional requests.
+'''
+
+import os
+import json
+import time
+import hashlib
+import requests
+import threading
+
+from collections import OrderedDict
+from file_utils import ensure_dir, locked, atomic_write
+from requests.structures import CaseInsensitiveDict
+
+#-----------------------------------------------------------------------------
+
+class ResponseCache(object):
+    '''
+    LRU cache of GET responses, keyed by username, URL (with query parameters), and Accept header.
+
+    Responses with an ETag or Last-Modified are revalidated on each use, with a conditional
+    request (If-None-Match, If-Modified-Since); if the server replies 304 (Not Modified), the
+    cached body is used.  Responses without validators are used, without any request, for ttl
+    seconds.  Cache-Control headers are ignored (Studio marks its JSON as not cacheable):
+    instead, edXapi drops the responses affected by each change it makes (see invalidate).
+    Changes made by others are seen on revalidation, or after ttl, for responses without validators.
+
+    The memory tier holds up to max_entries responses, with up to max_bytes of bodies.  If
+    cache_dir is given, responses are also stored there (one file each, readable only by the
+    owner), for use by later processes, up to max_disk_bytes (least recently used removed first).
+    Invalidations are recorded there too, so that they apply to the responses stored, or held in
+    memory, by other processes sharing the directory.
+    '''
+    PRUNE_EVERY = 50		# disk stores between checks of the disk tier size
+
+    def __init__(self, cache_dir=None, ttl=60, max_entries=1000, max_bytes=64*1024*1024,
+                 max_disk_bytes=256*1024*1024, verbose=False):
+        '''
+        cache_dir = (string) directory for the disk tier (memory only, if None)
+        ttl = (float) seconds for which responses without validators are used without revalidation
+        max_entries = (int) maximum number of responses in memory
+        max_bytes = (int) maximum total size of response bodies in memory
+        max_disk_bytes = (int) maximum total size of the disk tier
+        '''
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.verbose = verbose
+        self.lock = threading.RLock()
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.disk_urls = {}			# key: url, for disk entries known to this process
+        self.invalidations = []			# (time, fragments), recorded in the disk tier by any process
+        self.invalidations_stat = None
+        self.generation = 0
+        self.nstored = 0
+        self.stats = {'hits': 0, 'revalidated': 0, 'misses': 0}
+        if cache_dir:
+            ensure_dir(cache_dir)
+            self.prune_disk()
+
+    @staticmethod
+    def key(username, url, accept=None):
+        return hashlib.sha1(json.dumps([username, url, accept])).hexdigest()
+
+    def entry_fn(self, key):
+        return os.path.join(self.cache_dir, "%s.resp" % key)
+
+    @property
+    def invalidations_fn(self):
+        return os.path.join(self.cache_dir, "invalidations.json")
+
+    #-----------------------------------------------------------------------------
+    # requests
+
+    def request(self, ea, url, params=None, headers=None, **kwargs):
+        '''
+        GET url (with params), for edXapi instance ea, using the cache; takes the same arguments as
+        ea.request.  Returns a requests Response (for a cached response, made from the cache entry).
+        '''
+        if kwargs.get('stream'):
+            return ea.dispatcher.request(ea.ses, 'GET', url, params=params, headers=headers, **kwargs)
+        headers = dict(headers or {})
+        url = requests.Request('GET', url, params=params).prepare().url
+        key = self.key(ea.username, url, headers.get('Accept'))
+        with self.lock:
+            generation = self.generation
+        entry = self.lookup(key)
+        if entry:
+            if not (entry['etag'] or entry['last_modified']):
+                if time.time() - entry['stored_at'] < self.ttl:
+                    self.count('hits')
+                    return self.make_response(entry)
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+        requested_at = time.time()
+        ret = ea.dispatcher.request(ea.ses, 'GET', url, headers=headers, **kwargs)
+        if ret.status_code==304 and entry:
+            self.count('revalidated')
+            return self.make_response(entry, ret)
+        self.count('misses')
+        if ret.status_code==200:
+            entry = {'url': url,
+                     'etag': ret.headers.get('ETag'),
+                     'last_modified': ret.headers.get('Last-Modified'),
+                     'content_type': ret.headers.get('Content-Type'),
+                     'stored_at': requested_at,
+                     'body': ret.content,
+                     }
+            self.store(key, entry, generation)
+        return ret
+
+    def count(self, what):
+        with self.lock:
+            self.stats[what] += 1
+
+    @staticmethod
+    def make_response(entry, ret=None):
+        '''
+        Return a requests Response for a cache entry; ret is the 304 response, if revalidated
+        '''
+        resp = requests.models.Response()
+        resp.status_code = 200
+        resp.reason = "OK"
+        resp.url = entry['url']
+        resp.headers = CaseInsensitiveDict([(k, v) for (k, v) in [('Content-Type', entry['content_type']),
+                                                                  ('ETag', entry['etag']),
+                                                                  ('Last-Modified', entry['last_modified'])] if v])
+        resp.encoding = requests.utils.get_encoding_from_headers(resp.headers)
+        resp._content = entry['body']
+        resp.request = ret.request if ret is not None else requests.Request('GET', entry['url']).prepare()
+        resp.from_cache = True
+        return resp
+
+    #-----------------------------------------------------------------------------
+    # storage
+
+    def lookup(self, key):
+        '''
+        Return the cache entry for key, from memory, or else from disk (or None)
+        '''
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.entries[key] = entry		# most recently used last
+        if not self.cache_dir:
+            return entry
+        in_memory = entry is not None
+        if not in_memory:
+            entry = self.load(key)
+            if entry is None:
+                return None
+        with self.lock:
+            if self.invalidated_since(entry['url'], entry['stored_at']):
+                if in_memory and self.entries.get(key) is entry:
+                    self.nbytes -= len(self.entries.pop(key)['body'])
+                self.remove_file(key)
+                return None
+            if not in_memory:
+                self.disk_urls[key] = entry['url']
+                self.add(key, entry)
+        return entry
+
+    def store(self, key, entry, generation=None):
+        '''
+        Store entry for key, unless the cache has been invalidated since generation
+        '''
+        with self.lock:
+            if generation is not None and not generation==self.generation:
+                return				# fetched before a change, which may not be reflected
+            self.add(key, entry)
+            if self.cache_dir:
+                self.disk_urls[key] = entry['url']
+                self.nstored += 1
+        if self.cache_dir:
+            self.save(key, entry)
+            if self.nstored % self.PRUNE_EVERY==0:
+                self.prune_disk()
+
+    def add(self, key, entry):
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.nbytes -= len(old['body'])
+        self.entries[key] = entry
+        self.nbytes += len(entry['body'])
+        while self.entries and (len(self.entries) > self.max_entries or self.nbytes > self.max_bytes):
+            k, old = self.entries.popitem(last=False)
+            self.nbytes -= len(old['body'])
+
+    def save(self, key, entry):
+        fn = self.entry_fn(key)
+        meta = dict([(k, v) for (k, v) in entry.items() if not k=='body'])
+        with atomic_write(fn, mode=0600) as fp:
+            fp.write(json.dumps(meta) + '\n')
+            fp.write(entry['body'])
+
+    def load(self, key):
+        fn = self.entry_fn(key)
+        try:
+            with open(fn, 'rb') as fp:
+                entry = json.loads(fp.readline())
+                entry['body'] = fp.read()
+            os.utime(fn, None)			# for LRU pruning
+        except (IOError, OSError, ValueError):
+            return None
+        return entry
+
+    def remove_file(self, key):
+        self.disk_urls.pop(key, None)
+        try:
+            os.unlink(self.entry_fn(key))
+        except OSError:
+            pass
+
+    def prune_disk(self):
+        '''
+        Remove least recently used files from the disk tier, until it is within max_disk_bytes
+        '''
+        files = []
+        for fn in os.listdir(self.cache_dir):
+            if fn.endswith(".resp"):
+                try:
+                    st = os.stat(os.path.join(self.cache_dir, fn))
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, fn))
+        total = sum([x[1] for x in files])
+        for mtime, size, fn in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            with self.lock:
+                self.remove_file(fn[:-len(".resp")])
+            total -= size
+
+    #-----------------------------------------------------------------------------
+    # invalidation
+
+    def invalidate(self, *fragments):
+        '''
+        Drop cached responses whose URL contains any of the given fragments (e.g. a usage key,
+        or "/xblock/outline/"); drop all cached responses, if no fragments are given.
+        '''
+        def matches(url):
+            return not fragments or any([x in url for x in fragments])
+        with self.lock:
+            self.generation += 1
+            for key in [k for (k, entry) in self.entries.items() if matches(entry['url'])]:
+                self.nbytes -= len(self.entries.pop(key)['body'])
+            for key in [k for (k, url) in self.disk_urls.items() if matches(url)]:
+                self.remove_file(key)
+        if self.cache_dir:
+            self.record_invalidation(time.time(), fragments)
+        if self.verbose > 1:
+            print "[ResponseCache] invalidated %s" % (list(fragments) or "all")
+
+    def record_invalidation(self, when, fragments):
+        '''
+        Add an invalidation to the disk tier's list, dropping those older than ttl (after which
+        responses without validators are revalidated anyway)
+        '''
+        fn = self.invalidations_fn
+        with locked(fn):
+            invalidations = [x for x in self.load_invalidations(fn) if x[0] > when - self.ttl]
+            invalidations.append([when, list(fragments)])
+            with atomic_write(fn, mode=0600) as fp:
+                fp.write(json.dumps(invalidations))
+
+    @staticmethod
+    def load_invalidations(fn):
+        try:
+            return json.loads(open(fn).read())
+        except (IOError, ValueError):
+            return []
+
+    def invalidated_since(self, url, when):
+        '''
+        True if url was invalidated, by any process sharing the disk tier, after time when.
+        The list of invalidations is re-read only when the file has been replaced.
+        '''
+        try:
+            st = os.stat(self.invalidations_fn)
+            stat = (st.st_ino, st.st_mtime, st.st_size)
+        except OSError:
+            stat = None
+        with self.lock:
+            if not stat==self.invalidations_stat:
+                self.invalidations = self.load_invalidations(self.invalidations_fn) if stat else []
+                self.invalidations_stat = stat
+            invalidations = self.invalidations
+        for t, fragments in invalidations:
+            if t >= when and (not fragments or any([x in url for x in fragments])):
+                return True
+        return False
+
+#-----------------------------------------------------------------------------
+# unit tests
+
+def test_lru_eviction():
+    rc = ResponseCache(max_entries=3, max_bytes=25)
+    for k in range(4):
+        rc.store("k%d" % k, {'url': "/u%d" % k, 'body': "x" * 5})
+    assert rc.entries.keys()==["k1", "k2", "k3"]
+    rc.lookup("k1")
+    rc.store("k4", {'url': "/u4", 'body': "x" * 12})
+    assert rc.entries.keys()==["k3", "k1", "k4"] and rc.nbytes==22
+    rc.invalidate("/u4")
+    assert rc.entries.keys()==["k3", "k1"] and rc.nbytes==10
+    rc.store("k5", {'url': "/u5", 'body': ""}, generation=0)
+    assert not "k5" in rc.entries		# fetched before the invalidation
+
+def test_disk_invalidation():
+    import shutil
+    cache_dir = "/tmp/edxcut_tmp_response_cache_inv"
+    shutil.rmtree(cache_dir, True)
+    rc1 = ResponseCache(cache_dir)
+    rc1.store("k1", {'url': "/xblock/block1", 'stored_at': time.time(), 'body': "old"})
+    rc1.store("k2", {'url': "/xblock/block2", 'stored_at': time.time(), 'body': "b2"})
+    ResponseCache(cache_dir).invalidate("/xblock/block1")		# by another process
+    rc3 = ResponseCache(cache_dir)
+    assert rc3.lookup("k1") is None and rc3.lookup("k2")['body']=="b2"
+    assert rc1.lookup("k1") is None and rc1.lookup("k2")['body']=="b2"
+    assert not os.path.exists(rc1.entry_fn("k1"))
+    rc3.store("k1", {'url': "/xblock/block1", 'stored_at': time.time(), 'body': "new"})
+    assert ResponseCache(cache_dir).lookup("k1")['body']=="new"
+
+def test_response_cache():
+    import shutil
+    from fake_edx import FakeCourse, FakeEdxServer, fake_api
+    cache_dir = "/tmp/edxcut_tmp_response_cache"
+    shutil.rmtree(cache_dir, True)
+    srv = FakeEdxServer([FakeCourse(assets=5)]).start()
+
+    def nrequests(status, endpoint):
+        return sum([x['status'].get(status, 0) for x in srv.metrics.summary()['requests'] if endpoint in x['endpoint']])
+
+    try:
+        ea = fake_api(srv, response_cache=cache_dir)
+        outline = ea.get_outline()
+        assert ea.get_outline()==outline and nrequests('304', "/xblock/outline/")==1
+        key = ea.create_block_key('problem', 'problem_1')
+        assert ea.get_xblock(usage_key=key)['data']==ea.get_xblock(usage_key=key)['data']
+        ea.update_xblock(usage_key=key, data="<problem>new</problem>")
+        assert ea.get_xblock(usage_key=key)['data']=="<problem>new</problem>"
+        assert nrequests('304', "/xblock/{usage_key}")==1
+        assert len(ea.list_static_assets())==5
+        open("/tmp/edxcut_tmp_asset.txt", 'w').write("hello")
+        ea.upload_static_asset("/tmp/edxcut_tmp_asset.txt")
+        assert len(ea.list_static_assets())==6
+        assert ea.response_cache.stats=={'hits': 0, 'revalidated': 2, 'misses': 5}
+
+        ea2 = fake_api(srv, response_cache=cache_dir)		# disk tier, shared with a later instance
+        assert ea2.get_xblock(usage_key=key)['data']=="<problem>new</problem>"
+        assert nrequests('304', "/xblock/{usage_key}")==2
+
+        srv.etags = False				# no validators: used for ttl seconds
+        ea3 = fake_api(srv, response_cache=True, response_cache_ttl=60)
+        md = ea3.get_course_metadata()
+        assert ea3.get_course_metadata()==md and ea3.response_cache.stats['hits']==1
+        ea3.update_course_metadata({'end_date': "2030-01-01T00:00:00Z"}, single_field=True)
+        assert ea3.get_course_metadata()['end_date']=="2030-01-01T00:00:00Z"
+    finally:
+        srv.stop()
@@ -0,0 +1,134 @@
+'''
+Database of course unit test results, kept in a JSON file, with a fingerprint of what each
+result depends on (the problem's content, the grader library, and the test definition), so
+that incremental runs only re-run the tests for which any of those has changed.
+'''
+
+import os
+import json
+import time
+import hashlib
+
+from file_utils import locked, atomic_write
+
+#-----------------------------------------------------------------------------
+
+def fingerprint(*parts):
+    '''
+    Return hex digest of the JSON serialization of parts
+    '''
+    return hashlib.sha1(json.dumps(parts, sort_keys=True)).hexdigest()
+
+class ResultsDB(object):
+    '''
+    Results of course unit tests, by test set (e.g. test file), problem url_name, and test key
+    (a fingerprint of the test definition, not including its name or position in the test file).
+    Each result records the test's fingerprint when it was run, whether it passed, and the
+    correctness list.  One file may hold the results of several test sets.
+    '''
+    VERSION = 2
+
+    def __init__(self, fn, test_set=None, verbose=False):
+        '''
+        fn = (string) name of the JSON file holding the results
+        test_set = (string) name of the test set (e.g. test file path) whose results this instance reads and writes
+        '''
+        self.fn = fn
+        self.test_set = test_set or ""
+        self.verbose = verbose
+        self.results = self.load().get(self.test_set, {})
+
+    def load(self):
+        '''
+        Return results of all test sets in the file
+        '''
+        if not os.path.exists(self.fn):
+            return {}
+        try:
+            data = json.loads(open(self.fn).read())
+        except Exception as err:
+            print "[ResultsDB] ignoring unreadable results database %s, err=%s" % (self.fn, err)
+            return {}
+        if not data.get('version')==self.VERSION:
+            return {}
+        return data.get('results', {})
+
+    @staticmethod
+    def test_key(test):
+        '''
+        Return key for an AnswerBoxUnitTest, from its definition
+        '''
+        return fingerprint(test.url_name, test.responses, test.expected, [list(x) for x in test.box_indexes])
+
+    def lookup(self, test, fp):
+        '''
+        Return the stored result for test, if it was run with fingerprint fp, and gave a verdict
+        (else None)
+        '''
+        if fp is None:
+            return None
+        result = self.results.get(test.url_name, {}).get(self.test_key(test))
+        if result and result['fingerprint']==fp and result.get('correctness_list') is not None:
+            return result
+        return None
+
+    def make_results(self, tests, fingerprints, rets):
+        '''
+        Return new results dict, for tests (list of AnswerBoxUnitTest), which had the given fingerprints,
+        and test_problem return dicts.  Results for tests no longer present are dropped.
+        '''
+        results = {}
+        now = time.time()
+        for test, fp, ret in zip(tests, fingerprints, rets):
+            if ret.get('cached'):
+                result = self.results[test.url_name][self.test_key(test)]
+            else:
+                result = {'fingerprint': fp,
+                          'ok': ret['ok'],
+                          'correctness_list': ret['correctness_list'],
+                          'ran_at': now,
+                          }
+            results.setdefault(test.url_name, {})[self.test_key(test)] = result
+        return results
+
+    def save(self, tests, fingerprints, rets):
+        '''
+        Replace the stored results of this test set with those of a run (see make_results), and write them
+        to the file, keeping those of other test sets
+        '''
+        self.results = self.make_results(tests, fingerprints, rets)
+        with locked(self.fn):
+            all_results = self.load()
+            all_results[self.test_set] = self.results
+            with atomic_write(self.fn) as fp:
+                fp.write(json.dumps({'version': self.VERSION, 'saved_at': time.time(), 'results': all_results}))
+        if self.verbose:
+            print "[ResultsDB] saved %d test results to %s" % (len(tests), self.fn)
+
+#-----------------------------------------------------------------------------
+# unit tests
+
+def test_results_db():
+    from course_tests import AnswerBoxUnitTest
+    fn = "/tmp/edxcut_tmp_results.json"
+    if os.path.exists(fn):
+        os.unlink(fn)
+    t1 = AnswerBoxUnitTest({'url_name': "p1", 'responses': ["1"], 'expected': "correct"}, 1)
+    t2 = AnswerBoxUnitTest({'url_name': "p1", 'responses': ["2"], 'expected': "incorrect"}, 2)
+    t3 = AnswerBoxUnitTest({'url_name': "p2", 'responses': ["3"], 'expected': "correct"}, 3)
+    rdb = ResultsDB(fn)
+    rdb.save([t1, t2, t3], ["a", "b", "c"], [{'ok': True, 'correctness_list': ["correct"]},
+                                             {'ok': False, 'correctness_list': ["correct"]},
+                                             {'ok': False, 'correctness_list': None}])
+    rdb = ResultsDB(fn)
+    assert rdb.lookup(t1, "a")['ok'] and not rdb.lookup(t2, "b")['ok']
+    assert rdb.lookup(t1, "x") is None			# changed since
+    assert rdb.lookup(t3, "c") is None			# no verdict
+    t1.name = "renamed"
+    assert rdb.lookup(t1, "a")
+    rdb.save([t1], ["a"], [{'cached': True}])
+    assert rdb.results.keys()==["p1"] and len(rdb.results["p1"])==1
+    rdb2 = ResultsDB(fn, test_set="other.yaml")			# another test file, sharing the database
+    assert rdb2.lookup(t1, "a") is None
+    rdb2.save([t3], ["c"], [{'ok': True, 'correctness_list': ["correct"]}])
+    assert ResultsDB(fn).lookup(t1, "a") and ResultsDB(fn, test_set="other.yaml").lookup(t3, "c")
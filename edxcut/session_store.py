@@ -0,0 +1,165 @@
+'''
+On-disk store of logged-in edX site sessions (cookies and CSRF token), so that
+separate edxcut runs against the same site and user can skip the login sequence.
+'''
+
+import os
+import json
+import time
+import hashlib
+import requests
+
+from file_utils import locked, atomic_write
+
+#-----------------------------------------------------------------------------
+
+class SessionStore(object):
+    '''
+    Store of authenticated sessions, one file per (site base URL, username), in a directory.
+
+    A stored session is reused if one request, for a page which requires login, succeeds
+    with it; otherwise a full login is done, and the new session stored.  A lock file per
+    session serializes this among concurrent processes, so that only one of them logs in,
+    and the rest reuse its session.
+
+    Session files hold live credentials, so they (and the directory) are only readable by
+    the owner.
+    '''
+    DEFAULT_DIR = os.path.join(os.path.expanduser("~"), ".edxcut", "sessions")
+
+    def __init__(self, session_dir=None, verbose=False):
+        '''
+        session_dir = (string) directory in which to keep session files (default ~/.edxcut/sessions)
+        '''
+        self.session_dir = session_dir or self.DEFAULT_DIR
+        self.verbose = verbose
+
+    def session_fn(self, base, username):
+        key = hashlib.sha1(json.dumps([base.rstrip('/'), username])).hexdigest()
+        return os.path.join(self.session_dir, "session_%s.json" % key)
+
+    @staticmethod
+    def cookie_to_dict(cookie):
+        return {'name': cookie.name,
+                'value': cookie.value,
+                'domain': cookie.domain,
+                'path': cookie.path,
+                'secure': cookie.secure,
+                'expires': cookie.expires,
+                'rest': cookie._rest,
+                }
+
+    def save(self, ea):
+        '''
+        Store the session of the logged in edXapi instance ea
+        '''
+        fn = self.session_fn(ea.BASE, ea.username)
+        data = {'base': ea.BASE,
+                'username': ea.username,
+                'saved_at': time.time(),
+                'csrf': getattr(ea, 'csrf', None),
+                'headers': getattr(ea, 'headers', {}),
+                'cookies': [self.cookie_to_dict(x) for x in ea.ses.cookies],
+                }
+        with atomic_write(fn, mode=0600) as fp:
+            fp.write(json.dumps(data))
+        if self.verbose:
+            print "[SessionStore] saved session for %s at %s to %s" % (ea.username, ea.BASE, fn)
+
+    def restore(self, ea):
+        '''
+        Load the stored session (if any) for ea's site and username into ea.
+        Returns True if a session was loaded.
+        '''
+        fn = self.session_fn(ea.BASE, ea.username)
+        if not os.path.exists(fn):
+            return False
+        try:
+            data = json.loads(open(fn).read())
+        except Exception as err:
+            if self.verbose:
+                print "[SessionStore] ignoring unreadable session file %s, err=%s" % (fn, err)
+            return False
+        now = time.time()
+        for cdat in data['cookies']:
+            if cdat.get('expires') and cdat['expires'] < now:
+                continue
+            ea.ses.cookies.set_cookie(requests.cookies.create_cookie(**cdat))
+        ea.csrf = data.get('csrf')
+        ea.headers = data.get('headers') or {}
+        return True
+
+    def is_valid(self, ea):
+        '''
+        Return True if ea's session is still logged in, as judged by one request for a page
+        which redirects to the login page if not (the response body is not read).
+        '''
+        url = '%s/%s' % (ea.BASE, "home/" if ea.is_studio else "dashboard")
+        try:
+            ret = ea.request('GET', url, allow_redirects=False, stream=True)
+            ret.close()
+        except Exception as err:
+            if self.verbose:
+                print "[SessionStore] failed to check session at %s, err=%s" % (url, err)
+            return False
+        if self.verbose:
+            print "[SessionStore] session check %s -> %s" % (url, ret.status_code)
+        return ret.status_code==200
+
+    def login(self, ea, username, pw):
+        '''
+        Log ea in, reusing the stored session if it is still valid, and otherwise doing a full
+        login (ea.login), and storing the new session.  Returns the result of ea.login, or True.
+        '''
+        fn = self.session_fn(ea.BASE, username)
+        with locked(fn):
+            if self.restore(ea) and self.is_valid(ea):
+                if self.verbose:
+                    print "[SessionStore] reusing stored session for %s at %s" % (username, ea.BASE)
+                ea.login_ok = True
+                return True
+            ea.ses.cookies.clear()
+            ret = ea.login(username, pw)
+            if ea.login_ok:
+                self.save(ea)
+            return ret
+
+    def forget(self, base, username):
+        '''
+        Delete the stored session for the given site and username
+        '''
+        fn = self.session_fn(base, username)
+        with locked(fn):
+            if os.path.exists(fn):
+                os.unlink(fn)
+
+#-----------------------------------------------------------------------------
+# unit tests
+
+def test_session_store_roundtrip():
+    import shutil
+    class FakeEA(object):
+        BASE = "http://localhost:18010"
+        username = "staff@example.com"
+        csrf = "abc"
+        headers = {'X-CSRFToken': "abc"}
+        def __init__(self):
+            self.ses = requests.Session()
+    sdir = "/tmp/edxcut_tmp_sessions"
+    shutil.rmtree(sdir, True)
+    ss = SessionStore(sdir)
+    ea = FakeEA()
+    ea.ses.cookies.set('csrftoken', 'abc', domain='localhost.local', path='/')
+    ea.ses.cookies.set('sessionid', 'xyz', domain='localhost.local', path='/')
+    ea.ses.cookies.set('old', 'gone', domain='localhost.local', path='/', expires=1)
+    with locked(ss.session_fn(ea.BASE, ea.username)):
+        ss.save(ea)
+    assert oct(os.stat(ss.session_fn(ea.BASE, ea.username)).st_mode & 0777)=='0600'
+    ea2 = FakeEA()
+    ea2.csrf = ea2.headers = None
+    assert ss.restore(ea2)
+    assert ea2.ses.cookies.get('sessionid')=='xyz'
+    assert 'old' not in ea2.ses.cookies
+    assert ea2.csrf=="abc" and ea2.headers['X-CSRFToken']=="abc"
+    ss.forget(ea.BASE, ea.username)
+    assert not ss.restore(FakeEA())
@@ -0,0 +1,97 @@
+'''
+On-disk profile of what has been learned about an edX site (e.g. how the LMS numbers the
+ids of answer box status elements), so that later edxcut runs against the site can start
+from it, instead of discovering it again.
+'''
+
+import os
+import json
+import time
+import hashlib
+
+from file_utils import locked, atomic_write
+
+#-----------------------------------------------------------------------------
+
+class SiteProfile(object):
+    '''
+    Profile of an edX site: a dict of JSON-serializable values, kept in one file per site
+    base URL, in a directory.
+
+    Values changed with set are written by save, which re-reads the file (holding a lock
+    shared with other processes), so that values stored meanwhile by other runs, under
+    other keys, are kept.
+    '''
+    DEFAULT_DIR = os.path.join(os.path.expanduser("~"), ".edxcut", "sites")
+
+    def __init__(self, base, profile_dir=None, verbose=False):
+        '''
+        base = (string) site base URL, e.g. https://courses.edx.org
+        profile_dir = (string) directory in which to keep site profiles (default ~/.edxcut/sites)
+        '''
+        self.base = base.rstrip('/')
+        self.profile_dir = profile_dir or self.DEFAULT_DIR
+        self.verbose = verbose
+        self.changed = set()
+        self.data = self.load()
+
+    @property
+    def profile_fn(self):
+        key = hashlib.sha1(self.base).hexdigest()
+        return os.path.join(self.profile_dir, "site_%s.json" % key)
+
+    def load(self):
+        fn = self.profile_fn
+        if not os.path.exists(fn):
+            return {}
+        try:
+            data = json.loads(open(fn).read())
+        except Exception as err:
+            if self.verbose:
+                print "[SiteProfile] ignoring unreadable site profile %s, err=%s" % (fn, err)
+            return {}
+        return data.get('profile', {})
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, value):
+        if not self.data.get(key)==value:
+            self.data[key] = value
+            self.changed.add(key)
+
+    def save(self):
+        '''
+        Write the values changed since loading to the profile file (if any were changed)
+        '''
+        if not self.changed:
+            return
+        fn = self.profile_fn
+        with locked(fn):
+            data = self.load()
+            for key in self.changed:
+                data[key] = self.data[key]
+            with atomic_write(fn, mode=0600) as fp:
+                fp.write(json.dumps({'base': self.base, 'saved_at': time.time(), 'profile': data}, indent=2))
+        self.data = data
+        self.changed = set()
+        if self.verbose:
+            print "[SiteProfile] saved profile for %s to %s" % (self.base, fn)
+
+#-----------------------------------------------------------------------------
+# unit tests
+
+def test_site_profile():
+    import shutil
+    pdir = "/tmp/edxcut_tmp_sites"
+    shutil.rmtree(pdir, True)
+    sp1 = SiteProfile("http://localhost:18010/", pdir)
+    sp2 = SiteProfile("http://localhost:18010", pdir)
+    assert sp1.profile_fn==sp2.profile_fn
+    sp1.set('a', [1, 1])
+    sp2.set('b', {'problem_1': [2, 1]})
+    sp1.save()
+    sp2.save()
+    assert sp2.data=={'a': [1, 1], 'b': {'problem_1': [2, 1]}}
+    assert SiteProfile("http://localhost:18010", pdir).get('a')==[1, 1]
+    assert SiteProfile("http://localhost:18011", pdir).data=={}
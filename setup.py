@@ -25,7 +25,7 @@ setup(
                       'pysrt',
                       ],
     package_dir={'edxcut': 'edxcut'},
-    package_data={},
+    package_data={'edxcut': ['benchmarks_baseline.json']},
     # data_files = data_files,
     # test_suite="edxcut.test",
 )